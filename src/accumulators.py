@@ -0,0 +1,103 @@
+import torch
+
+class PredictionBuffer():
+    ''' Preallocated per-sample buffers, filled batch by batch during evaluation.
+    Replaces growing tensors with torch.cat (quadratic copying). Buffers stay on the device,
+    so filling them does not synchronize with the host.
+    '''
+
+    def __init__(self, num_samples:int, device):
+        ''' Creates empty buffers, the columns are allocated with the first batch.
+
+        Arguments:
+            self: The PredictionBuffer object itself.
+            num_samples: Number of samples of the evaluated dataset.
+            device: Hardware the buffers are allocated on.
+        Return:
+            The class constructor returns a "PredictionBuffer" object.
+        '''
+
+        self.num_samples = num_samples
+        self.device = device
+        self.columns = {}
+        self.position = 0
+
+    def add(self, **batch_columns) -> None:
+        ''' Writes the values of one batch into the buffers, floating point values are stored as float32.
+
+        Arguments:
+            self: The PredictionBuffer object.
+            batch_columns: Tensors of the batch by column name, first dimension is the batch size.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        batch_size = next(iter(batch_columns.values())).shape[0]
+        for name, values in batch_columns.items():
+            if name not in self.columns:
+                dtype = torch.float32 if values.is_floating_point() else values.dtype
+                self.columns[name] = torch.empty((self.num_samples,) + tuple(values.shape[1:]), dtype=dtype, device=self.device)
+            self.columns[name][self.position:self.position + batch_size] = values.detach()
+        self.position += batch_size
+
+    def __contains__(self, name:str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name:str) -> torch.Tensor:
+        return self.columns[name][:self.position]
+
+    def numpy(self, name:str):
+        return self[name].cpu().numpy()
+
+class SampleReservoir():
+    ''' Keeps a bounded, uniformly drawn subset of samples of a stream (reservoir sampling, Algorithm R).
+    Used to retain some full inputs and outputs for consumers like the example image export,
+    without keeping every input of a dataset in memory. The kept samples are stored on the CPU.
+    '''
+
+    def __init__(self, capacity:int, seed:int=18):
+        ''' Creates an empty reservoir.
+
+        Arguments:
+            self: The SampleReservoir object itself.
+            capacity: Maximum number of samples kept.
+            seed: Seed of the random generator, the selection is deterministic for a given stream.
+        Return:
+            The class constructor returns a "SampleReservoir" object.
+        '''
+
+        self.capacity = capacity
+        self.generator = torch.Generator().manual_seed(seed)
+        self.num_seen = 0
+        self.slots = [None] * capacity
+
+    def add(self, *batch_tensors) -> None:
+        ''' Offers the samples of one batch to the reservoir.
+
+        Arguments:
+            self: The SampleReservoir object.
+            batch_tensors: Tensors of the batch (e.g. inputs and outputs), first dimension is the batch size.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        batch_size = batch_tensors[0].shape[0]
+        positions = torch.arange(self.num_seen, self.num_seen + batch_size)
+        # Sample i of the stream replaces a random slot with probability capacity / (i + 1)
+        slots = torch.floor(torch.rand(batch_size, generator=self.generator) * (positions + 1)).long()
+        slots = torch.where(positions < self.capacity, positions, slots)
+
+        for i in torch.nonzero(slots < self.capacity).flatten().tolist():
+            self.slots[slots[i]] = (int(positions[i]),) + tuple(tensor[i].detach().float().cpu() for tensor in batch_tensors)
+        self.num_seen += batch_size
+
+    def samples(self) -> list:
+        ''' Gets the kept samples ordered by their position in the stream.
+
+        Arguments:
+            self: The SampleReservoir object.
+        Return:
+            List of tuples (position, tensors of the sample ...).
+        '''
+
+        return sorted((sample for sample in self.slots if sample is not None), key=lambda sample: sample[0])
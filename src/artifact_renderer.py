@@ -0,0 +1,183 @@
+import os
+import atexit
+import traceback
+import torch
+import numpy as np
+import torchvision.transforms as T
+import skimage
+
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Values of config['artifact_rendering']
+RENDERING_BACKGROUND = 'background'
+RENDERING_INLINE = 'inline'
+RENDERING_OFF = 'off'
+
+# Font sizes of the plots
+TITLE_FONTSIZE = 14
+AXIS_LABEL_FONTSIZE = 12
+TICK_LABEL_FONTSIZE = 10
+
+def save_figure(figure:Figure, path:Path) -> None:
+    # The object-oriented API with its own canvas does not touch the global pyplot state, so figures can be rendered in any thread.
+    FigureCanvasAgg(figure)
+    figure.savefig(path)
+
+def render_loss_distribution_plot(path:Path, auto_encoder_losses:np.ndarray, classifier_losses:np.ndarray, colors:np.ndarray) -> None:
+    ''' Renders the scatter plot of the autoencoder loss against the classifier loss of every sample.
+
+    Arguments:
+        path: Location of the PNG file.
+        auto_encoder_losses: Autoencoder loss per sample.
+        classifier_losses: Classifier loss per sample.
+        colors: Color per sample (green: correctly classified, red: misclassified).
+    Return:
+        This Method has nothing to return.
+    '''
+
+    figure = Figure(figsize=(10, 6))
+    axes = figure.add_subplot()
+    axes.scatter(auto_encoder_losses, classifier_losses, alpha=0.5, c=colors)
+    axes.set_title('Loss Pair Distribution of Classifier vs Autoencoder', fontsize=TITLE_FONTSIZE)
+    axes.set_xlabel('Autoencoder Loss', fontsize=AXIS_LABEL_FONTSIZE)
+    axes.set_ylabel('Classifier Loss', fontsize=AXIS_LABEL_FONTSIZE)
+    axes.tick_params(labelsize=TICK_LABEL_FONTSIZE)
+    axes.grid(True)
+    save_figure(figure, path)
+
+def render_risk_coverage_curve(path:Path, proportions:np.ndarray, average_losses:np.ndarray) -> None:
+    ''' Renders the average classifier loss of the samples with the lowest autoencoder loss over their proportion.
+
+    Arguments:
+        path: Location of the PNG file.
+        proportions: Proportions of samples kept.
+        average_losses: Average classifier loss per proportion.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    figure = Figure(figsize=(10, 6))
+    axes = figure.add_subplot()
+    axes.plot(proportions, average_losses)
+    axes.set_xlabel('Proportion of Samples with Lowest MAE', fontsize=AXIS_LABEL_FONTSIZE)
+    axes.set_ylabel('Average Classifier Loss', fontsize=AXIS_LABEL_FONTSIZE)
+    axes.tick_params(labelsize=TICK_LABEL_FONTSIZE)
+    axes.set_title('Relationship between MAE and Classifier Loss', fontsize=TITLE_FONTSIZE)
+    axes.grid(True)
+    save_figure(figure, path)
+
+def render_auto_encoder_samples(img_dir:Path, positions:np.ndarray, images_in:np.ndarray, images_pred:np.ndarray) -> None:
+    ''' Renders input, blurred input, output, absolute difference and a superpixel segmentation
+    of the difference for example samples of an autoencoder.
+
+    Arguments:
+        img_dir: Directory the PNG files are stored in.
+        positions: Position of every sample in the dataset, used as file name prefix.
+        images_in: First channel of the inputs, shape (N, H, W).
+        images_pred: First channel of the outputs, shape (N, H, W).
+    Return:
+        This Method has nothing to return.
+    '''
+
+    os.makedirs(img_dir, exist_ok=True)
+    blur = T.GaussianBlur(kernel_size=(5,5), sigma=(2,2))
+
+    for i, image_slice_in, image_slice_pred in zip(positions, torch.from_numpy(images_in), torch.from_numpy(images_pred)):
+        # with blurring:
+        image_slice_in_blur = blur(image_slice_in.unsqueeze(0)).squeeze(0)
+
+        images_max = max(image_slice_in.max(), image_slice_pred.max())
+        images_min = min(image_slice_in.min(), image_slice_pred.min())
+        image_in = (255 * (image_slice_in - images_min) / (images_max - images_min)).clamp(0, 255).byte()
+        image_in_blur = (255 * (image_slice_in_blur - images_min) / (images_max - images_min)).clamp(0, 255).byte()
+        image_out = (255 * (image_slice_pred - images_min) / (images_max - images_min)).clamp(0, 255).byte()
+
+        # Save the image as a PNG file
+        Image.fromarray(image_in.numpy(), mode='L').save(img_dir / f"{i}_input.png", "PNG")
+        Image.fromarray(image_in_blur.numpy(), mode='L').save(img_dir / f"{i}_input_blur.png", "PNG")
+        Image.fromarray(image_out.numpy(), mode='L').save(img_dir / f"{i}_output.png", "PNG")
+
+        # Print absolute difference of input and output
+        abs_diff = torch.abs(torch.subtract(image_slice_in, image_slice_pred))
+        abs_diff = (255 * (abs_diff - images_min) / (images_max - images_min)).clamp(0, 255).byte()
+        #Alternative min and max values when normalizing for range 0 to 255
+        #abs_diff = (255 * (abs_diff - abs_diff.min()) / (abs_diff.max() - abs_diff.min())).clamp(0, 255).byte()
+        abs_diff_image = abs_diff.numpy()
+        Image.fromarray(np.uint8(abs_diff_image), mode='L').save(img_dir / f"{i}_absdiff.png")
+
+        segments = skimage.segmentation.slic(abs_diff_image, n_segments=8, compactness=0.03, channel_axis=None)
+        segmentation_overlay = skimage.color.label2rgb(segments, image=abs_diff_image, kind='overlay')
+        Image.fromarray(np.uint8(segmentation_overlay * 255)).save(img_dir / f"{i}_segmentation.png")
+
+class ArtifactRenderer():
+    ''' Renders plots and example images (PNG files) of the evaluation in background threads,
+    so the evaluation returns as soon as the metrics are computed. Render jobs only receive compact
+    NumPy arrays, never models or tensors on the GPU.
+    '''
+
+    def __init__(self, mode:str=RENDERING_BACKGROUND, max_workers:int=2):
+        ''' Creates the renderer.
+
+        Arguments:
+            self: The ArtifactRenderer object itself.
+            mode: RENDERING_BACKGROUND (thread pool), RENDERING_INLINE (in the calling thread) or RENDERING_OFF (nothing is rendered).
+            max_workers: Number of render threads.
+        Return:
+            The class constructor returns a "ArtifactRenderer" object.
+        '''
+
+        if mode not in [RENDERING_BACKGROUND, RENDERING_INLINE, RENDERING_OFF]:
+            raise ValueError('Unknown artifact rendering mode "' + str(mode) + '".')
+
+        self.mode = mode
+        self.futures = []
+        self.executor = None
+        if self.mode == RENDERING_BACKGROUND:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ArtifactRenderer')
+            atexit.register(self.flush)
+
+    def submit(self, render_function, *args) -> None:
+        ''' Requests to render an artifact.
+
+        Arguments:
+            self: The ArtifactRenderer object.
+            render_function: Function writing the artifact, e.g. render_risk_coverage_curve.
+            args: Arguments passed to the function (paths and NumPy arrays).
+        Return:
+            This Method has nothing to return.
+        '''
+
+        if self.mode == RENDERING_OFF:
+            return
+        if self.mode == RENDERING_INLINE:
+            render_function(*args)
+            return
+
+        future = self.executor.submit(render_function, *args)
+        future.add_done_callback(self._report_error)
+        self.futures = [pending for pending in self.futures if not pending.done()] + [future]
+
+    def flush(self) -> None:
+        ''' Blocks until all requested artifacts are rendered.
+
+        Arguments:
+            self: The ArtifactRenderer object.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        for future in self.futures:
+            future.exception()
+        self.futures = []
+
+    @staticmethod
+    def _report_error(future) -> None:
+        # A failed plot must not stop training, the error is only printed.
+        error = future.exception()
+        if error is not None:
+            print('Rendering artifact failed:')
+            traceback.print_exception(type(error), error, error.__traceback__)
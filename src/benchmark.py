@@ -0,0 +1,129 @@
+import os
+import time
+import torch
+import argparse
+import numpy as np
+
+from utils import Utils
+from config import NAME_CONFIG_FILE_STANDARD
+from compilation import compile_model, get_input_channels
+from export import PreprocessedModel, load_exported_model
+
+from models.model_resnet_autenc import ResNet18
+from models.model_vgg19_autenc import VGG19
+from models.model_unet1 import UNetWithoutSkips1
+from models.model_unet2 import UNetWithoutSkips2
+from models.model_mobilenet import MobileNetV3Small
+
+# Models benchmarked on CPU, the UNets are benchmarked as full encoder-decoder networks.
+BENCHMARK_MODELS = {
+    'ResNet18': lambda config: ResNet18(config, 0),
+    'VGG19': lambda config: VGG19(config, 0),
+    'UNetWithoutSkips1': lambda config: UNetWithoutSkips1(config),
+    'UNetWithoutSkips2': lambda config: UNetWithoutSkips2(config),
+    'MobileNetV3Small': lambda config: MobileNetV3Small(config, 0),
+}
+
+def measure_latency(model, inputs, iterations:int, warm_up:int=2) -> float:
+    ''' Measures the median latency of a forward pass in inference mode.
+
+    Arguments:
+        model: The model to run.
+        inputs: Batch given to the model.
+        iterations: Number of timed forward passes.
+        warm_up: Number of untimed forward passes before timing.
+    Return:
+        Median duration of a forward pass in seconds.
+    '''
+
+    durations = []
+    with torch.inference_mode():
+        for i in range(warm_up + iterations):
+            start = time.perf_counter()
+            model(inputs)
+            if i >= warm_up:
+                durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+def benchmark_compile(model_names:list, batch_size:int, iterations:int) -> None:
+    ''' Compares eager and compiled execution as well as both memory formats on CPU.
+
+    Arguments:
+        model_names: Keys of BENCHMARK_MODELS to run.
+        batch_size: Batch size of the random input.
+        iterations: Number of timed forward passes per variant.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    device = torch.device('cpu')
+    config = Utils.read_json('./src/' + NAME_CONFIG_FILE_STANDARD)
+    config['pretrained'] = False
+
+    print('Threads:', torch.get_num_threads(), '- Batch size:', batch_size)
+    print('{:<20} {:<10} {:<15} {:>12} {:>10}'.format('Model', 'Mode', 'Memory format', 'Latency [ms]', 'Speedup'))
+    for model_name in model_names:
+        latency_eager = None
+        for compiled in [False, True]:
+            for channels_last in [False, True]:
+                config['channels_last'] = channels_last
+                memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+                model = BENCHMARK_MODELS[model_name](config).to(device, memory_format=memory_format).eval()
+                inputs = torch.rand(batch_size, get_input_channels(model), 224, 224).to(memory_format=memory_format)
+                if compiled:
+                    model = compile_model(model, model_name, device, config)
+
+                latency = measure_latency(model, inputs, iterations)
+                if latency_eager is None:
+                    latency_eager = latency
+                print('{:<20} {:<10} {:<15} {:>12.1f} {:>9.2f}x'.format(model_name, 'compiled' if compiled else 'eager', 'channels_last' if channels_last else 'contiguous', latency * 1000, latency_eager / latency))
+                torch._dynamo.reset()
+
+def benchmark_runtimes(artifacts:list, batch_sizes:list, thread_counts:list, iterations:int, image_size:int) -> None:
+    ''' Measures latency and throughput of exported models (see export.py) on CPU per batch size and number of intra-op threads.
+    Names of BENCHMARK_MODELS are benchmarked as eager baseline with the same folded preprocessing and random weights.
+
+    Arguments:
+        artifacts: Paths of TorchScript or ONNX artifacts and/or keys of BENCHMARK_MODELS.
+        batch_sizes: Batch sizes of the random frames.
+        thread_counts: Numbers of intra-op threads.
+        iterations: Number of timed forward passes per variant.
+        image_size: Height and width of the random frames, must match the frame size of the artifacts.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    config = Utils.read_json('./src/' + NAME_CONFIG_FILE_STANDARD)
+    config.update(pretrained=False, channels_last=False)
+
+    print('{:<40} {:>8} {:>6} {:>13} {:>14}'.format('Model', 'Threads', 'Batch', 'Latency [ms]', 'Frames/s'))
+    for artifact in artifacts:
+        for num_threads in thread_counts:
+            if artifact in BENCHMARK_MODELS:
+                torch.set_num_threads(num_threads)
+                model = PreprocessedModel(BENCHMARK_MODELS[artifact](config).eval(), (image_size, image_size)).eval()
+            else:
+                model = load_exported_model(artifact, num_threads)
+
+            for batch_size in batch_sizes:
+                inputs = torch.rand(batch_size, image_size, image_size) * 65535
+                latency = measure_latency(model, inputs, iterations)
+                print('{:<40} {:>8} {:>6} {:>13.1f} {:>14.1f}'.format(os.path.basename(artifact), num_threads, batch_size, latency * 1000, batch_size / latency))
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Benchmark eager against compiled models or exported runtimes on CPU')
+    args.add_argument('-m', '--models', default=','.join(BENCHMARK_MODELS), type=str, help='comma separated models to benchmark (default: all)')
+    args.add_argument('-bs', '--batch_size', default=8, type=int, help='batch size (default: 8)')
+    args.add_argument('-it', '--iterations', default=10, type=int, help='timed forward passes per variant (default: 10)')
+    args.add_argument('-a', '--artifacts', default=None, type=str, help='comma separated exported artifacts or models, benchmarks the runtimes instead')
+    args.add_argument('-bss', '--batch_sizes', default='1,2,4,8,16,32,64,128,256', type=str, help='comma separated batch sizes of the runtime benchmark')
+    args.add_argument('-th', '--threads', default=None, type=str, help='comma separated intra-op thread counts (default: powers of 2 up to all cores)')
+    args.add_argument('-is', '--image_size', default=224, type=int, help='frame size of the runtime benchmark (default: 224)')
+    args = args.parse_args()
+
+    if args.artifacts:
+        thread_counts = [int(t) for t in args.threads.split(',')] if args.threads else [2**i for i in range(int(np.log2(os.cpu_count())) + 1)]
+        benchmark_runtimes(args.artifacts.split(','), [int(bs) for bs in args.batch_sizes.split(',')], thread_counts, args.iterations, args.image_size)
+    else:
+        benchmark_compile(args.models.split(','), args.batch_size, args.iterations)
@@ -0,0 +1,193 @@
+import json
+import argparse
+import numpy as np
+import multiprocessing
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from logit_cache import LogitCache, SPLIT_TEST
+from metrics import metrics_from_confusion_matrix, auc_one_vs_rest, METRIC_NAMES
+from selective_prediction import area_under_risk_coverage
+
+# Bootstrap confidence intervals of the test metrics from cached predictions (see logit_cache.py). Frames of a
+# pullback are correlated, so whole pullbacks are resampled (cluster bootstrap): a resample is a vector of counts
+# per pullback, all resamples are one (B, P) count matrix and the metrics are computed for many resamples at once.
+
+FILE_NAME_BOOTSTRAP_RESULTS = 'test_results_bootstrap.json'
+
+# Metric names of Logger.printer, followed by ROC AUC and AURC
+BOOTSTRAP_METRICS = {
+    'loss': 'Loss', 'accuracy': 'Accuracy', 'sensitivity': 'Sensitivity', 'specificity': 'Specificity', 'f1': 'F1',
+    'bacc': 'BACC', 'mcc': 'MCC', 'precision': 'Prec.', 'roc_auc': 'ROC AUC', 'aurc': 'AURC',
+}
+
+def pullback_resample_counts(num_pullbacks:int, num_resamples:int, seed:int=18) -> np.ndarray:
+    ''' Draws the pullback resamples, each draws num_pullbacks pullbacks with replacement.
+
+    Arguments:
+        num_pullbacks: Number of pullbacks P.
+        num_resamples: Number of resamples B.
+        seed: Seed of the random generator.
+    Return:
+        How often every pullback is drawn per resample, shape (B, P).
+    '''
+
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(num_pullbacks, np.full(num_pullbacks, 1.0 / num_pullbacks), size=num_resamples)
+
+def compact_predictions(records:np.ndarray, pullbacks:np.ndarray) -> dict:
+    ''' Gets the arrays of a prediction store needed for the bootstrap, as plain arrays to send them to worker processes.
+
+    Arguments:
+        records: Prediction store of a classifier (see prediction_store.py).
+        pullbacks: Sorted names of all pullbacks, the pullbacks of the records are indexed in it.
+    Return:
+        Dictionary with "logits", "labels", "losses", "confidences" and the "pullback_ids" of every frame.
+    '''
+
+    return {
+        'logits': np.asarray(records['logits'], dtype=np.float32),
+        'labels': np.asarray(records['label'], dtype=np.int64),
+        'losses': np.asarray(records['ce_loss'], dtype=np.float64),
+        'confidences': np.asarray(records['softmax'], dtype=np.float64).max(axis=1),
+        'pullback_ids': np.searchsorted(pullbacks, records['pullback']),
+    }
+
+def resample_metrics(predictions:dict, counts:np.ndarray) -> dict:
+    ''' Computes the metrics of the predictions of one model for a chunk of pullback resamples.
+    Confusion matrices and losses are summed per pullback once and weighted with the counts in a matrix product,
+    ROC AUC and AURC weight every frame with the count of its pullback.
+
+    Arguments:
+        predictions: Predictions of the frames, see compact_predictions.
+        counts: How often every pullback is drawn per resample, shape (B, P).
+    Return:
+        Dictionary with the BOOTSTRAP_METRICS of shape (B,).
+    '''
+
+    logits, labels, pullback_ids = predictions['logits'], predictions['labels'], predictions['pullback_ids']
+    num_out = logits.shape[1]
+    num_pullbacks = counts.shape[1]
+    cells = pullback_ids * num_out**2 + labels * num_out + logits.argmax(axis=1)
+    pullback_conf_matrices = np.bincount(cells, minlength=num_pullbacks * num_out**2).reshape(num_pullbacks, num_out**2)
+    conf_matrices = (counts @ pullback_conf_matrices).reshape(-1, num_out, num_out)
+
+    results = {name: values for name, values in metrics_from_confusion_matrix(conf_matrices).items() if name in METRIC_NAMES}
+    pullback_losses = np.bincount(pullback_ids, weights=predictions['losses'], minlength=num_pullbacks)
+    pullback_frames = np.bincount(pullback_ids, minlength=num_pullbacks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        results['loss'] = (counts @ pullback_losses) / (counts @ pullback_frames)
+
+    sample_weight = counts[:, pullback_ids]
+    roc_auc = auc_one_vs_rest(logits, labels, num_out, sample_weight)
+    results['roc_auc'] = roc_auc[:, 1] if num_out == 2 else np.nanmean(roc_auc, axis=1)
+    errors = logits.argmax(axis=1) != labels
+    results['aurc'] = area_under_risk_coverage(predictions['confidences'], errors, sample_weight)
+    return results
+
+def fold_average_metrics(fold_predictions:list, counts:np.ndarray) -> dict:
+    ''' Computes the metrics of every fold for a chunk of resamples and averages them over the folds like
+    the averaged test results of main.py. Runs in the worker processes.
+
+    Arguments:
+        fold_predictions: Predictions of every fold, see compact_predictions.
+        counts: How often every pullback is drawn per resample, shape (B, P).
+    Return:
+        Dictionary with the BOOTSTRAP_METRICS of shape (B,).
+    '''
+
+    fold_results = [resample_metrics(predictions, counts) for predictions in fold_predictions]
+    return {name: np.mean([results[name] for results in fold_results], axis=0) for name in BOOTSTRAP_METRICS}
+
+def bootstrap_confidence_intervals(fold_records:list, num_resamples:int=1000, confidence_level:float=0.95,
+                                   seed:int=18, num_workers:int=4, chunk_size:int=100) -> dict:
+    ''' Computes percentile bootstrap confidence intervals of the fold-averaged test metrics. All folds are evaluated
+    on the same resamples of the pullbacks, the chunks of resamples are distributed to a process pool.
+
+    Arguments:
+        fold_records: Prediction stores of the test split of every fold.
+        num_resamples: Number of pullback resamples.
+        confidence_level: Coverage of the intervals, e.g. 0.95.
+        seed: Seed of the resampling.
+        num_workers: Number of worker processes, 0 or 1 computes all chunks in this process.
+        chunk_size: Number of resamples per chunk (the frame weights of a chunk are held in memory at once).
+    Return:
+        Dictionary of the BOOTSTRAP_METRICS, each a dictionary with the "estimate" (on all test frames),
+        the "lower" and "upper" bound and the "std" of the bootstrap distribution.
+    '''
+
+    pullbacks = np.unique(np.concatenate([np.asarray(records['pullback']) for records in fold_records]))
+    fold_predictions = [compact_predictions(records, pullbacks) for records in fold_records]
+    counts = pullback_resample_counts(len(pullbacks), num_resamples, seed)
+    chunks = [counts[start:start + chunk_size] for start in range(0, num_resamples, chunk_size)]
+
+    if num_workers > 1:
+        # Workers are spawned, forking the training process would copy its CUDA context
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            chunk_results = list(executor.map(fold_average_metrics, [fold_predictions] * len(chunks), chunks))
+    else:
+        chunk_results = [fold_average_metrics(fold_predictions, chunk) for chunk in chunks]
+
+    estimates = fold_average_metrics(fold_predictions, np.ones((1, len(pullbacks)), dtype=np.int64))
+    tail = (1 - confidence_level) / 2 * 100
+    intervals = {}
+    for name in BOOTSTRAP_METRICS:
+        distribution = np.concatenate([results[name] for results in chunk_results])
+        lower, upper = np.nanpercentile(distribution, [tail, 100 - tail])
+        intervals[name] = {'estimate': float(estimates[name][0]), 'lower': float(lower), 'upper': float(upper), 'std': float(np.nanstd(distribution))}
+    return intervals
+
+def bootstrap_run(save_path:Path, checkpoint_name:str, num_resamples:int=1000, confidence_level:float=0.95,
+                  num_workers:int=4, decimals:int=4) -> dict:
+    ''' Prints the bootstrap confidence intervals of the test metrics of a run and stores them in its
+    FILE_NAME_BOOTSTRAP_RESULTS, using the cached test predictions of all folds.
+
+    Arguments:
+        save_path: Location of the run, e.g. "./data/train_and_test/group/name".
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        num_resamples: Number of pullback resamples.
+        confidence_level: Coverage of the intervals.
+        num_workers: Number of worker processes.
+        decimals: Number of printed decimals.
+    Return:
+        The intervals, see bootstrap_confidence_intervals.
+    '''
+
+    save_path = Path(save_path)
+    fold_records = []
+    for save_path_cv in sorted(save_path.glob('cv_*')):
+        cache = LogitCache(save_path_cv)
+        if cache.contains(checkpoint_name, SPLIT_TEST):
+            fold_records.append(cache.load(checkpoint_name, SPLIT_TEST))
+    if not fold_records:
+        raise FileNotFoundError('No cached test predictions of "' + checkpoint_name + '" in ' + str(save_path))
+
+    intervals = bootstrap_confidence_intervals(fold_records, num_resamples, confidence_level, num_workers=num_workers)
+
+    print('\n' + checkpoint_name, 'Bootstrap', str(round(confidence_level * 100)) + '% CI (' + str(num_resamples), 'pullback resamples,', len(fold_records), 'folds):')
+    for name, title in BOOTSTRAP_METRICS.items():
+        interval = intervals[name]
+        print('   {:<15}'.format(title + ':'), round(interval['estimate'], decimals), '[' + str(round(interval['lower'], decimals)) + ', ' + str(round(interval['upper'], decimals)) + ']')
+
+    file_bootstrap_results = save_path / FILE_NAME_BOOTSTRAP_RESULTS
+    try:
+        with open(file_bootstrap_results, 'r') as json_file:
+            existing_data = json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        existing_data = {}
+    existing_data[checkpoint_name] = dict(intervals, resamples=num_resamples, confidence_level=confidence_level, folds=len(fold_records))
+    with open(file_bootstrap_results, 'w') as json_file:
+        json.dump(existing_data, json_file, indent=4)
+    return intervals
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Pullback bootstrap confidence intervals of cached test predictions')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-b', '--resamples', default=1000, type=int, help='number of pullback resamples (default: 1000)')
+    args.add_argument('-cl', '--confidence_level', default=0.95, type=float, help='coverage of the intervals (default: 0.95)')
+    args.add_argument('-nw', '--num_workers', default=4, type=int, help='number of worker processes (default: 4)')
+    args = args.parse_args()
+
+    bootstrap_run(args.run, args.checkpoint, args.resamples, args.confidence_level, args.num_workers)
@@ -0,0 +1,292 @@
+import time
+import torch
+import argparse
+import numpy as np
+import torch.nn.functional as F
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+
+from utils import Utils
+from checkpoint import Checkpoint
+from ensemble import FoldEnsemble
+from dataset import IVOCT_Dataset
+from dataset_preparation import DatasetPreparation
+from accumulators import PredictionBuffer
+from compilation import get_memory_format
+from metrics import compute_metrics
+from predict import read_run_config
+from confidence_scorer import ConfidenceScorer
+
+SCORE_MARGIN = 'margin'
+SCORE_RECONSTRUCTION = 'reconstruction'
+
+def softmax_margin(log_probabilities:torch.Tensor) -> torch.Tensor:
+    # Difference of the two highest class probabilities, 1 for certain and 0 for undecided predictions
+    top2 = torch.topk(log_probabilities.float().exp(), k=2, dim=1).values
+    return top2[:, 0] - top2[:, 1]
+
+def reconstruction_confidence(auto_encoder, inputs:torch.Tensor) -> torch.Tensor:
+    # Negative mean squared reconstruction error per frame, higher is more confident
+    return -F.mse_loss(auto_encoder(inputs).float(), inputs.float(), reduction='none').flatten(1).mean(dim=1)
+
+def calibrate_threshold(confidences:np.ndarray, cheap_correct:np.ndarray, expensive_correct:np.ndarray, max_accuracy_loss:float) -> tuple:
+    ''' Finds the lowest confidence threshold (fewest escalated frames) whose cascade accuracy is at most max_accuracy_loss
+    below the accuracy of the expensive model. Frames below the threshold are escalated. All thresholds are evaluated
+    with one sort and cumulative sums.
+
+    Arguments:
+        confidences: Confidence of the cheap model per frame.
+        cheap_correct: Whether the cheap model classifies a frame correctly.
+        expensive_correct: Whether the expensive model classifies a frame correctly.
+        max_accuracy_loss: Accepted loss of accuracy against the expensive model.
+    Return:
+        Tuple of the threshold and the expected fraction of escalated frames.
+    '''
+
+    if max_accuracy_loss < 0:
+        raise ValueError('A negative accepted accuracy loss is not supported.')
+
+    order = np.argsort(confidences, kind='stable')
+    confidences_sorted = confidences[order]
+    num_samples = len(confidences)
+
+    # Escalating the k least confident frames: expensive results for those, cheap results for the others
+    expensive_escalated = np.concatenate([[0], np.cumsum(expensive_correct[order])])
+    cheap_kept = np.concatenate([np.cumsum(cheap_correct[order][::-1])[::-1], [0]])
+    accuracies = (expensive_escalated + cheap_kept) / num_samples
+
+    # Only cuts between distinct confidences are realizable with a threshold
+    valid = np.concatenate([[True], confidences_sorted[1:] > confidences_sorted[:-1], [True]])
+    target = np.mean(expensive_correct) - max_accuracy_loss
+    num_escalated = int(np.flatnonzero(valid & (accuracies >= target - 1e-12))[0])
+
+    threshold = -np.inf if num_escalated == 0 else (np.inf if num_escalated == num_samples else float(confidences_sorted[num_escalated]))
+    return threshold, num_escalated / num_samples
+
+class CascadePredictor():
+    ''' Two-stage classifier: a cheap model (e.g. a distilled student or a model on downscaled frames) classifies every
+    frame, only frames whose confidence (softmax margin of the cheap model or negative reconstruction error of an
+    autoencoder) falls below a threshold are escalated to the expensive model (e.g. ResNet18, VGG19 or a fold ensemble).
+    '''
+
+    def __init__(self, cheap_model, expensive_model, device, config, score:str=SCORE_MARGIN, auto_encoder=None, cheap_resolution:int=None, threshold:float=-np.inf):
+        ''' Creates the cascade.
+
+        Arguments:
+            self: The CascadePredictor object itself.
+            cheap_model: Classifier of the first stage, or a ConfidenceScorer (classifier and autoencoder fused).
+            expensive_model: Classifier or FoldEnsemble of the second stage.
+            device: Hardware the models are stored on.
+            config: Configuration of the expensive model.
+            score: Confidence score, SCORE_MARGIN or SCORE_RECONSTRUCTION.
+            auto_encoder: Autoencoder of the reconstruction score (not needed for a ConfidenceScorer).
+            cheap_resolution: If given, the cheap model classifies frames downscaled to this height and width.
+            threshold: Frames with a lower confidence are escalated (see calibrate).
+        Return:
+            The class constructor returns a "CascadePredictor" object.
+        '''
+
+        if score == SCORE_RECONSTRUCTION and auto_encoder is None and not isinstance(cheap_model, ConfidenceScorer):
+            raise ValueError('The reconstruction score requires an autoencoder.')
+
+        self.cheap_model = cheap_model
+        self.expensive_model = expensive_model
+        self.device = device
+        self.config = config
+        self.score = score
+        self.auto_encoder = auto_encoder
+        self.cheap_resolution = cheap_resolution
+        self.threshold = threshold
+
+    def cheap_forward(self, inputs:torch.Tensor) -> tuple:
+        ''' Runs the first stage on a batch.
+
+        Arguments:
+            self: The CascadePredictor object.
+            inputs: Batch of frames on the device.
+        Return:
+            Tuple of the log probabilities and the confidence per frame.
+        '''
+
+        cheap_inputs = inputs
+        if self.cheap_resolution is not None:
+            cheap_inputs = F.interpolate(inputs, size=(self.cheap_resolution, self.cheap_resolution), mode='bilinear', antialias=True)
+        if isinstance(self.cheap_model, ConfidenceScorer):
+            # Classifier and autoencoder share the encoder, one fused forward pass. The reconstruction error is
+            # computed on the full resolution frames like the autoencoder was trained, only the classification is downscaled
+            scores = self.cheap_model(inputs, None if self.cheap_resolution is None else cheap_inputs)
+            return torch.log_softmax(scores['logits'].float(), dim=1), -scores['mse']
+
+        log_probabilities = torch.log_softmax(self.cheap_model(cheap_inputs).float(), dim=1)
+        if self.score == SCORE_RECONSTRUCTION:
+            return log_probabilities, reconstruction_confidence(self.auto_encoder, inputs)
+        return log_probabilities, softmax_margin(log_probabilities)
+
+    def expensive_forward(self, inputs:torch.Tensor) -> torch.Tensor:
+        # Log probabilities of the second stage, the mean probabilities of all members for ensembles
+        if isinstance(self.expensive_model, FoldEnsemble):
+            return torch.log(torch.softmax(self.expensive_model.forward(inputs).float(), dim=2).mean(dim=0).clamp_min(1e-12))
+        return torch.log_softmax(self.expensive_model(inputs).float(), dim=1)
+
+    def predict(self, inputs:torch.Tensor) -> dict:
+        ''' Classifies a batch, the expensive model only runs on the escalated frames.
+
+        Arguments:
+            self: The CascadePredictor object.
+            inputs: Batch of frames on the device.
+        Return:
+            Dictionary with per frame "log_probabilities" of the cascade, "cheap_log_probabilities", "confidences"
+            and the mask "escalated".
+        '''
+
+        cheap_log_probabilities, confidences = self.cheap_forward(inputs)
+        escalated = confidences < self.threshold
+        log_probabilities = cheap_log_probabilities
+        if escalated.any():
+            log_probabilities = cheap_log_probabilities.clone()
+            log_probabilities[escalated] = self.expensive_forward(inputs[escalated]).to(log_probabilities.dtype)
+        return {'log_probabilities': log_probabilities, 'cheap_log_probabilities': cheap_log_probabilities, 'confidences': confidences, 'escalated': escalated}
+
+    def calibrate(self, dataloader:DataLoader, max_accuracy_loss:float, expensive_model=None) -> float:
+        ''' Sets the threshold on a validation set: the fewest escalated frames with an accuracy at most max_accuracy_loss
+        below the expensive model. No model of the calibration may be trained on the validation set, otherwise its
+        accuracy is overestimated.
+
+        Arguments:
+            self: The CascadePredictor object.
+            dataloader: Dataloader of the validation set.
+            max_accuracy_loss: Accepted loss of accuracy against the expensive model.
+            expensive_model: Second stage of the calibration if the expensive model has seen the validation set,
+                             e.g. the fold model of the validation set for a FoldEnsemble (default: the expensive model).
+        Return:
+            The expected fraction of escalated frames.
+        '''
+
+        calibration_cascade = self if expensive_model is None else CascadePredictor(self.cheap_model, expensive_model, self.device, self.config,
+                                                                                    self.score, self.auto_encoder, self.cheap_resolution)
+
+        predictions = PredictionBuffer(len(dataloader.dataset), self.device)
+        for inputs, labels in dataloader:
+            inputs = inputs.to(self.device, memory_format=get_memory_format(self.config))
+            with torch.set_grad_enabled(False):
+                with torch.cuda.amp.autocast():
+                    cheap_log_probabilities, confidences = calibration_cascade.cheap_forward(inputs)
+                    expensive_log_probabilities = calibration_cascade.expensive_forward(inputs)
+            predictions.add(targets=labels.type(torch.LongTensor).to(self.device), confidences=confidences.float(),
+                            cheap=cheap_log_probabilities.argmax(dim=1), expensive=expensive_log_probabilities.argmax(dim=1))
+
+        targets = predictions.numpy('targets')
+        self.threshold, escalated_fraction = calibrate_threshold(predictions.numpy('confidences'), predictions.numpy('cheap') == targets,
+                                                                 predictions.numpy('expensive') == targets, max_accuracy_loss)
+        print('Cascade threshold:', round(self.threshold, 5), '- expected escalated frames:', str(round(100 * escalated_fraction, 1)) + '%')
+        return escalated_fraction
+
+    def evaluate(self, dataloader:DataLoader) -> dict:
+        ''' Evaluates the cascade against the expensive model alone on a dataset.
+
+        Arguments:
+            self: The CascadePredictor object.
+            dataloader: Dataloader of the evaluated dataset.
+        Return:
+            Dictionary with "escalated" (fraction of escalated frames) and per variant ("cheap", "cascade", "expensive")
+            the metrics and the end-to-end throughput in frames/s (not measured for "cheap").
+        '''
+
+        results = {}
+        for variant in ['cascade', 'expensive']:
+            predictions = PredictionBuffer(len(dataloader.dataset), self.device)
+            duration = 0.0
+            for inputs, labels in dataloader:
+                inputs = inputs.to(self.device, memory_format=get_memory_format(self.config))
+                start_time = time.perf_counter()
+                with torch.set_grad_enabled(False):
+                    with torch.cuda.amp.autocast():
+                        if variant == 'cascade':
+                            cascade_results = self.predict(inputs)
+                            log_probabilities = cascade_results['log_probabilities']
+                        else:
+                            log_probabilities = self.expensive_forward(inputs)
+                if inputs.is_cuda:
+                    torch.cuda.synchronize()
+                duration += time.perf_counter() - start_time
+
+                columns = {'targets': labels.type(torch.LongTensor).to(self.device), 'outputs': log_probabilities.float()}
+                if variant == 'cascade':
+                    columns.update(escalated=cascade_results['escalated'].float(), cheap_outputs=cascade_results['cheap_log_probabilities'].float())
+                predictions.add(**columns)
+
+            results[variant] = compute_metrics(predictions['outputs'], predictions['targets'], self.config['num_out'])
+            results[variant]['throughput'] = len(dataloader.dataset) / duration
+            if variant == 'cascade':
+                results['cheap'] = compute_metrics(predictions['cheap_outputs'], predictions['targets'], self.config['num_out'])
+                results['escalated'] = float(predictions['escalated'].mean())
+        return results
+
+def load_models(run_path:Path, cv:int, checkpoint_name:str, device, ensemble:bool=False):
+    ''' Loads the model of a fold of a run, or the ensemble of all folds.
+
+    Arguments:
+        run_path: Location of the run.
+        cv: Number of the CV round.
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        device: Hardware to evaluate on.
+        ensemble: Whether the FoldEnsemble of all folds is loaded.
+    Return:
+        Tuple of the model (or FoldEnsemble) and the configuration of the run.
+    '''
+
+    config = read_run_config(run_path)
+    if ensemble:
+        return FoldEnsemble.from_run(run_path, device, config, checkpoint_name, vectorize=config['ensemble_vectorize']), config
+    model, _ = Checkpoint.load_inference_model(checkpoint_name, Path(run_path) / ('cv_' + str(cv)), device, config, cv)
+    return model, config
+
+def main(args) -> None:
+    device = Utils.config_torch_and_cuda(read_run_config(args.run)) if torch.cuda.is_available() else torch.device('cpu')
+    expensive_model, config = load_models(args.run, args.fold, args.checkpoint, device, args.ensemble)
+    cheap_model, _ = load_models(args.cheap_run, args.fold, args.checkpoint, device)
+    auto_encoder = None
+    if args.score == SCORE_RECONSTRUCTION:
+        auto_encoder, auto_encoder_config = load_models(args.auto_encoder_run, args.fold, args.checkpoint, device)
+        if Path(args.cheap_run).resolve() == Path('./data/train_and_test', auto_encoder_config['encoder_group'], auto_encoder_config['encoder_name']).resolve():
+            # The autoencoder is trained on the encoder of the cheap model, both are evaluated in one fused pass
+            cheap_model, _ = ConfidenceScorer.from_run(args.auto_encoder_run, args.fold, device, args.checkpoint)
+
+    cust_data = DatasetPreparation(config)
+    valid_ind, _ = cust_data.get_train_valid_ind(args.fold - 1)
+    valid_loader = DataLoader(IVOCT_Dataset(valid_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'], num_workers=1, pin_memory=True)
+    test_loader = DataLoader(IVOCT_Dataset(cust_data.test_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'], num_workers=1, pin_memory=True)
+
+    cascade = CascadePredictor(cheap_model, expensive_model, device, config, args.score, auto_encoder, args.cheap_resolution)
+    # The other members of the ensemble are trained on the validation set of the fold, only its own model calibrates
+    calibration_model = load_models(args.run, args.fold, args.checkpoint, device)[0] if args.ensemble else None
+    if args.ensemble:
+        print('Warning: the accepted accuracy loss is calibrated against the model of CV', args.fold, 'not the ensemble,',
+              'the accuracy lost against the ensemble on the test set may differ.')
+    cascade.calibrate(valid_loader, args.max_accuracy_loss, calibration_model)
+    results = cascade.evaluate(test_loader)
+
+    print('\nEscalated frames:', str(round(100 * results['escalated'], 1)) + '%')
+    print('{:<10} {:>10} {:>10} {:>14}'.format('Variant', 'Accuracy', 'MCC', 'Frames/s'))
+    for variant in ['cheap', 'cascade', 'expensive']:
+        throughput = '{:>14.1f}'.format(results[variant]['throughput']) if 'throughput' in results[variant] else '{:>14}'.format('-')
+        print('{:<10} {:>10.4f} {:>10.4f}'.format(variant, float(results[variant]['accuracy']), float(results[variant]['mcc'])) + ' ' + throughput)
+    print('Accuracy lost:', round(float(results['expensive']['accuracy'] - results['cascade']['accuracy']), 5),
+          '- Speedup:', str(round(results['cascade']['throughput'] / results['expensive']['throughput'], 2)) + 'x')
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Confidence-gated cascade of a cheap and an expensive classifier')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run of the expensive model')
+    args.add_argument('-s', '--cheap_run', required=True, type=str, help='location of the run of the cheap model, e.g. a distilled student')
+    args.add_argument('-cv', '--fold', default=1, type=int, help='CV round of the models, its validation set calibrates the threshold (default: 1)')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-e', '--ensemble', action='store_true', help='escalate to the ensemble of all folds of the expensive run (calibrated with the model of the fold)')
+    args.add_argument('-sc', '--score', default=SCORE_MARGIN, choices=[SCORE_MARGIN, SCORE_RECONSTRUCTION], help='confidence score (default: margin)')
+    args.add_argument('-ae', '--auto_encoder_run', default=None, type=str, help='location of the autoencoder run of the reconstruction score')
+    args.add_argument('-res', '--cheap_resolution', default=None, type=int, help='downscale the frames of the cheap model to this size')
+    args.add_argument('-l', '--max_accuracy_loss', default=0.01, type=float, help='accepted accuracy loss on the validation set, not negative, relative to the model of the fold with --ensemble (default: 0.01)')
+    parsed_args = args.parse_args()
+    if parsed_args.max_accuracy_loss < 0:
+        args.error('argument -l/--max_accuracy_loss: must not be negative')
+    main(parsed_args)
@@ -7,7 +7,6 @@ import copy
 import torch.optim as optim
 import torch.nn as nn
 
-from glob import glob
 from torch._C import device
 from collections import namedtuple
 from torch.nn.parallel.data_parallel import DataParallel
@@ -15,17 +14,25 @@ from torch.nn.parallel.data_parallel import DataParallel
 from eval import Eval
 from utils_wandb import Wandb
 from config import Config
+from compilation import compile_model, get_memory_format
+from checkpoint_writer import CheckpointWriter
+from checkpoint_index import CheckpointIndex, KIND_TRAINING, KIND_INFERENCE
+from inference_weights import WEIGHTS_SUFFIX, METADATA_SUFFIX, to_inference_weights, save_metadata, load_inference_weights, get_evaluation_weights_path
 
 from models.model_resnet_autenc import ResNet18, create_autoenc_resnet18
 from models.model_vgg19_autenc import VGG19, create_autoenc_vgg19
 from models.model_unet1 import UNetClassifier1, load_unet1_with_classifier_weights
 from models.model_unet2 import UNetClassifier2, load_unet2_with_classifier_weights
+from models.model_mobilenet import MobileNetV3Small
              
 class Checkpoint():
     ''' This class represents a checkpoint of the training process, where the current status is stored.
     All training and testing processes use the model in it.
     '''
     
+    # Writes checkpoint files in the background, shared by all checkpoints
+    writer = None
+    
     def __init__(self, name:str, save_path_cv:Path, device:device, config:Config, cv:int):
         ''' Creates the first checkpoint of the training process.
         Stores most important components of the training process, e.g.: model, optimizer, wandb_id, etc.
@@ -52,26 +59,23 @@ class Checkpoint():
         self.eval_valid = None
         self.eval_valid_best = None
         
-        # Load existing checkpoint
-        model_found = False
-        for checkpoint_path in glob(str(save_path_cv / '*.pt')):
-            if name in checkpoint_path:
-                model_found = True
-                
-                checkpoint = torch.load(checkpoint_path)
-                
-                self.model.load_state_dict(checkpoint['model_state_dict'])
-                self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-                self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
-                self.scaler.load_state_dict(checkpoint['scaler_state_dict'])
-                self.start_epoch = checkpoint['epoch'] + 1
-                if config["enable_wandb"]:
-                    self.wandb_id = checkpoint['Wandb_ID']
-                self.eval_valid = namedtuple("eval_valid", checkpoint['eval_valid'].keys())(*checkpoint['eval_valid'].values())
-                self.eval_valid_best = namedtuple("eval_valid_best", checkpoint['eval_valid_best'].keys())(*checkpoint['eval_valid_best'].values())
-                break
-
-        if not model_found:
+        # Load existing checkpoint (after pending writes are completed)
+        if Checkpoint.writer is not None:
+            Checkpoint.writer.flush()
+        checkpoint_path = CheckpointIndex(save_path_cv).get_path(name, KIND_TRAINING)
+        if checkpoint_path is not None:
+            checkpoint = torch.load(checkpoint_path)
+            
+            self.model.load_state_dict(checkpoint['model_state_dict'])
+            self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+            self.scaler.load_state_dict(checkpoint['scaler_state_dict'])
+            self.start_epoch = checkpoint['epoch'] + 1
+            if config["enable_wandb"]:
+                self.wandb_id = checkpoint['Wandb_ID']
+            self.eval_valid = namedtuple("eval_valid", checkpoint['eval_valid'].keys())(*checkpoint['eval_valid'].values())
+            self.eval_valid_best = namedtuple("eval_valid_best", checkpoint['eval_valid_best'].keys())(*checkpoint['eval_valid_best'].values())
+        else:
             print(f'No Model with "{name}" found. Train from first epoch.')
     
     def update_eval_valid(self, eval_valid:Eval, config) -> None:
@@ -91,6 +95,8 @@ class Checkpoint():
     
     def save_checkpoint(self, name:str, epoch:int, save_path_cv:Path, config:Config) -> None:
         ''' Saves the current model under specified name.
+        The file is written atomically, with config['async_checkpointing'] in the background.
+        Additionally, the weights are saved as a lightweight inference artifact in config['inference_weights_dtype'].
 
         Arguments:
             self: The Checkpoint object.
@@ -112,7 +118,78 @@ class Checkpoint():
         if config["enable_wandb"]:
             state.update({'Wandb_ID': self.wandb_id})
 
-        torch.save(state, save_path_cv / (name + '_at_epoch_' + str(epoch) + '.pt'))
+        index = CheckpointIndex(save_path_cv)
+        metric = self.eval_valid.mean_loss if config["auto_encoder"] else self.eval_valid.metrics[5]
+        
+        self.get_writer(config).save(str(save_path_cv / name), state, save_path_cv / (name + '_at_epoch_' + str(epoch) + '.pt'),
+                                     on_done=lambda path: index.record(name, KIND_TRAINING, path, epoch, metric))
+        
+        if config['inference_weights_dtype']:
+            metadata = {
+                'name': name,
+                'epoch': epoch,
+                'model_type': config['model_type'],
+                'num_out': config['num_out'],
+                'dtype': config['inference_weights_dtype'],
+            }
+            if config["enable_wandb"]:
+                metadata.update({'Wandb_ID': self.wandb_id})
+            
+            weights = to_inference_weights(self.model.state_dict(), config['inference_weights_dtype'])
+            weights_path = save_path_cv / (name + '_at_epoch_' + str(epoch) + WEIGHTS_SUFFIX)
+            def on_weights_saved(path):
+                save_metadata(metadata, path)
+                index.record(name, KIND_INFERENCE, path, epoch, metric)
+            
+            self.get_writer(config).save(str(save_path_cv / name) + WEIGHTS_SUFFIX, weights, weights_path, on_done=on_weights_saved)
+    
+    @classmethod
+    def load_inference_model(cls, name:str, save_path_cv:Path, device:device, config:Config, cv:int) -> tuple:
+        ''' Loads only the model of a stored checkpoint for evaluation, without optimizer, scheduler or scaler.
+        A full precision inference artifact is used if available, otherwise the full training checkpoint
+        (reduced precision artifacts only if no training checkpoint is stored, see get_evaluation_weights_path).
+
+        Arguments:
+            cls: The Checkpoint class.
+            name: Name of the checkpoint to load.
+            save_path_cv: Location where this CV round is stored.
+            device: Hardware to evaluate on.
+            config: Configuration set by the user.
+            cv: Number of the CV round.
+        Return:
+            Tuple of the model (in eval mode) and the metadata of the checkpoint.
+        '''
+        
+        if cls.writer is not None:
+            cls.writer.flush()
+        
+        weights_path = get_evaluation_weights_path(CheckpointIndex(save_path_cv), name)
+        if weights_path is not None:
+            model = cls.get_new_model(device, config, cv)
+            state_dict, metadata = load_inference_weights(weights_path)
+            model.load_state_dict(state_dict)
+            return model.eval(), metadata
+        
+        checkpoint = Checkpoint(name, save_path_cv, device, config, cv)
+        metadata = {'name': name, 'epoch': checkpoint.start_epoch - 1}
+        if config["enable_wandb"]:
+            metadata.update({'Wandb_ID': checkpoint.wandb_id})
+        return checkpoint.model.eval(), metadata
+    
+    @classmethod
+    def get_writer(cls, config:Config) -> CheckpointWriter:
+        ''' Gets the writer shared by all checkpoints, creates it on first use.
+
+        Arguments:
+            cls: The Checkpoint class.
+            config: The application configuration.
+        Return:
+            The checkpoint writer.
+        '''
+        
+        if cls.writer is None:
+            cls.writer = CheckpointWriter(asynchronous=config['async_checkpointing'])
+        return cls.writer
     
     @classmethod
     def get_new_model(cls, device:device, config:Config, cv:int) -> DataParallel:
@@ -135,6 +212,7 @@ class Checkpoint():
             'load_unet1_with_classifier_weights': load_unet1_with_classifier_weights,
             'UNetClassifier2': UNetClassifier2,
             'load_unet2_with_classifier_weights': load_unet2_with_classifier_weights,
+            'MobileNetV3Small': MobileNetV3Small,
         }
 
         if config['model_type'] not in model_map:
@@ -146,6 +224,10 @@ class Checkpoint():
         #    model = nn.DataParallel(model)
                 
         model.to(device)
+        model.to(memory_format=get_memory_format(config))
+        
+        if config['compile_model']:
+            model = compile_model(model, config['model_type'], device, config)
         
         return model
     
@@ -167,11 +249,14 @@ class Checkpoint():
         else:
             return optim.Adam(model.parameters(), lr=config['learning_rate'], weight_decay=config['weight_decay'])
 
-    @staticmethod
-    def delete_checkpoint(name, epoch, save_path:Path) -> None:
+    @classmethod
+    def delete_checkpoint(cls, name, epoch, save_path:Path) -> None:
         ''' Deletes the specified checkpoint from a given directory.
+        If checkpoints are written in the background, the file is deleted after all previous saves are completed.
+        The checkpoint index entry is removed as well, unless it already refers to a newer file.
 
         Arguments:
+            cls: The Checkpoint class.
             name: Filename beginning of the checkpoint to delete.
             epoch: The epoch the checkpoint belongs to as part of the filename.
             save_path: Location where the checkpoint is stored.
@@ -179,6 +264,16 @@ class Checkpoint():
             The Method has nothing to return.
         '''
         
-        if os.path.isfile(save_path / (name + '_at_epoch_' + str(epoch) + '.pt')):
-            os.remove(save_path / (name + '_at_epoch_' + str(epoch) + '.pt'))
+        index = CheckpointIndex(save_path)
+        for kind, suffix in [(KIND_TRAINING, '.pt'), (KIND_INFERENCE, WEIGHTS_SUFFIX), (None, METADATA_SUFFIX)]:
+            path = save_path / (name + '_at_epoch_' + str(epoch) + suffix)
+            remove_entry = None if kind is None else (lambda path, kind=kind: index.remove(name, kind, path))
+            
+            if cls.writer is not None:
+                cls.writer.delete(path, on_done=remove_entry)
+            else:
+                if os.path.isfile(path):
+                    os.remove(path)
+                if remove_entry is not None:
+                    remove_entry(path)
 
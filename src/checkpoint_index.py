@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from glob import glob
+from pathlib import Path
+
+FILE_NAME_CHECKPOINT_INDEX = 'checkpoint_index.json'
+
+# Kinds of files stored per checkpoint
+KIND_TRAINING = 'training'
+KIND_INFERENCE = 'inference'
+KIND_SUFFIXES = {
+    KIND_TRAINING: '.pt',
+    KIND_INFERENCE: '.weights',
+}
+
+def file_sha256(path:Path) -> str:
+    ''' Computes the SHA-256 hash of a file in chunks.
+
+    Arguments:
+        path: Location of the file.
+    Return:
+        The hex digest of the hash.
+    '''
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2**24), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class CheckpointIndex():
+    ''' Index of the checkpoints stored for one CV round (fold), kept as json file in the fold directory.
+    For every checkpoint name (e.g. "checkpoint_best") and kind of file (training checkpoint, inference weights)
+    it records file, epoch, validation metric and hash. Lookups read the index instead of scanning the directory,
+    so stale duplicate files are never picked up. The index is updated atomically on every save and deletion.
+    '''
+
+    # Saves and deletions may update the index from the background writer and the training thread.
+    lock = threading.Lock()
+
+    def __init__(self, save_path_cv:Path):
+        ''' Creates the index object of a fold directory, the index file is created on the first update.
+
+        Arguments:
+            self: The CheckpointIndex object itself.
+            save_path_cv: Location where this CV round is stored.
+        Return:
+            The class constructor returns a "CheckpointIndex" object.
+        '''
+
+        self.save_path_cv = Path(save_path_cv)
+        self.path = self.save_path_cv / FILE_NAME_CHECKPOINT_INDEX
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def read(self) -> dict:
+        ''' Reads the index. Runs stored before the index was introduced are indexed by their file names.
+
+        Arguments:
+            self: The CheckpointIndex object.
+        Return:
+            Dictionary of the index with the keys "checkpoints" and "test_results".
+        '''
+
+        if not self.exists():
+            return self._scan_directory()
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def get(self, name:str, kind:str=KIND_TRAINING) -> dict:
+        ''' Gets the index entry of a checkpoint.
+
+        Arguments:
+            self: The CheckpointIndex object.
+            name: Name of the checkpoint, e.g. "checkpoint_best".
+            kind: Kind of the file, KIND_TRAINING or KIND_INFERENCE.
+        Return:
+            The entry with "file", "epoch", "metric" and "sha256", None if not stored.
+        '''
+
+        return self.read()['checkpoints'].get(name, {}).get(kind)
+
+    def get_path(self, name:str, kind:str=KIND_TRAINING) -> Path:
+        ''' Gets the location of a stored checkpoint file.
+
+        Arguments:
+            self: The CheckpointIndex object.
+            name: Name of the checkpoint, e.g. "checkpoint_best".
+            kind: Kind of the file, KIND_TRAINING or KIND_INFERENCE.
+        Return:
+            Path of the file, None if not stored.
+        '''
+
+        entry = self.get(name, kind)
+        return None if entry is None else self.save_path_cv / entry['file']
+
+    def record(self, name:str, kind:str, path:Path, epoch:int, metric:float) -> None:
+        ''' Records a newly written checkpoint file, replacing the previous entry of the same name and kind.
+
+        Arguments:
+            self: The CheckpointIndex object.
+            name: Name of the checkpoint, e.g. "checkpoint_best".
+            kind: Kind of the file, KIND_TRAINING or KIND_INFERENCE.
+            path: Location of the written file.
+            epoch: The epoch the checkpoint belongs to.
+            metric: Validation metric of the checkpoint (MCC, mean loss for autoencoders).
+        Return:
+            This Method has nothing to return.
+        '''
+
+        entry = {
+            'file': Path(path).name,
+            'epoch': int(epoch),
+            'metric': None if metric is None else float(metric),
+            'sha256': file_sha256(path),
+        }
+        with CheckpointIndex.lock:
+            index = self.read()
+            index['checkpoints'].setdefault(name, {})[kind] = entry
+            self._write(index)
+
+    def remove(self, name:str, kind:str, path:Path) -> None:
+        ''' Removes the entry of a deleted checkpoint file, if the entry still refers to this file.
+
+        Arguments:
+            self: The CheckpointIndex object.
+            name: Name of the checkpoint, e.g. "checkpoint_best".
+            kind: Kind of the file, KIND_TRAINING or KIND_INFERENCE.
+            path: Location of the deleted file.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        with CheckpointIndex.lock:
+            index = self.read()
+            entries = index['checkpoints'].get(name, {})
+            if kind in entries and entries[kind]['file'] == Path(path).name:
+                del entries[kind]
+                if not entries:
+                    del index['checkpoints'][name]
+                self._write(index)
+
+    def record_test_results(self, file_name:str) -> None:
+        ''' Records that the tests of this fold are completed.
+
+        Arguments:
+            self: The CheckpointIndex object.
+            file_name: Name of the file with the test results.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        with CheckpointIndex.lock:
+            index = self.read()
+            index['test_results'] = file_name
+            self._write(index)
+
+    def has_test_results(self) -> bool:
+        return self.read()['test_results'] is not None
+
+    def _write(self, index:dict) -> None:
+        # Write to a temporary file and rename, so the index is never half-written
+        os.makedirs(self.save_path_cv, exist_ok=True)
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(index, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _scan_directory(self) -> dict:
+        # Fallback for runs without index: the file with the highest epoch per name and kind, hashes are not computed.
+        index = {'checkpoints': {}, 'test_results': None}
+        for kind, suffix in KIND_SUFFIXES.items():
+            for path in glob(str(self.save_path_cv / ('*_at_epoch_*' + suffix))):
+                match = re.fullmatch(r'(.+)_at_epoch_(\d+)' + re.escape(suffix), Path(path).name)
+                if match is None:
+                    continue
+                name, epoch = match.group(1), int(match.group(2))
+                entries = index['checkpoints'].setdefault(name, {})
+                if kind not in entries or entries[kind]['epoch'] < epoch:
+                    entries[kind] = {'file': Path(path).name, 'epoch': epoch, 'metric': None, 'sha256': None}
+        if glob(str(self.save_path_cv / 'test_results*')):
+            index['test_results'] = Path(glob(str(self.save_path_cv / 'test_results*'))[0]).name
+        return index
@@ -0,0 +1,186 @@
+import os
+import copy
+import atexit
+import threading
+import collections
+import torch
+
+from pathlib import Path
+
+def snapshot_to_cpu(state):
+    ''' Copies a (nested) state to CPU memory, so training can continue to modify the original tensors.
+
+    Arguments:
+        state: Tensor, dict, list or tuple of states, e.g. a state dict of a model or optimizer.
+    Return:
+        A copy of the state with all tensors detached and on the CPU.
+    '''
+
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, snapshot_to_cpu(value)) for key, value in state.items())
+    if isinstance(state, tuple) and hasattr(state, '_fields'):
+        return type(state)(*[snapshot_to_cpu(value) for value in state])
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return copy.deepcopy(state)
+
+def atomic_save(state, path:Path) -> None:
+    ''' Saves a state with torch.save, such that the file at path is either the complete old or the complete new version.
+    The state is written to a temporary file, synced to disk and renamed afterwards.
+
+    Arguments:
+        state: The state to save.
+        path: Location of the file to write.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    path = Path(path)
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as file:
+        torch.save(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+    # Persist the rename itself (not supported on every platform / file system)
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+class CheckpointWriter():
+    ''' Writes checkpoints in a background thread, so training does not block on (network) storage.
+    Saves and deletions are executed in the order they were requested. A save which is still pending
+    when a newer save with the same key arrives is superseded (coalesced) by the newer one.
+    '''
+
+    def __init__(self, asynchronous:bool=True):
+        ''' Creates the writer and starts its background thread.
+
+        Arguments:
+            self: The CheckpointWriter object itself.
+            asynchronous: If False, all requests are executed immediately in the calling thread.
+        Return:
+            The class constructor returns a "CheckpointWriter" object.
+        '''
+
+        self.asynchronous = asynchronous
+        self.tasks = collections.deque()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.error = None
+
+        if self.asynchronous:
+            self.thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def save(self, key:str, state:dict, path:Path, on_done=None) -> None:
+        ''' Requests to save a state. The state is copied to CPU memory before this method returns.
+
+        Arguments:
+            self: The CheckpointWriter object.
+            key: Identifier of the checkpoint, pending saves with the same key are superseded.
+            state: The state to save.
+            path: Location of the file to write.
+            on_done: Optional function called with the path after the file has been written.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        if not self.asynchronous:
+            atomic_save(state, path)
+            if on_done is not None:
+                on_done(path)
+            return
+
+        task = ('save', key, snapshot_to_cpu(state), path, on_done)
+        with self.condition:
+            self._raise_error()
+            # Replace a superseded save at its position, so deletions queued after it still follow a completed save
+            for i, pending in enumerate(self.tasks):
+                if pending[0] == 'save' and pending[1] == key:
+                    self.tasks[i] = task
+                    break
+            else:
+                self.tasks.append(task)
+            self.condition.notify_all()
+
+    def delete(self, path:Path, on_done=None) -> None:
+        ''' Requests to delete a checkpoint file after all previously requested saves are written.
+
+        Arguments:
+            self: The CheckpointWriter object.
+            path: Location of the file to delete.
+            on_done: Optional function called with the path after the file has been deleted.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        if not self.asynchronous:
+            self._delete(path, on_done)
+            return
+
+        with self.condition:
+            self._raise_error()
+            self.tasks.append(('delete', None, None, path, on_done))
+            self.condition.notify_all()
+
+    def flush(self) -> None:
+        ''' Blocks until all requested saves and deletions are executed.
+
+        Arguments:
+            self: The CheckpointWriter object.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        if not self.asynchronous:
+            return
+
+        with self.condition:
+            while self.tasks or self.busy:
+                self.condition.wait()
+            self._raise_error()
+
+    def _raise_error(self) -> None:
+        # Errors of the background thread are raised in the training thread.
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing checkpoint failed.') from error
+
+    @staticmethod
+    def _delete(path:Path, on_done) -> None:
+        if os.path.isfile(path):
+            os.remove(path)
+        if on_done is not None:
+            on_done(path)
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.tasks:
+                    self.condition.wait()
+                kind, _, state, path, on_done = self.tasks.popleft()
+                self.busy = True
+
+            try:
+                if kind == 'save':
+                    atomic_save(state, path)
+                    if on_done is not None:
+                        on_done(path)
+                else:
+                    self._delete(path, on_done)
+            except Exception as error:
+                self.error = error
+
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
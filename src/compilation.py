@@ -0,0 +1,106 @@
+import torch
+import torch.nn as nn
+
+from torch._C import device
+
+# Compile modes tried per model (in order) before falling back to eager execution.
+# The decoders and UNets contain python control flow (seeds, block loops), "reduce-overhead"
+# (CUDA graphs) is therefore not attempted for them.
+COMPILE_MODES = {
+    'ResNet18': ['max-autotune', 'default'],
+    'ResNet18AutEnc': ['default'],
+    'VGG19': ['max-autotune', 'default'],
+    'VGG19AutEnc': ['default'],
+    'UNetClassifier1': ['default'],
+    'load_unet1_with_classifier_weights': ['default'],
+    'UNetClassifier2': ['default'],
+    'load_unet2_with_classifier_weights': ['default'],
+    'MobileNetV3Small': ['max-autotune', 'default'],
+}
+
+def get_memory_format(config) -> torch.memory_format:
+    ''' Gets the memory format of the model inputs and weights specified in the configurations.
+
+    Arguments:
+        config: The application configuration.
+    Return:
+        torch.channels_last if activated, else the standard contiguous format.
+    '''
+
+    return torch.channels_last if config['channels_last'] else torch.contiguous_format
+
+def get_input_channels(model:nn.Module) -> int:
+    ''' Determines the number of input channels of a model by its first convolution.
+
+    Arguments:
+        model: The model to inspect.
+    Return:
+        Number of channels the model expects as input.
+    '''
+
+    for module in model.modules():
+        if isinstance(module, (nn.Conv2d, nn.Conv3d)):
+            return module.in_channels
+    return 3
+
+def suppress_compile_errors(compiled_forward):
+    ''' Wraps a compiled forward function, compile errors during its calls fall back to eager execution.
+
+    Arguments:
+        compiled_forward: The forward function returned by torch.compile.
+    Return:
+        The wrapped forward function.
+    '''
+
+    def forward(*args, **kwargs):
+        with torch._dynamo.config.patch(suppress_errors=True):
+            return compiled_forward(*args, **kwargs)
+    return forward
+
+def compile_model(model:nn.Module, model_type:str, device:device, config, image_size:int=224) -> nn.Module:
+    ''' Compiles the forward pass of a model in place with torch.compile.
+    Only the forward method is replaced, so state dicts (and thereby checkpoints) stay identical to eager models.
+    Each mode in COMPILE_MODES is validated with a warm-up forward pass. If every mode fails, the model stays eager.
+    Compiled artifacts are cached in TORCHINDUCTOR_CACHE_DIR (see Utils.config_torch_and_cuda), restarts reuse them.
+
+    Arguments:
+        model: The (eager) model to compile, already moved to the device.
+        model_type: Key of the model in the model map.
+        device: Hardware the model runs on.
+        config: The application configuration.
+        image_size: Height and width of the warm-up input.
+    Return:
+        The same model object, compiled if possible.
+    '''
+
+    if not hasattr(torch, 'compile'):
+        print('torch.compile not available in torch', torch.__version__, '- model stays eager.')
+        return model
+
+    was_training = model.training
+    warm_up_input = torch.zeros(2, get_input_channels(model), image_size, image_size, device=device)
+    warm_up_input = warm_up_input.to(memory_format=get_memory_format(config))
+
+    for mode in COMPILE_MODES.get(model_type, ['default']):
+        compiled_forward = torch.compile(type(model).forward.__get__(model), mode=mode)
+        model.forward = compiled_forward
+        try:
+            model.eval()
+            with torch._dynamo.config.patch(suppress_errors=False):
+                with torch.set_grad_enabled(False):
+                    with torch.cuda.amp.autocast():
+                        model(warm_up_input)
+            print('Compiled model "' + model_type + '" with mode "' + mode + '".')
+            # Errors that only occur later (e.g. in the training graph) fall back to eager instead of crashing,
+            # only for the calls of this model (the dynamo configuration is process-global)
+            model.forward = suppress_compile_errors(compiled_forward)
+            break
+        except Exception as error:
+            print('Compiling model "' + model_type + '" with mode "' + mode + '" failed:', type(error).__name__, error)
+            del model.forward
+            torch._dynamo.reset()
+    else:
+        print('Model "' + model_type + '" runs eager.')
+
+    model.train(was_training)
+    return model
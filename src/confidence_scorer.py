@@ -0,0 +1,148 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+
+from checkpoint import Checkpoint
+from accumulators import PredictionBuffer
+from compilation import get_memory_format
+from predict import read_run_config
+
+AGGREGATION_GLOBAL = 'global'
+AGGREGATION_REGIONAL_MAX = 'regional_max'
+AGGREGATION_LATENT = 'latent'
+AGGREGATIONS = [AGGREGATION_GLOBAL, AGGREGATION_REGIONAL_MAX, AGGREGATION_LATENT]
+
+class ConfidenceScorer(nn.Module):
+    ''' Fused classifier and autoencoder: the frozen encoder shared by both (the feature layers of the classifier, see
+    create_autoenc_resnet18 and create_autoenc_vgg19) runs once per batch, its features are passed to the pooling and
+    fully connected head of the classifier and to the decoder of the autoencoder. The reconstruction error is the
+    confidence score of the classification (a high error indicates an unfamiliar frame).
+    '''
+
+    def __init__(self, classifier:nn.Module, auto_encoder:nn.Module, aggregation:str=AGGREGATION_GLOBAL, region_size:int=16):
+        ''' Creates the scorer from the classifier and the autoencoder trained on its encoder.
+
+        Arguments:
+            self: The ConfidenceScorer object itself.
+            classifier: The ResNet18 or VGG19 classifier, its head is used.
+            auto_encoder: The autoencoder of the classifier, its encoder and decoder are used.
+            aggregation: Aggregation of the reconstruction error per frame, one of AGGREGATIONS:
+                         "global" (mean over all pixels), "regional_max" (maximum of the mean error of regions of
+                         region_size x region_size pixels) or "latent" (mean squared distance of the encoded
+                         frame and the encoded reconstruction, costs a second encoder pass).
+            region_size: Height and width of the regions of "regional_max".
+        Return:
+            The class constructor returns a "ConfidenceScorer" object.
+        '''
+
+        super().__init__()
+        if aggregation not in AGGREGATIONS:
+            raise ValueError('Aggregation "' + aggregation + '" unknown, use one of ' + ', '.join(AGGREGATIONS) + '.')
+
+        self.encoder = auto_encoder.encoder
+        self.decoder = auto_encoder.decoder
+        # Head of ResNet18 (avgpool, fc) or VGG19 (avgpool, classifier) after the encoder layers
+        pooling, fully_connected = list(classifier.net.children())[-2:]
+        self.head = nn.Sequential(pooling, nn.Flatten(1), fully_connected)
+        self.aggregation = aggregation
+        self.region_size = region_size
+
+        classifier_encoder = nn.Sequential(*list(classifier.net.children())[:-2])
+        for parameter, classifier_parameter in zip(self.encoder.parameters(), classifier_encoder.parameters()):
+            if not torch.equal(parameter.data.float(), classifier_parameter.data.float()):
+                print('ConfidenceScorer: the encoder of the autoencoder differs from the classifier, the logits are computed with the encoder of the autoencoder.')
+                break
+
+    @classmethod
+    def from_run(cls, auto_encoder_path:Path, cv:int, device, checkpoint_name:str='checkpoint_best', aggregation:str=AGGREGATION_GLOBAL, region_size:int=16):
+        ''' Loads the autoencoder of a fold and the classifier it was trained on (encoder_group, encoder_name of its config).
+
+        Arguments:
+            cls: The ConfidenceScorer class.
+            auto_encoder_path: Location of the autoencoder run.
+            cv: Number of the CV round.
+            device: Hardware to evaluate on.
+            checkpoint_name: Checkpoint of the autoencoder and the classifier, e.g. "checkpoint_best".
+            aggregation: Aggregation of the reconstruction error, see the constructor.
+            region_size: Height and width of the regions of "regional_max".
+        Return:
+            The scorer in eval mode and the configuration of the autoencoder run.
+        '''
+
+        config = read_run_config(auto_encoder_path)
+        if not config['auto_encoder']:
+            raise ValueError('The run "' + str(auto_encoder_path) + '" is no autoencoder.')
+        config.update(compile_model=False)
+        classifier_path = Path('./data/train_and_test', config['encoder_group'], config['encoder_name'])
+        classifier_config = dict(read_run_config(classifier_path), compile_model=False)
+
+        classifier, _ = Checkpoint.load_inference_model(checkpoint_name, classifier_path / ('cv_' + str(cv)), device, classifier_config, cv)
+        auto_encoder, _ = Checkpoint.load_inference_model(checkpoint_name, Path(auto_encoder_path) / ('cv_' + str(cv)), device, config, cv)
+        return cls(classifier, auto_encoder, aggregation, region_size).eval(), config
+
+    def reconstruction_errors(self, inputs:torch.Tensor, reconstructions:torch.Tensor, features:torch.Tensor) -> tuple:
+        ''' Aggregates the reconstruction errors of a batch.
+
+        Arguments:
+            self: The ConfidenceScorer object.
+            inputs: Batch of frames.
+            reconstructions: Outputs of the decoder.
+            features: Outputs of the encoder for the frames.
+        Return:
+            Tuple of the squared and the absolute error per frame.
+        '''
+
+        if self.aggregation == AGGREGATION_LATENT:
+            reconstruction_features = self.encoder(reconstructions)
+            difference = (reconstruction_features.float() - features.float()).flatten(1)
+            return difference.pow(2).mean(dim=1), difference.abs().mean(dim=1)
+
+        difference = reconstructions.float() - inputs.float()
+        squared, absolute = difference.pow(2).mean(dim=1, keepdim=True), difference.abs().mean(dim=1, keepdim=True)
+        if self.aggregation == AGGREGATION_REGIONAL_MAX:
+            squared = F.avg_pool2d(squared, self.region_size, ceil_mode=True)
+            absolute = F.avg_pool2d(absolute, self.region_size, ceil_mode=True)
+            return squared.flatten(1).amax(dim=1), absolute.flatten(1).amax(dim=1)
+        return squared.flatten(1).mean(dim=1), absolute.flatten(1).mean(dim=1)
+
+    def forward(self, inputs:torch.Tensor, classifier_inputs:torch.Tensor=None) -> dict:
+        ''' Classifies a batch and scores the reconstruction with one pass of the shared encoder.
+
+        Arguments:
+            self: The ConfidenceScorer object.
+            inputs: Batch of frames (B, C, H, W), the reconstruction error is always computed on these frames.
+            classifier_inputs: If given, the frames are classified on these inputs instead (e.g. downscaled frames),
+                               which costs a second encoder pass.
+        Return:
+            Dictionary with the "logits" of the classifier and the reconstruction errors "mse" and "l1" per frame.
+        '''
+
+        features = self.encoder(inputs)
+        logits = self.head(features if classifier_inputs is None else self.encoder(classifier_inputs))
+        mse, l1 = self.reconstruction_errors(inputs, self.decoder(features), features)
+        return {'logits': logits, 'mse': mse, 'l1': l1}
+
+    def score(self, dataloader:DataLoader, device, config) -> dict:
+        ''' Scores all frames of a dataset.
+
+        Arguments:
+            self: The ConfidenceScorer object.
+            dataloader: Dataloader of the frames (not shuffled).
+            device: Hardware the scorer is stored on.
+            config: Configuration of the autoencoder run.
+        Return:
+            Dictionary of NumPy arrays "logits", "mse", "l1" and "targets" in the order of the dataset.
+        '''
+
+        self.eval()
+        predictions = PredictionBuffer(len(dataloader.dataset), device)
+        for inputs, labels in dataloader:
+            inputs = inputs.to(device, memory_format=get_memory_format(config))
+            with torch.set_grad_enabled(False):
+                with torch.cuda.amp.autocast():
+                    scores = self(inputs)
+            predictions.add(targets=labels.type(torch.LongTensor).to(device), logits=scores['logits'].float(), mse=scores['mse'], l1=scores['l1'])
+        return {name: predictions.numpy(name) for name in ['logits', 'mse', 'l1', 'targets']}
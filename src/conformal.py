@@ -0,0 +1,145 @@
+import argparse
+import numpy as np
+
+from pathlib import Path
+
+from logit_cache import LogitCache, SPLIT_VALID, SPLIT_TEST
+
+# Conformal prediction sets of a classifier from cached predictions (see logit_cache.py), no model is evaluated again.
+# The nonconformity score of a frame and class is 1 - softmax probability of the class (least ambiguous set-valued
+# classifier), a class is in the prediction set if its score is at most the calibrated quantile.
+# Caveat: the runs calibrate on the validation split, which also selected the checkpoint (early stopping, best epoch).
+# Its frames are therefore not exchangeable with the test frames and the coverage guarantee of 1 - alpha does not
+# strictly hold; the reported test coverage shows how far it is met.
+CALIBRATION_CAVEAT = 'calibrated on the validation split that selected the checkpoint, the coverage is not guaranteed'
+
+def nonconformity_scores(probabilities:np.ndarray, labels:np.ndarray) -> np.ndarray:
+    ''' Computes the nonconformity score of the true class of every frame.
+
+    Arguments:
+        probabilities: Softmax probabilities of shape (N, C).
+        labels: Integer class labels of shape (N,).
+    Return:
+        Scores of shape (N,).
+    '''
+
+    return 1.0 - np.take_along_axis(np.asarray(probabilities, dtype=np.float64), np.asarray(labels, dtype=np.int64)[:, None], axis=1)[:, 0]
+
+def calibrate_quantiles(probabilities:np.ndarray, labels:np.ndarray, alpha:float, class_conditional:bool=False) -> np.ndarray:
+    ''' Computes the conformal quantiles of the calibration scores with the finite-sample correction: the
+    ceil((n + 1)(1 - alpha))-th smallest score of n calibration frames, infinite if there are too few frames.
+    Class-conditional quantiles use only the frames of each class, all classes are handled with one sort.
+
+    Arguments:
+        probabilities: Softmax probabilities of the calibration frames (N, C), e.g. the cached validation split.
+        labels: Integer class labels of shape (N,).
+        alpha: Miscoverage level, the sets contain the true class with probability of at least 1 - alpha.
+        class_conditional: Whether the coverage is guaranteed per class instead of on average.
+    Return:
+        Quantile per class of shape (C,), identical for all classes without class conditioning.
+    '''
+
+    labels = np.asarray(labels, dtype=np.int64)
+    num_out = np.shape(probabilities)[1]
+    scores = nonconformity_scores(probabilities, labels)
+    groups = labels if class_conditional else np.zeros_like(labels)
+
+    # Scores sorted by group, then by score: the k-th smallest score of a group is at its start + k - 1
+    order = np.lexsort((scores, groups))
+    counts = np.bincount(groups, minlength=num_out)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ranks = np.ceil((counts + 1) * (1 - alpha)).astype(np.int64)
+    valid = (ranks >= 1) & (ranks <= counts)
+    quantiles = np.full(num_out, np.inf)
+    quantiles[valid] = scores[order][starts[valid] + ranks[valid] - 1]
+    quantiles[ranks < 1] = -np.inf
+    return quantiles if class_conditional else np.full(num_out, quantiles[0])
+
+def prediction_sets(probabilities:np.ndarray, quantiles:np.ndarray) -> np.ndarray:
+    ''' Builds the prediction sets with the precomputed quantiles, a vectorized comparison per class.
+
+    Arguments:
+        probabilities: Softmax probabilities of shape (N, C).
+        quantiles: Quantile per class of shape (C,), see calibrate_quantiles.
+    Return:
+        Boolean membership of every class in the set of every frame, shape (N, C).
+    '''
+
+    return 1.0 - np.asarray(probabilities, dtype=np.float64) <= np.asarray(quantiles)[None, :]
+
+def set_metrics(sets:np.ndarray, labels:np.ndarray) -> dict:
+    ''' Evaluates prediction sets.
+
+    Arguments:
+        sets: Boolean prediction sets of shape (N, C).
+        labels: Integer class labels of shape (N,).
+    Return:
+        Dictionary with the "coverage", the mean "set_size", the fraction of "singletons" and of "empty" sets and the
+        "class_coverage" per class (NaN for classes without frames).
+    '''
+
+    labels = np.asarray(labels, dtype=np.int64)
+    covered = np.take_along_axis(sets, labels[:, None], axis=1)[:, 0]
+    sizes = sets.sum(axis=1)
+    counts = np.bincount(labels, minlength=sets.shape[1])
+    class_coverage = np.bincount(labels, weights=covered, minlength=sets.shape[1]) / np.where(counts > 0, counts, np.nan)
+    return {
+        'coverage': float(covered.mean()),
+        'set_size': float(sizes.mean()),
+        'singletons': float(np.mean(sizes == 1)),
+        'empty': float(np.mean(sizes == 0)),
+        'class_coverage': class_coverage,
+    }
+
+def conformalize(calibration_records:np.ndarray, probabilities:np.ndarray, labels:np.ndarray, alpha:float, class_conditional:bool=False) -> dict:
+    ''' Calibrates on cached predictions and evaluates the prediction sets of other predictions. The coverage guarantee
+    only holds if the calibration frames are exchangeable with the evaluated ones, which the validation split used for
+    checkpoint selection is not (see CALIBRATION_CAVEAT).
+
+    Arguments:
+        calibration_records: Prediction store of the calibration split (see prediction_store.py).
+        probabilities: Softmax probabilities of the evaluated frames (N, C).
+        labels: Integer class labels of the evaluated frames (N,).
+        alpha: Miscoverage level.
+        class_conditional: Whether the quantiles are calibrated per class.
+    Return:
+        Dictionary of set_metrics with the "quantiles" and the "sets".
+    '''
+
+    quantiles = calibrate_quantiles(calibration_records['softmax'], calibration_records['label'], alpha, class_conditional)
+    sets = prediction_sets(probabilities, quantiles)
+    return dict(set_metrics(sets, labels), quantiles=quantiles, sets=sets)
+
+def analyze_run(save_path:Path, checkpoint_name:str, alpha:float) -> None:
+    ''' Prints the split and class-conditional conformal prediction sets of every fold of a run, calibrated
+    on the cached validation predictions and applied to the cached test predictions.
+
+    Arguments:
+        save_path: Location of the run, e.g. "./data/train_and_test/group/name".
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        alpha: Miscoverage level.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    for save_path_cv in sorted(Path(save_path).glob('cv_*')):
+        cache = LogitCache(save_path_cv)
+        if not (cache.contains(checkpoint_name, SPLIT_VALID) and cache.contains(checkpoint_name, SPLIT_TEST)):
+            print(save_path_cv.name + ': no cached validation and test predictions of', checkpoint_name)
+            continue
+        valid, test = cache.load(checkpoint_name, SPLIT_VALID), cache.load(checkpoint_name, SPLIT_TEST)
+
+        print('\n' + save_path_cv.name, checkpoint_name, '(alpha: ' + str(alpha) + ',', CALIBRATION_CAVEAT + ')')
+        for title, class_conditional in [('   Split:            ', False), ('   Class-conditional:', True)]:
+            results = conformalize(valid, test['softmax'], test['label'], alpha, class_conditional)
+            print(title, 'coverage', round(results['coverage'], 4), ', set size', round(results['set_size'], 4),
+                  ', singletons', round(results['singletons'], 4), ', class coverage', np.round(results['class_coverage'], 4))
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Conformal prediction sets of cached predictions')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-a', '--alpha', default=0.1, type=float, help='miscoverage level (default: 0.1)')
+    args = args.parse_args()
+
+    analyze_run(args.run, args.checkpoint, args.alpha)
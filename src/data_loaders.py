@@ -15,7 +15,7 @@ class Dataloaders():
             pin_memory = True)
 
     @classmethod
-    def setup_data_loaders_training(cls, train_ind_for_cv, train_eval_ind_for_cv, valid_ind_for_cv, cust_data, config):
+    def setup_data_loaders_training(cls, train_ind_for_cv, train_eval_ind_for_cv, valid_ind_for_cv, cust_data, config, teacher_logits=None):
         # TODO: The following print commands do not belong here
         print('Images for training:                ', len(train_ind_for_cv))
         print('Images for testing while training:  ', len(train_eval_ind_for_cv))
@@ -27,7 +27,7 @@ class Dataloaders():
 
         num_workers = 1 # len(config['gpus']) * 4 # Recommended by Pytorch Docs # TODO
         cls.trainInd = DataLoader(
-            IVOCT_Dataset(train_ind_for_cv, cust_data.label_data, cust_data.all_files_paths, config, for_train=True),
+            IVOCT_Dataset(train_ind_for_cv, cust_data.label_data, cust_data.all_files_paths, config, for_train=True, teacher_logits=teacher_logits),
             batch_size = config['batch_size'],
             shuffle = True,
             num_workers = num_workers,
@@ -1,4 +1,6 @@
 
+import os
+import re
 import numpy as np
 from torch.utils.data import Dataset
 import h5py
@@ -8,11 +10,13 @@ from da_techniques import DataAugmentationTechniques
 from torchvision import transforms as T
 
 class IVOCT_Dataset(Dataset):
-    def __init__(self, ind_set:list, label_data, all_files_paths, config, for_train=False):
+    def __init__(self, ind_set:list, label_data, all_files_paths, config, for_train=False, teacher_logits=None):
         self.for_train = for_train
+        self.teacher_logits = teacher_logits # cached logits of a teacher ensemble per file for distillation (see teacher_cache.py)
         self.indices = ind_set
         self.preload = config['preload']
         self.transformations_chosen = config['transformations_chosen']
+        self.all_files_paths = all_files_paths
         self.datasets = [h5py.File(path, 'r')['raw'] for path in all_files_paths]
         self.label_data = label_data
         
@@ -44,4 +48,76 @@ class IVOCT_Dataset(Dataset):
         image_tensor = DataAugmentationTechniques.transform_image(image, self.transformations_chosen, self.for_train)
         label = self.label_data[elem_idx].astype(np.float32)
         
+        if self.teacher_logits is not None:
+            return image_tensor, label, np.asarray(self.teacher_logits[elem_idx], dtype=np.float32)
         return image_tensor, label
+
+    def sample_info(self) -> dict:
+        ''' Gets the identity of every sample in the order of the dataset, e.g. to store predictions per sample.
+        The pullback is the directory of the file, the frame the last number in its file name.
+
+        Arguments:
+            self: The IVOCT_Dataset object.
+        Return:
+            Dictionary with the arrays "sample_id" (pullback directory and file name), "sample_index" (index of the
+            file), "pullback" and "frame" (-1 if unknown).
+        '''
+
+        sample_indices = np.asarray(self.indices, dtype=np.int64)
+        paths = [self.all_files_paths[index] for index in sample_indices]
+        frames = [re.findall(r'\d+', os.path.splitext(os.path.basename(path))[0]) for path in paths]
+        pullbacks = [os.path.basename(os.path.dirname(path)) for path in paths]
+        return {
+            'sample_id': np.array([pullback + '/' + os.path.basename(path) for pullback, path in zip(pullbacks, paths)]),
+            'sample_index': sample_indices,
+            'pullback': np.array(pullbacks),
+            'frame': np.array([int(numbers[-1]) if numbers else -1 for numbers in frames], dtype=np.int32),
+        }
+
+class IVOCT_InferenceDataset(Dataset):
+    ''' Unlabeled frames for inference, read from a folder of h5 files, a .npy file of images (N, H, W) or a
+    consolidated .npz store with the arrays "images" (N, H, W) and optionally "pullbacks" and "frames".
+    Frames are transformed like the evaluation data of training (no data augmentation).
+    '''
+
+    def __init__(self, source:str, config):
+        self.transformations_chosen = config['transformations_chosen']
+        self.source = source
+
+        if os.path.isfile(source):
+            # A .npy file of images is memory-mapped, frames are only read when accessed
+            store = {'images': np.load(source, mmap_mode='r')} if source.endswith('.npy') else np.load(source)
+            self.images = store['images']
+            self.files = np.full(len(self.images), os.path.basename(source))
+            self.pullbacks = store['pullbacks'] if 'pullbacks' in store else np.full(len(self.images), '')
+            self.frames = store['frames'] if 'frames' in store else np.arange(len(self.images))
+        else:
+            paths = sorted(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(source) for filename in filenames if '.h5' in filename)
+            assert paths, "No h5 files found in " + source
+            self.images = None
+            self.paths = paths
+            self.files = np.array([os.path.relpath(path, source) for path in paths])
+            self.pullbacks = np.array([os.path.basename(os.path.dirname(path)) for path in paths])
+            frames = [re.findall(r'\d+', os.path.splitext(os.path.basename(path))[0]) for path in paths]
+            self.frames = np.array([int(numbers[-1]) if numbers else -1 for numbers in frames])
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, idx):
+        if self.images is not None:
+            image = np.asarray(self.images[idx])
+        else:
+            with h5py.File(self.paths[idx], 'r') as file:
+                image = np.squeeze(file['raw'][:])
+
+        image_tensor = DataAugmentationTechniques.transform_image(image, self.transformations_chosen, False)
+        return image_tensor, idx
+
+    def sample_info(self) -> dict:
+        return {
+            'sample_id': np.asarray(self.files).astype(str) if self.images is None else np.arange(len(self)).astype(str),
+            'sample_index': np.arange(len(self), dtype=np.int64),
+            'pullback': np.asarray(self.pullbacks).astype(str),
+            'frame': np.asarray(self.frames, dtype=np.int32),
+        }
@@ -0,0 +1,22 @@
+import torch
+import torch.nn.functional as F
+
+def distillation_loss(student_logits:torch.Tensor, teacher_logits:torch.Tensor, labels:torch.Tensor, hard_loss_function, temperature:float, alpha:float) -> torch.Tensor:
+    ''' Knowledge distillation loss: the weighted sum of the KL divergence to the soft targets of the teacher ensemble
+    (mean of the tempered member probabilities, scaled by the squared temperature) and the loss to the hard labels.
+
+    Arguments:
+        student_logits: Logits of the student (B, C).
+        teacher_logits: Cached logits of all teacher members (B, M, C).
+        labels: Class labels (B,).
+        hard_loss_function: Loss of the student to the hard labels, e.g. the weighted cross entropy of training.
+        temperature: Softmax temperature of teacher and student.
+        alpha: Weight of the distillation term, 1 - alpha is the weight of the hard label loss.
+    Return:
+        Mean loss of the batch.
+    '''
+
+    soft_targets = torch.softmax(teacher_logits.float() / temperature, dim=2).mean(dim=1)
+    student_log_probabilities = F.log_softmax(student_logits.float() / temperature, dim=1)
+    soft_loss = F.kl_div(student_log_probabilities, soft_targets, reduction='batchmean') * temperature**2
+    return alpha * soft_loss + (1 - alpha) * hard_loss_function(student_logits, labels)
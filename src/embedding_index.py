@@ -0,0 +1,345 @@
+import os
+import time
+import torch
+import argparse
+import numpy as np
+import torch.nn as nn
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+
+from utils import Utils
+from checkpoint import Checkpoint
+from dataset import IVOCT_Dataset
+from dataset_preparation import DatasetPreparation
+from compilation import get_memory_format
+from metrics import auc_one_vs_rest
+from predict import read_run_config
+
+FILE_NAME_EMBEDDING_INDEX = 'embedding_index_{}.npz'
+
+class EmbeddingExtractor():
+    ''' Captures the penultimate-layer embeddings of a classifier, i.e. the input of its last linear layer
+    (ResNet18.net.fc, the last layer of VGG19.net.classifier or the fc after the pooled UNet contracting_path),
+    with a forward pre-hook during the normal forward pass.
+    '''
+
+    def __init__(self, model:nn.Module):
+        linear_layers = [module for module in model.modules() if isinstance(module, nn.Linear)]
+        if not linear_layers:
+            raise ValueError('The model "' + type(model).__name__ + '" has no linear layer.')
+        self.embeddings = None
+        self.handle = linear_layers[-1].register_forward_pre_hook(self._hook)
+
+    def _hook(self, module, inputs):
+        self.embeddings = inputs[0].detach().flatten(1)
+
+    def remove(self) -> None:
+        self.handle.remove()
+
+class EmbeddingIndex():
+    ''' Index of float16 embeddings (e.g. of the training folds) to score the confidence of new frames by their distance
+    to the training data: the distance to the k-th nearest neighbour (exact with batched matrix multiplications or
+    approximate with an inverted file of k-means lists) or the Mahalanobis distance to the closest class centroid with
+    a covariance shared by all classes. Embeddings are added incrementally, the class statistics are accumulated on the fly.
+    '''
+
+    def __init__(self, dim:int, num_out:int, normalize:bool=True):
+        ''' Creates an empty index.
+
+        Arguments:
+            self: The EmbeddingIndex object itself.
+            dim: Dimension of the embeddings.
+            num_out: Number of classes.
+            normalize: Whether the embeddings are L2 normalized (kNN distances on the unit sphere).
+        Return:
+            The class constructor returns an "EmbeddingIndex" object.
+        '''
+
+        self.dim = dim
+        self.num_out = num_out
+        self.normalize = normalize
+        self.embeddings = np.zeros((0, dim), dtype=np.float16)
+        self.labels = np.zeros(0, dtype=np.int16)
+        self.pending = [] # embeddings and labels added since the last consolidation
+        self.class_counts = np.zeros(num_out, dtype=np.int64)
+        self.class_sums = np.zeros((num_out, dim), dtype=np.float64)
+        self.second_moment = np.zeros((dim, dim), dtype=np.float64)
+        self.centroids = None # k-means centroids of the inverted file
+        self.lists = None # list number of every embedding
+
+    def __len__(self):
+        return len(self.embeddings) + sum(len(labels) for _, labels in self.pending)
+
+    def _prepare(self, embeddings) -> np.ndarray:
+        embeddings = torch.as_tensor(embeddings).float().cpu()
+        if self.normalize:
+            embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+        return embeddings.numpy()
+
+    def add(self, embeddings, labels) -> None:
+        ''' Adds embeddings of labeled frames.
+
+        Arguments:
+            self: The EmbeddingIndex object.
+            embeddings: Embeddings of shape (N, dim) as tensor or array.
+            labels: Class labels of shape (N,).
+        Return:
+            This Method has nothing to return.
+        '''
+
+        embeddings = self._prepare(embeddings).astype(np.float64)
+        labels = np.asarray(torch.as_tensor(labels).cpu(), dtype=np.int64)
+        self.class_counts += np.bincount(labels, minlength=self.num_out)
+        np.add.at(self.class_sums, labels, embeddings)
+        self.second_moment += embeddings.T @ embeddings
+        self.pending.append((embeddings.astype(np.float16), labels.astype(np.int16)))
+
+    def _consolidate(self) -> None:
+        # Appends the pending embeddings, assigns them to the lists of the inverted file if it is trained
+        if not self.pending:
+            return
+        new_embeddings = np.concatenate([embeddings for embeddings, _ in self.pending])
+        self.embeddings = np.concatenate([self.embeddings, new_embeddings])
+        self.labels = np.concatenate([self.labels] + [labels for _, labels in self.pending])
+        if self.centroids is not None:
+            self.lists = np.concatenate([self.lists, self._nearest(new_embeddings, self.centroids, 1)[1][:, 0]])
+        self.pending = []
+
+    @staticmethod
+    def _nearest(queries:np.ndarray, references:np.ndarray, k:int, chunk_size:int=65536) -> tuple:
+        ''' Exact k nearest neighbours by squared Euclidean distance, ||q||^2 - 2 q.r + ||r||^2 with one matrix
+        multiplication per chunk of references, the running top k is merged chunk by chunk.
+
+        Arguments:
+            queries: Array of shape (Q, dim).
+            references: Array of shape (R, dim), e.g. float16.
+            k: Number of neighbours (at most R).
+            chunk_size: Number of references per matrix multiplication.
+        Return:
+            Tuple of the squared distances and the indices of the neighbours, both of shape (Q, k).
+        '''
+
+        queries = torch.as_tensor(queries, dtype=torch.float32)
+        query_norms = queries.pow(2).sum(dim=1, keepdim=True)
+        best_distances = torch.full((len(queries), 0), float('inf'))
+        best_indices = torch.zeros((len(queries), 0), dtype=torch.int64)
+
+        for start in range(0, len(references), chunk_size):
+            chunk = torch.as_tensor(np.asarray(references[start:start + chunk_size]), dtype=torch.float32)
+            distances = query_norms - 2 * queries @ chunk.T + chunk.pow(2).sum(dim=1)
+            distances = torch.cat([best_distances, distances.clamp_min(0)], dim=1)
+            indices = torch.cat([best_indices, torch.arange(start, start + len(chunk)).expand(len(queries), -1)], dim=1)
+            best_distances, positions = torch.topk(distances, min(k, distances.shape[1]), dim=1, largest=False)
+            best_indices = indices.gather(1, positions)
+
+        return best_distances.numpy(), best_indices.numpy()
+
+    def train_ivf(self, num_lists:int, iterations:int=10, seed:int=18) -> None:
+        ''' Trains the inverted file of the approximate search: the embeddings are clustered with k-means into num_lists
+        lists, a query only searches the lists of its closest centroids. Embeddings added later are assigned to their list.
+
+        Arguments:
+            self: The EmbeddingIndex object.
+            num_lists: Number of lists (k-means clusters), e.g. about the square root of the size of the index.
+            iterations: Number of k-means iterations.
+            seed: Seed of the initial centroids.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        self._consolidate()
+        embeddings = self.embeddings.astype(np.float32)
+        rng = np.random.default_rng(seed)
+        centroids = embeddings[rng.choice(len(embeddings), num_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = self._nearest(embeddings, centroids, 1)[1][:, 0]
+            counts = np.bincount(assignments, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, embeddings)
+            centroids = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids) # empty lists keep their centroid
+        self.centroids = centroids.astype(np.float32)
+        self.lists = self._nearest(embeddings, self.centroids, 1)[1][:, 0]
+
+    def knn_distance(self, queries, k:int=10, num_probes:int=None) -> np.ndarray:
+        ''' Distance of every query to its k-th nearest neighbour in the index, large distances indicate unfamiliar frames.
+
+        Arguments:
+            self: The EmbeddingIndex object.
+            queries: Embeddings of shape (Q, dim).
+            k: Number of neighbours.
+            num_probes: Number of lists searched per query (approximate search, requires train_ivf), None searches all embeddings.
+        Return:
+            Euclidean distance to the k-th neighbour per query (Q,).
+        '''
+
+        self._consolidate()
+        queries = self._prepare(queries)
+        if num_probes is None or self.centroids is None:
+            return np.sqrt(self._nearest(queries, self.embeddings, k)[0][:, -1])
+
+        # Queries are grouped by probed list, each list is searched once for all its queries
+        probes = self._nearest(queries, self.centroids, num_probes)[1]
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for list_number in np.unique(probes):
+            query_indices = np.flatnonzero((probes == list_number).any(axis=1))
+            members = self.embeddings[self.lists == list_number]
+            if len(members) == 0:
+                continue
+            distances = self._nearest(queries[query_indices], members, k)[0]
+            merged = np.concatenate([best_distances[query_indices], distances], axis=1)
+            best_distances[query_indices] = np.sort(merged, axis=1)[:, :k]
+        return np.sqrt(best_distances[:, -1])
+
+    def mahalanobis_distance(self, queries, epsilon:float=1e-6) -> tuple:
+        ''' Mahalanobis distance of every query to the closest class centroid, with the covariance of the embeddings
+        around their class centroids shared by all classes.
+
+        Arguments:
+            self: The EmbeddingIndex object.
+            queries: Embeddings of shape (Q, dim).
+            epsilon: Regularization of the covariance relative to its mean variance.
+        Return:
+            Tuple of the squared distance to the closest centroid (Q,) and the class of this centroid (Q,).
+        '''
+
+        counts = np.maximum(self.class_counts, 1)
+        means = self.class_sums / counts[:, None]
+        covariance = (self.second_moment - (means.T * self.class_counts) @ means) / max(self.class_counts.sum(), 1)
+        covariance += epsilon * np.trace(covariance) / self.dim * np.eye(self.dim) + 1e-12 * np.eye(self.dim)
+        precision = np.linalg.inv(covariance)
+
+        queries = self._prepare(queries).astype(np.float64)
+        # (q - m)^T P (q - m) for all queries and centroids with matrix multiplications
+        query_terms = np.einsum('qd,de,qe->q', queries, precision, queries)
+        cross_terms = queries @ precision @ means.T
+        mean_terms = np.einsum('cd,de,ce->c', means, precision, means)
+        distances = query_terms[:, None] - 2 * cross_terms + mean_terms
+        distances[:, self.class_counts == 0] = np.inf
+        return distances.min(axis=1), distances.argmin(axis=1)
+
+    def save(self, path:Path) -> None:
+        ''' Stores the index as .npz file atomically (temporary file and rename).
+
+        Arguments:
+            self: The EmbeddingIndex object.
+            path: Location of the file.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        self._consolidate()
+        path = Path(path)
+        arrays = {
+            'embeddings': self.embeddings, 'labels': self.labels, 'class_counts': self.class_counts,
+            'class_sums': self.class_sums, 'second_moment': self.second_moment, 'normalize': np.array(self.normalize),
+        }
+        if self.centroids is not None:
+            arrays.update(centroids=self.centroids, lists=self.lists)
+        temp_path = path.with_name(path.name + '.tmp')
+        with open(temp_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path:Path):
+        ''' Loads a stored index, more embeddings can be added afterwards.
+
+        Arguments:
+            cls: The EmbeddingIndex class.
+            path: Location of the file.
+        Return:
+            The EmbeddingIndex object.
+        '''
+
+        with np.load(path) as arrays:
+            index = cls(arrays['embeddings'].shape[1], len(arrays['class_counts']), bool(arrays['normalize']))
+            for name in ['embeddings', 'labels', 'class_counts', 'class_sums', 'second_moment']:
+                setattr(index, name, arrays[name])
+            if 'centroids' in arrays:
+                index.centroids, index.lists = arrays['centroids'], arrays['lists']
+        return index
+
+def extract_embeddings(model:nn.Module, dataloader:DataLoader, device, config) -> dict:
+    ''' Runs a classifier on a dataset and collects its penultimate-layer embeddings.
+
+    Arguments:
+        model: The classifier in eval mode.
+        dataloader: Dataloader of the frames.
+        device: Hardware the model is stored on.
+        config: Configuration of the run.
+    Return:
+        Dictionary of NumPy arrays "embeddings" (float16), "logits" and "targets" in the order of the dataset.
+    '''
+
+    extractor = EmbeddingExtractor(model)
+    embeddings, logits, targets = [], [], []
+    try:
+        for inputs, labels in dataloader:
+            inputs = inputs.to(device, memory_format=get_memory_format(config))
+            with torch.set_grad_enabled(False):
+                with torch.cuda.amp.autocast():
+                    outputs = model(inputs)
+            embeddings.append(extractor.embeddings.half().cpu().numpy())
+            logits.append(outputs.float().cpu().numpy())
+            targets.append(labels.numpy().astype(np.int64))
+    finally:
+        extractor.remove()
+    return {'embeddings': np.concatenate(embeddings), 'logits': np.concatenate(logits), 'targets': np.concatenate(targets)}
+
+def main(run_path:Path, cv:int, checkpoint_name:str, k:int, num_lists:int, num_probes:int, rebuild:bool) -> None:
+    config = read_run_config(run_path)
+    if config['auto_encoder']:
+        raise ValueError('Embedding indices are only supported for classifiers.')
+
+    device = Utils.config_torch_and_cuda(config) if torch.cuda.is_available() else torch.device('cpu')
+    save_path_cv = Path(run_path) / ('cv_' + str(cv))
+    model, _ = Checkpoint.load_inference_model(checkpoint_name, save_path_cv, device, config, cv)
+
+    cust_data = DatasetPreparation(config)
+    _, train_ind = cust_data.get_train_valid_ind(cv - 1)
+    index_path = save_path_cv / FILE_NAME_EMBEDDING_INDEX.format(checkpoint_name)
+
+    if os.path.isfile(index_path) and not rebuild:
+        index = EmbeddingIndex.load(index_path)
+    else:
+        train_loader = DataLoader(IVOCT_Dataset(train_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'], num_workers=1, pin_memory=True)
+        train = extract_embeddings(model, train_loader, device, config)
+        index = EmbeddingIndex(train['embeddings'].shape[1], config['num_out'])
+        index.add(train['embeddings'], train['targets'])
+        if num_lists:
+            index.train_ivf(num_lists)
+        index.save(index_path)
+        print('Embedding index of', len(index), 'training frames stored in', index_path)
+
+    test_loader = DataLoader(IVOCT_Dataset(cust_data.test_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'], num_workers=1, pin_memory=True)
+    test = extract_embeddings(model, test_loader, device, config)
+    incorrect = (test['logits'].argmax(axis=1) != test['targets']).astype(np.int64)
+
+    # Large distances should indicate misclassified frames, the AUC of the score measures how well
+    scores = {}
+    start_time = time.time()
+    scores['kNN'] = index.knn_distance(test['embeddings'], k)
+    print('kNN (exact):', len(test['targets']), 'queries in', round(time.time() - start_time, 2), 's')
+    if index.centroids is not None:
+        start_time = time.time()
+        scores['kNN (IVF)'] = index.knn_distance(test['embeddings'], k, num_probes)
+        print('kNN (IVF):  ', len(test['targets']), 'queries in', round(time.time() - start_time, 2), 's')
+    scores['Mahalanobis'] = index.mahalanobis_distance(test['embeddings'])[0]
+
+    for name, score in scores.items():
+        auc = auc_one_vs_rest(np.stack([-score, score], axis=1), incorrect, 2)[1]
+        print('{:<12} AUC (misclassification): {:.4f}'.format(name, auc))
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Embedding-space nearest-neighbour confidence of a classifier')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-cv', '--fold', default=1, type=int, help='CV round, its training folds are indexed (default: 1)')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-k', '--neighbours', default=10, type=int, help='k of the kNN distance (default: 10)')
+    args.add_argument('-nl', '--num_lists', default=0, type=int, help='lists of the approximate inverted file, 0 for exact search only (default: 0)')
+    args.add_argument('-np', '--num_probes', default=4, type=int, help='lists searched per query (default: 4)')
+    args.add_argument('-rb', '--rebuild', action='store_true', help='rebuild a stored index')
+    args = args.parse_args()
+
+    main(Path(args.run), args.fold, args.checkpoint, args.neighbours, args.num_lists, args.num_probes, args.rebuild)
@@ -0,0 +1,153 @@
+import copy
+import torch
+
+from pathlib import Path
+
+from checkpoint import Checkpoint
+from checkpoint_index import CheckpointIndex, KIND_TRAINING, KIND_INFERENCE
+from compilation import get_memory_format
+from accumulators import PredictionBuffer
+from metrics import compute_metrics, METRIC_NAMES
+from uncertainty import predictive_uncertainty
+from prediction_store import get_sample_info, create_prediction_store, save_prediction_store, PREDICTION_STORE_SUFFIX
+
+class EnsembleEval():
+    ''' Results of an ensemble on a dataset, with the attributes of an Eval object used by Logger and Wandb. '''
+
+    def __init__(self, mean_loss, metrics, confusion_matrix, roc_auc, weighted_accuracy, mean_disagreement, mean_agreement):
+        self.mean_loss = mean_loss
+        self.metrics = metrics
+        self.confusion_matrix = confusion_matrix
+        self.roc_auc = roc_auc
+        self.weighted_accuracy = weighted_accuracy
+        self.mean_disagreement = mean_disagreement
+        self.mean_agreement = mean_agreement
+
+class FoldEnsemble():
+    ''' Ensemble of the models of all CV rounds (folds) of a run. All models are loaded once and every batch is
+    preprocessed and moved to the device once for all of them. If the models share their architecture, the parameters
+    are stacked and all models are evaluated in one vectorized call (torch.func.vmap), otherwise one after another.
+    The disagreement of a sample is the mutual information between prediction and member (see uncertainty.py).
+    '''
+
+    def __init__(self, models:list, device, config, vectorize:bool=True):
+        ''' Creates the ensemble.
+
+        Arguments:
+            self: The FoldEnsemble object itself.
+            models: The models of the folds, all in eval mode.
+            device: Hardware the models are stored on.
+            config: Dictionary of the configurations.
+            vectorize: Whether the models are evaluated with stacked parameters.
+        Return:
+            The class constructor returns a "FoldEnsemble" object.
+        '''
+
+        if config['auto_encoder']:
+            raise ValueError('Ensembles are only supported for classifiers.')
+
+        self.models = models
+        self.device = device
+        self.config = config
+        self.vectorized_forward = self._get_vectorized_forward() if vectorize and len(models) > 1 else None
+
+    @classmethod
+    def from_run(cls, save_path:Path, device, config, checkpoint_name:str='checkpoint_best', vectorize:bool=True):
+        ''' Loads the stored checkpoint of every CV round of a run.
+
+        Arguments:
+            cls: The FoldEnsemble class.
+            save_path: Location of the run, with one "cv_<number>" directory per fold.
+            device: Hardware to evaluate on.
+            config: Dictionary of the configurations of the run.
+            checkpoint_name: Name of the checkpoint loaded of every fold.
+            vectorize: Whether the models are evaluated with stacked parameters.
+        Return:
+            The ensemble of all folds with this checkpoint.
+        '''
+
+        models = []
+        for cv in range(config['num_cv']):
+            save_path_cv = Path(save_path) / ('cv_' + str(cv + 1))
+            index = CheckpointIndex(save_path_cv)
+            if index.get(checkpoint_name, KIND_TRAINING) is None and index.get(checkpoint_name, KIND_INFERENCE) is None:
+                print('Ensemble: no', checkpoint_name, 'in', save_path_cv)
+                continue
+            model, _ = Checkpoint.load_inference_model(checkpoint_name, save_path_cv, device, config, cv + 1)
+            models.append(model)
+
+        if not models:
+            raise FileNotFoundError('No checkpoint "' + checkpoint_name + '" found in ' + str(save_path))
+        return cls(models, device, config, vectorize)
+
+    def _get_vectorized_forward(self):
+        # Parameters and buffers of all models are stacked, a stateless copy of the first model on the meta device runs them.
+        try:
+            params, buffers = torch.func.stack_module_state(self.models)
+            base_model = copy.deepcopy(self.models[0]).to('meta')
+            base_model.__dict__.pop('forward', None) # compiled models override the forward method of their instance
+
+            def forward_one(model_params, model_buffers, inputs):
+                return torch.func.functional_call(base_model, (model_params, model_buffers), (inputs,))
+
+            vectorized = torch.vmap(forward_one, in_dims=(0, 0, None))
+            return lambda inputs: vectorized(params, buffers, inputs)
+        except Exception as error:
+            print('Ensemble: models can not be stacked, they are evaluated one after another (' + str(error) + ')')
+            return None
+
+    def forward(self, inputs:torch.Tensor) -> torch.Tensor:
+        ''' Runs all models on a batch.
+
+        Arguments:
+            self: The FoldEnsemble object.
+            inputs: Batch of inputs on the device.
+        Return:
+            Logits of all models, shape (models, batch size, classes).
+        '''
+
+        if self.vectorized_forward is not None:
+            try:
+                return self.vectorized_forward(inputs)
+            except Exception as error:
+                print('Ensemble: vectorized evaluation failed, the models are evaluated one after another (' + str(error) + ')')
+                self.vectorized_forward = None
+        return torch.stack([model(inputs) for model in self.models])
+
+    def evaluate(self, dataloader, save_path:Path=None, checkpoint_name:str='checkpoint_best') -> EnsembleEval:
+        ''' Evaluates the ensemble on a dataset, the classification is the argmax of the mean probabilities.
+
+        Arguments:
+            self: The FoldEnsemble object.
+            dataloader: Dataloader of the evaluated dataset (not shuffled).
+            save_path: If given, the predictions are stored as prediction store in this directory.
+            checkpoint_name: Name of the checkpoint of the members, used for the name of the prediction store.
+        Return:
+            The results of the ensemble.
+        '''
+
+        predictions = PredictionBuffer(len(dataloader.dataset), self.device)
+        for inputs, labels in dataloader:
+            inputs = inputs.to(self.device, memory_format=get_memory_format(self.config))
+
+            with torch.set_grad_enabled(False):
+                with torch.cuda.amp.autocast():
+                    summary = predictive_uncertainty(self.forward(inputs))
+
+            predictions.add(targets=labels.type(torch.LongTensor).to(self.device), mean_probabilities=summary['mean_probabilities'],
+                            disagreement=summary['mutual_information'], agreement=summary['agreement'])
+
+        mean_probabilities, targets = predictions['mean_probabilities'], predictions['targets']
+        log_probabilities = torch.log(mean_probabilities.clamp_min(1e-12))
+        losses = torch.nn.functional.nll_loss(log_probabilities, targets, reduction='none')
+        metrics = compute_metrics(log_probabilities, targets, self.config['num_out'])
+
+        if save_path is not None:
+            store = create_prediction_store(get_sample_info(dataloader.dataset), targets.cpu().numpy(), self.config['num_out'],
+                                            logits=log_probabilities.cpu().numpy(), softmax=mean_probabilities.cpu().numpy(),
+                                            ce_loss=losses.cpu().numpy(), linear_loss=-mean_probabilities.gather(1, targets[:, None])[:, 0].cpu().numpy())
+            save_prediction_store(store, Path(save_path) / ('ensemble_' + checkpoint_name + '_test' + PREDICTION_STORE_SUFFIX))
+
+        return EnsembleEval(float(losses.mean()), [float(metrics[name]) for name in METRIC_NAMES], metrics['confusion_matrix'],
+                            metrics['roc_auc'], metrics['weighted_accuracy'],
+                            float(predictions['disagreement'].mean()), float(predictions['agreement'].mean()))
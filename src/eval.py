@@ -1,276 +1,232 @@
 
 import torch
 import numpy as np
-import matplotlib.pyplot as plt
 import torch.nn.functional as F
-import math
 import torch.nn as nn
 from pathlib import Path
-import os
-from PIL import Image
-from torchvision.transforms import ToPILImage
-import torchvision.transforms as T
-import skimage
 
-from sklearn.metrics import confusion_matrix, f1_score, auc, roc_curve
+from compilation import get_memory_format
+from accumulators import PredictionBuffer, SampleReservoir
+from artifact_renderer import ArtifactRenderer, render_loss_distribution_plot, render_risk_coverage_curve, render_auto_encoder_samples
+from prediction_store import get_sample_info, create_prediction_store, join_by_sample_id
+from logit_cache import LogitCache, SPLIT_VALID, SPLIT_TEST
+from conformal import conformalize
+from uncertainty import mc_dropout_predict
+from tta import TestTimeAugmentation
+from metrics import compute_metrics, safe_divide, average_loss_by_coverage, METRIC_NAMES
+from selective_prediction import confidences_from_logits, compare_confidence_scores
+
+# Number of example images exported of the autoencoder test results
+NUM_EXAMPLE_IMAGES = 20
 
 class Eval():
-    def __init__(self, dataloader, device, model, config, save_path_cv, cv, checkpoint_name=None, class_weights=None):
+    renderer = None
+    conformal = None # prediction sets of the test split, see conformal.py
+    selective = None # risk-coverage comparison of the confidence scores, see selective_prediction.py
+
+    def __init__(self, dataloader, device, model, config, save_path_cv, cv, checkpoint_name=None, class_weights=None, split=SPLIT_TEST):
         model.eval()
         
-        for i, (inputs, labels) in enumerate(dataloader):
-            inputs = inputs.to(device)
+        # Per-sample results are written into preallocated buffers, full inputs are only kept for the example images
+        predictions = PredictionBuffer(len(dataloader.dataset), device)
+        example_reservoir = SampleReservoir(NUM_EXAMPLE_IMAGES) if checkpoint_name and config["auto_encoder"] else None
+        
+        if config["auto_encoder"]:
+            mse_loss_function = nn.MSELoss(reduction='none')
+            me_loss_function = nn.L1Loss(reduction='none') # Mean Error
+        else:
+            ce_loss = nn.CrossEntropyLoss(reduction='none') # no weights here
+            softmax_function = nn.Softmax(dim=1)
+            nllloss_function = nn.NLLLoss(reduction='none')
+        
+        # MC dropout: the outputs are the log of the mean probabilities of the stochastic forward passes.
+        # Only for the evaluations of checkpoints, the per-epoch validation stays a single deterministic pass
+        mc_dropout_samples = config['mc_dropout_samples'] if checkpoint_name is not None and not config["auto_encoder"] and getattr(model, 'num_dropout_seeds', 0) else 0
+        # Test-time augmentation: the same for the mean probabilities of the augmented views, also only for checkpoints
+        tta_views = config['tta_views'] if checkpoint_name is not None and not config["auto_encoder"] and not mc_dropout_samples else 0
+        
+        for batch_index, (inputs, labels) in enumerate(dataloader):
+            inputs = inputs.to(device, memory_format=get_memory_format(config))
             labels_long = labels.type(torch.LongTensor).to(device)
-            labels = labels.to(device)
             
             with torch.set_grad_enabled(False):
                 with torch.cuda.amp.autocast():
 
-                    outputs = model(inputs)
+                    if mc_dropout_samples:
+                        uncertainty = mc_dropout_predict(model, inputs, mc_dropout_samples, seed=batch_index)
+                        outputs = torch.log(uncertainty['mean_probabilities'].clamp_min(1e-12))
+                    elif tta_views:
+                        uncertainty = self.get_tta(config, model, inputs).predict(model, inputs)
+                        outputs = torch.log(uncertainty['mean_probabilities'].clamp_min(1e-12))
+                    else:
+                        outputs = model(inputs)
                     
                     if config["auto_encoder"]:
-                        mse_loss_function = nn.MSELoss(reduction='none')
                         loss_elementwise = mse_loss_function(outputs, inputs)
                         loss_each = torch.mean(loss_elementwise, dim=[1,2,3]) # loss for each image in batch (8 floats for batch size 8)
                         
-                        me_loss_function = nn.L1Loss(reduction='none') # Mean Error
                         loss_linear_elementwise = me_loss_function(outputs, inputs)
                         loss_linear_each = torch.mean(loss_linear_elementwise, dim=[1,2,3])
                     else:
-                        ce_loss = nn.CrossEntropyLoss(class_weights=class_weights, reduction='none') # no weights here
                         loss_each = ce_loss(outputs, labels_long)
                         
                         # cross-entropy loss without log
-                        softmax_function = nn.Softmax(dim=1)
                         outputs_softmax = softmax_function(outputs)
-                        nllloss_function = nn.NLLLoss(reduction='none')
                         loss_linear_each = nllloss_function(outputs_softmax, labels_long)
-                
-            if i == 0:
-                loss_all_tensor = loss_each
-                loss_linear_all_tensor = loss_linear_each
-                targets_all_tensor = labels_long
-                predictions_all_tensor = outputs
-                inputs_all_tensor = inputs
-                    
-            else:
-                loss_all_tensor = torch.cat([loss_all_tensor, loss_each], 0)
-                loss_linear_all_tensor = torch.cat([loss_linear_all_tensor, loss_linear_each], 0)
-                targets_all_tensor = torch.cat([targets_all_tensor, labels_long], 0)
-                predictions_all_tensor = torch.cat([predictions_all_tensor, outputs], 0)
-                inputs_all_tensor = torch.cat([inputs_all_tensor, inputs], 0)
-                    
+            
+            batch_results = {'loss': loss_each, 'loss_linear': loss_linear_each, 'targets': labels_long}
+            if not config["auto_encoder"]:
+                batch_results['outputs'] = outputs
+            if mc_dropout_samples:
+                batch_results.update(mc_entropy=uncertainty['entropy'], mc_mutual_information=uncertainty['mutual_information'])
+            elif tta_views:
+                batch_results.update(tta_variance=uncertainty['variance'], tta_agreement=uncertainty['agreement'])
+            predictions.add(**batch_results)
+            if example_reservoir is not None:
+                example_reservoir.add(inputs, outputs)
 
         # To numpy arrays
-        loss_all = loss_all_tensor.cpu().numpy()
-        loss_linear_all = loss_linear_all_tensor.cpu().numpy()
+        loss_all = predictions.numpy('loss')
+        loss_linear_all = predictions.numpy('loss_linear')
         self.mean_loss = np.mean(loss_all)
         self.mean_loss_linear = np.mean(loss_linear_all)
+        targets_all_tensor = predictions['targets']
         targets_np = targets_all_tensor.cpu().numpy()
-        predictions_np = predictions_all_tensor.cpu().numpy()
-
+        if mc_dropout_samples:
+            self.mc_entropy = predictions.numpy('mc_entropy')
+            self.mc_mutual_information = predictions.numpy('mc_mutual_information')
+        elif tta_views:
+            self.tta_variance = predictions.numpy('tta_variance')
+            self.tta_agreement = predictions.numpy('tta_agreement')
         if not config["auto_encoder"]:
-            self.metrics = self.calc_metrics(predictions_np, targets_all_tensor, config['num_out'])
+            predictions_np = predictions.numpy('outputs')
+            self.metrics = self.calc_metrics(predictions['outputs'], targets_all_tensor, config['num_out'])
             
         if checkpoint_name:
+            # Predictions and losses of every sample are cached per checkpoint and split, identified by the sample id
+            sample_info = get_sample_info(dataloader.dataset)
+            if not config["auto_encoder"]:
+                store = create_prediction_store(sample_info, targets_np, config['num_out'], logits=predictions_np,
+                                                softmax=torch.softmax(predictions['outputs'], dim=1).cpu().numpy(),
+                                                ce_loss=loss_all, linear_loss=loss_linear_all)
+            else:
+                store = create_prediction_store(sample_info, targets_np, mse_loss=loss_all, l1_loss=loss_linear_all)
             if not config["auto_encoder"]:
-                classifier_predictions = np.argmax(predictions_np, 1)
+                # Confidence scores compared by their risk-coverage curves, the risk is the 0/1 error
+                scores = confidences_from_logits(predictions_np)
+                if mc_dropout_samples:
+                    scores.update(mc_negative_entropy=-self.mc_entropy, mc_negative_mutual_information=-self.mc_mutual_information)
+                elif tta_views:
+                    scores.update(tta_negative_variance=-self.tta_variance, tta_agreement=self.tta_agreement)
+                self.selective = compare_confidence_scores(scores, predictions_np.argmax(axis=1) != targets_np)
 
-                # Writing integers to the file
-                predictions_file_name = save_path_cv / (checkpoint_name + '_test_predloss_pairs.txt')
-                with open(predictions_file_name, 'w') as file:
-                    for int_class, float_loss in zip(classifier_predictions,loss_linear_all):
-                        file.write(f"{int_class},{float_loss}\n")
+            cache = LogitCache(save_path_cv)
+            cache.save(store, checkpoint_name, split)
 
-            else:
-                self.save_auto_encoder_sample(inputs_all_tensor, predictions_all_tensor, save_path_cv)
+            if not config["auto_encoder"] and split == SPLIT_TEST and config['conformal_alpha'] > 0 and cache.contains(checkpoint_name, SPLIT_VALID):
+                # Prediction sets with the quantiles of the cached validation predictions of the same checkpoint
+                self.conformal = conformalize(cache.load(checkpoint_name, SPLIT_VALID), store['softmax'], targets_np,
+                                              config['conformal_alpha'], config['conformal_class_conditional'])
+
+            if config["auto_encoder"] and split == SPLIT_TEST:
+                self.save_auto_encoder_sample(example_reservoir.samples(), save_path_cv, config)
 
                 if config['compare_classifier_predictions']:
 
-                    # Reading integers from the file and writing them back to another variable
-                    # Load the pretrained ResNet18 model from a ".pt" file
+                    # Join with the stored predictions of the classifier (the encoder) of the same fold
                     save_path_classifier = Path('./data/train_and_test', config['encoder_group'], config['encoder_name'], ('cv_' + str(cv)))
+                    classifier_store = LogitCache(save_path_classifier).load(checkpoint_name, SPLIT_TEST)
+                    positions, classifier_positions = join_by_sample_id(store, classifier_store)
+
+                    loss_all = loss_all[positions]
+                    targets_np = targets_np[positions]
+                    classifier_predictions = np.argmax(classifier_store['logits'][classifier_positions], axis=1)
+                    classifier_losses = classifier_store['linear_loss'][classifier_positions]
                     
-                    predictions_file_name = save_path_classifier / (checkpoint_name + '_test_predloss_pairs.txt')
-                    classifier_predloss_pairs = []
-                    with open(predictions_file_name, 'r') as file:
-                        for line in file:
-                            parts = line.strip().split(',')
-                            classifier_predloss_pairs.append((int(parts[0]), float(parts[1])))
-                    
-                    # print(classifier_predloss_pairs)
-                    # exit()
-                    classifier_predictions, classifier_losses = tuple(map(list, zip(*classifier_predloss_pairs)))
-                    
-                    self.mse_loss_conf_matr_mean = self.calc_mse_loss_conf_matr_mean(inputs_all_tensor, predictions_all_tensor, targets_np, classifier_predictions)
+                    self.mse_loss_conf_matr_mean = self.calc_mse_loss_conf_matr_mean(loss_all, targets_np, classifier_predictions)
 
                     # Apply Threshold
-                    classifier_losses = np.array(classifier_losses)
-                    loss_all = np.array(loss_all)
-                    mask1 = np.array([elem > -1 for elem in classifier_losses])
-                    mask2 = np.array([elem > -10.0 for elem in loss_all])
+                    mask1 = classifier_losses > -1
+                    mask2 = loss_all > -10.0
 
                     classifier_losses_threshold = classifier_losses[mask1 & mask2]
                     loss_all_threshold = loss_all[mask1 & mask2]
 
-                    # Creating and storing the scatter plot for the larger dataset
-                    # New font sizes
-                    title_fontsize = 14
-                    axis_label_fontsize = 12
-                    tick_label_fontsize = 10
-
-                    colors = np.array([])
-                    for t, p in zip(targets_np, classifier_predictions):
-                        color = 'green' if t == p else 'red'
-                        colors = np.append(colors, color)
-                    #colors = np.array([('green' if t == p else 'red') for t, p in zip(targets_all_tensor, classifier_predictions)])
-                    colors_threshold = colors[mask1 & mask2]
-
-                    plt.clf()
-                    plt.figure(figsize=(10, 6))
-                    plt.scatter(loss_all_threshold, classifier_losses_threshold, alpha=0.5, c=colors_threshold)
-                    plt.title('Loss Pair Distribution of Classifier vs Autoencoder', fontsize=title_fontsize)
-                    plt.xlabel('Autoencoder Loss', fontsize=axis_label_fontsize)
-                    plt.ylabel('Classifier Loss', fontsize=axis_label_fontsize)
-                    plt.xticks(fontsize=tick_label_fontsize)  # Larger x-axis tick labels
-                    plt.yticks(fontsize=tick_label_fontsize)  # Larger y-axis tick labels
-                    plt.grid(True)
-                    plt.savefig(save_path_cv / (checkpoint_name + '_loss_distribution_plot.png'))
+                    # The plots are rendered in the background from the compact loss arrays
+                    colors = np.where(targets_np == classifier_predictions, 'green', 'red')
+                    renderer = self.get_renderer(config)
+                    renderer.submit(render_loss_distribution_plot, save_path_cv / (checkpoint_name + '_loss_distribution_plot.png'),
+                                    loss_all_threshold, classifier_losses_threshold, colors[mask1 & mask2])
 
-                    loss_all_asc, classifier_losses_asc = zip(*sorted(zip(loss_all_threshold, classifier_losses_threshold), key=lambda x: x[0]))
-                    # Convert tuples back to lists (if needed)
-                    loss_all_asc = list(loss_all_asc)
-                    classifier_losses_asc = list(classifier_losses_asc)
                     proportions = np.linspace(0.01, 1, 100)  # 100 proportions from 1% to 100%
-                    average_losses = [] # average_losses contains the average classifier loss for each proportion
-                    for proportion in proportions:
-                        n_samples = int(proportion * len(classifier_losses_asc))
-                        selected_losses = classifier_losses_asc[:n_samples]
-                        average_loss = np.mean(selected_losses)
-                        average_losses.append(average_loss)
-                    plt.clf()
-                    plt.plot(proportions, average_losses)
-                    plt.xlabel('Proportion of Samples with Lowest MAE', fontsize=axis_label_fontsize)
-                    plt.ylabel('Average Classifier Loss', fontsize=axis_label_fontsize)
-                    plt.xticks(fontsize=tick_label_fontsize)  # Larger x-axis tick labels
-                    plt.yticks(fontsize=tick_label_fontsize)  # Larger y-axis tick labels
-                    plt.title('Relationship between MAE and Classifier Loss', fontsize=title_fontsize)
-                    plt.grid(True)
-                    plt.savefig(save_path_cv / (checkpoint_name + '_risk_coverage_curve.png'))
-
-    def save_auto_encoder_sample(self, inputs_all_tensor, predictions_all_tensor, save_path_cv):
-        num_samples = 20
-        for i, (input_tensor, prediction_tensor) in enumerate(zip(inputs_all_tensor, predictions_all_tensor)):
-            if not i % int(len(predictions_all_tensor) / num_samples):
-                # Extract the slice (single channel image) from the tensor
-                image_slice_in = input_tensor[0, :, :]
-                image_slice_pred = prediction_tensor[0, :, :]
-                # with blurring:
-                image_slice_in_blur = input_tensor[0, :, :]
-                image_slice_in_blur = T.GaussianBlur(kernel_size=(5,5), sigma=(2,2))(image_slice_in_blur.unsqueeze(0)).squeeze(0)
-                
-                images_max = max(image_slice_in.max(), image_slice_pred.max())
-                images_min = min(image_slice_in.min(), image_slice_pred.min())
-                image_in = (255 * (image_slice_in - images_min) / (images_max - images_min)).clamp(0, 255).byte()
-                image_in_blur = (255 * (image_slice_in_blur - images_min) / (images_max - images_min)).clamp(0, 255).byte()
-                image_out = (255 * (image_slice_pred - images_min) / (images_max - images_min)).clamp(0, 255).byte()
-
-                to_pil = ToPILImage()
-                image_in_pil = to_pil(image_in)
-                image_in_blur_pil = to_pil(image_in_blur)
-                image_out_pil = to_pil(image_out)
-
-                # Save the image as a PNG file
-                img_dir = save_path_cv / "example_images/"
-                os.makedirs(img_dir, exist_ok = True)
-                image_in_pil.save(img_dir / f"{i}_input.png", "PNG")
-                image_in_blur_pil.save(img_dir / f"{i}_input_blur.png", "PNG")
-                image_out_pil.save(img_dir / f"{i}_output.png", "PNG")
-
-                # Print absolute difference of input and output
-                abs_diff = torch.abs(torch.subtract(image_slice_in, image_slice_pred))
-                abs_diff = (255 * (abs_diff - images_min) / (images_max - images_min)).clamp(0, 255).byte()
-                #Alternative min and max values when normalizing for range 0 to 255
-                #abs_diff = (255 * (abs_diff - abs_diff.min()) / (abs_diff.max() - abs_diff.min())).clamp(0, 255).byte()
-                abs_diff_image = abs_diff.cpu().numpy()
-                abs_diff_image_np = Image.fromarray(np.uint8(abs_diff_image), mode='L')
-                abs_diff_image_np.save(img_dir / f"{i}_absdiff.png")
-
-                segments = skimage.segmentation.slic(abs_diff_image, n_segments=8, compactness=0.03, channel_axis=None)
-                segmentation_overlay = skimage.color.label2rgb(segments, image=abs_diff_image, kind='overlay')
-                segmentation_image = Image.fromarray(np.uint8(segmentation_overlay * 255))
-                segmentation_image.save(img_dir / f"{i}_segmentation.png")
-
-    def calc_mse_loss_conf_matr_mean(self, inputs, predictions, classifier_targets, classifier_predictions):
-
-        # Compute MSE Loss for input and output image of autoencoder
-        loss_function_mse = nn.MSELoss() # instantiation
-        
-        mse_loss_conf_matr = [[[],[]], [[],[]]]
-        for input, prediction, classifier_target, classifier_prediction in zip(inputs, predictions, classifier_targets, classifier_predictions):
-            mse_loss = loss_function_mse(input, prediction).cpu().numpy()
-            mse_loss_conf_matr[int(classifier_prediction)][int(classifier_target)].append(mse_loss)
-
-        # Calculating the mean of each list and storing it in a 2D matrix
-        mse_loss_conf_matr_mean = np.array([[np.mean(lst) for lst in row] for row in mse_loss_conf_matr])
+                    average_losses = average_loss_by_coverage(loss_all_threshold, classifier_losses_threshold, proportions) # average classifier loss for each proportion
+                    renderer.submit(render_risk_coverage_curve, save_path_cv / (checkpoint_name + '_risk_coverage_curve.png'), proportions, average_losses)
+
+    def save_auto_encoder_sample(self, example_samples, save_path_cv, config):
+        if not example_samples:
+            return
+
+        # Only the first channel (single channel image) of the inputs and outputs is passed to the renderer
+        positions, inputs, outputs = zip(*example_samples)
+        images_in = torch.stack([input_tensor[0, :, :] for input_tensor in inputs]).numpy()
+        images_pred = torch.stack([prediction_tensor[0, :, :] for prediction_tensor in outputs]).numpy()
+        self.get_renderer(config).submit(render_auto_encoder_samples, save_path_cv / "example_images/", np.array(positions), images_in, images_pred)
+
+    @classmethod
+    def get_tta(cls, config, model, inputs) -> TestTimeAugmentation:
+        ''' Gets the test-time augmentation of a model, creates it on the first evaluation of the model.
+        With a latency budget, the number of views is reduced on the first batch to fit the budget of this model.
+
+        Arguments:
+            cls: The Eval class.
+            config: Dictionary of the configurations.
+            model: The evaluated classifier.
+            inputs: The first batch of images on the device.
+        Return:
+            The test-time augmentation.
+        '''
+
+        # Stored on the model, it is released with the model and never reused for another one
+        if getattr(model, 'test_time_augmentation', None) is None:
+            tta = TestTimeAugmentation(config['tta_views'], polar='pol' in config['cart_or_pol'])
+            if config['tta_latency_budget_ms']:
+                tta.fit_to_latency_budget(model, inputs, config['tta_latency_budget_ms'])
+            model.test_time_augmentation = tta
+        return model.test_time_augmentation
+
+    @classmethod
+    def get_renderer(cls, config) -> ArtifactRenderer:
+        ''' Gets the renderer of plots and example images shared by all evaluations, creates it on first use.
+
+        Arguments:
+            cls: The Eval class.
+            config: Dictionary of the configurations.
+        Return:
+            The artifact renderer.
+        '''
+
+        if cls.renderer is None:
+            cls.renderer = ArtifactRenderer(mode=config['artifact_rendering'])
+        return cls.renderer
+
+    def calc_mse_loss_conf_matr_mean(self, mse_losses, classifier_targets, classifier_predictions):
+
+        # MSE Loss for input and output image of autoencoder was computed per sample in the evaluation loop
+        # Scatter-mean into the 2x2 matrix (rows: classifier prediction, columns: target), NaN for empty cells
+        cell = 2 * np.asarray(classifier_predictions, dtype=np.int64) + np.asarray(classifier_targets, dtype=np.int64)
+        mse_loss_sums = np.bincount(cell, weights=mse_losses, minlength=4)
+        counts = np.bincount(cell, minlength=4)
+        mse_loss_conf_matr_mean = safe_divide(mse_loss_sums, counts, fill=np.nan).reshape(2, 2)
 
         return mse_loss_conf_matr_mean
     
-    def calc_metrics(self, predictions_np, targets, num_out):
+    def calc_metrics(self, outputs, targets, num_out):
         
-        targets_np = targets.cpu().numpy()
+        # All metrics are derived from one confusion matrix and one sort of the scores (see metrics.py)
+        metrics = compute_metrics(outputs, targets, num_out)
 
-        accuracy = np.mean(np.equal(np.argmax(predictions_np, 1), targets_np))
-        conf_matrix = confusion_matrix(targets_np, np.argmax(predictions_np, 1))
+        self.confusion_matrix = metrics['confusion_matrix']
+        self.roc_auc = metrics['roc_auc']
+        self.weighted_accuracy = metrics['weighted_accuracy']
 
-        weighted_accuracy = conf_matrix.diagonal() / conf_matrix.sum(axis=1)
-        sensitivity = np.zeros([num_out])
-        specificity = np.zeros([num_out])
-        if num_out > 2:
-            # will currently result in error if not all classes are in test set...
-            if conf_matrix.shape[0] == num_out:
-                for k in range(num_out):
-                    sensitivity[k] = conf_matrix[k, k] / (np.sum(conf_matrix[k, :]))
-                    true_negative = np.delete(conf_matrix, [k], 0)
-                    true_negative = np.delete(true_negative, [k], 1)
-                    true_negative = np.sum(true_negative)
-                    false_positive = np.delete(conf_matrix, [k], 0)
-                    false_positive = np.sum(false_positive[:, k])
-                    specificity[k] = true_negative / (true_negative + false_positive)
-            else:
-                tn, fp, fn, tp = conf_matrix.ravel()
-                sensitivity = tp / (tp + fn)
-                specificity = tn / (tn + fp)
-            # F1 score
-            f1 = f1_score(targets_np, np.argmax(predictions_np, 1), average='weighted')
-        else:
-            tn, fp, fn, tp = conf_matrix.ravel() # TODO: raveling multiple times
-            sensitivity = tp / (tp + fn)
-            specificity = tn / (tn + fp)
-            # F1 score
-            f1 = f1_score(targets_np, np.argmax(predictions_np, 1))
-        # Balanced accuracy
-        bacc = (sensitivity + specificity) / 2
-        prec = tp / (tp + fp) if tp + fp != 0 else 0.0 #TODO: check zero div everywhere
-        # Matthews Correlation Coefficient
-        if (tp+fp) != 0 and (tp+fn) != 0 and (tn+fp) != 0 and (tn+fn) != 0:
-            mcc = ((tp * tn) - (fp * fn)) / math.sqrt( (tp+fp) * (tp+fn) * (tn+fp) * (tn+fn) )
-        else:
-            mcc = 0.0
-        # AUC
-        fpr = {}
-        tpr = {}
-        roc_auc = np.zeros([num_out])
-        targets_one_hot = np.array(torch.nn.functional.one_hot(targets, num_out).cpu().numpy())
-        for i in range(num_out):
-            fpr[i], tpr[i], _ = roc_curve(targets_one_hot[:, i], predictions_np[:, i])
-            roc_auc[i] = auc(fpr[i], tpr[i])
-
-        self.confusion_matrix = conf_matrix # TODO: unused
-        self.roc_auc = roc_auc # TODO: unused
-        self.weighted_accuracy = weighted_accuracy # TODO: unused
-
-
-        return [accuracy, sensitivity, specificity, f1, bacc, mcc, prec]
-    
-    
\ No newline at end of file
+        return [float(metrics[name]) for name in METRIC_NAMES]
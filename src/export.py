@@ -0,0 +1,208 @@
+import os
+import torch
+import argparse
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision.transforms as T
+
+from pathlib import Path
+
+from checkpoint import Checkpoint
+from compilation import get_input_channels
+from da_techniques import Rescaling, ThreeChannelCopy
+from predict import read_run_config
+
+DIR_NAME_EXPORT = 'export'
+TORCHSCRIPT_SUFFIX = '.torchscript.pt'
+ONNX_SUFFIX = '.onnx'
+ONNX_OPSET = 18
+
+class PreprocessedModel(nn.Module):
+    ''' Model with the tensor steps of the evaluation preprocessing folded into its graph: min-max rescaling per image,
+    resizing to the model input size and copying the channel for models with three input channels. The steps on the
+    raw uint16 frame before (CLAHE, noise, circular mask) use OpenCV and are not part of the graph.
+    The antialiased bilinear resize is separable and linear, it is stored as one matrix per axis and applied with two
+    matrix multiplications, which every runtime supports (ONNX has no antialiased Resize). Therefore the frame size is fixed.
+    '''
+
+    def __init__(self, model:nn.Module, input_shape:tuple, output_shape:tuple=(224, 224)):
+        ''' Wraps a model.
+
+        Arguments:
+            self: The PreprocessedModel object itself.
+            model: The model in eval mode (eager, not compiled).
+            input_shape: Height and width of the raw frames.
+            output_shape: Height and width the model is trained with.
+        Return:
+            The class constructor returns a "PreprocessedModel" object.
+        '''
+
+        super().__init__()
+        self.model = model
+        self.input_shape = tuple(input_shape)
+        self.output_shape = tuple(output_shape)
+        self.in_channels = get_input_channels(model)
+        self.register_buffer('resize_rows', get_resize_matrix(self.input_shape[0], self.output_shape[0]))
+        self.register_buffer('resize_columns', get_resize_matrix(self.input_shape[1], self.output_shape[1]).T.contiguous())
+
+    def forward(self, images:torch.Tensor) -> torch.Tensor:
+        # images: (B, H, W) frames after CLAHE
+        x = images.float().unsqueeze(1)
+        minimum = x.amin(dim=(2, 3), keepdim=True)
+        maximum = x.amax(dim=(2, 3), keepdim=True)
+        x = (x - minimum) / (maximum - minimum)
+        x = self.resize_rows @ x @ self.resize_columns
+        if self.in_channels > 1:
+            x = x.expand(-1, self.in_channels, -1, -1)
+        return self.model(x)
+
+def get_resize_matrix(input_size:int, output_size:int) -> torch.Tensor:
+    ''' Gets the matrix of an antialiased bilinear resize along one axis (the resize applied to the identity).
+
+    Arguments:
+        input_size: Number of pixels before resizing.
+        output_size: Number of pixels after resizing.
+    Return:
+        Matrix of shape (output_size, input_size).
+    '''
+
+    identity = torch.eye(input_size)[None, None]
+    return F.interpolate(identity, size=(output_size, input_size), mode='bilinear', align_corners=False, antialias=True)[0, 0]
+
+def reference_preprocessing(images:torch.Tensor, in_channels:int, output_shape:tuple=(224, 224)) -> torch.Tensor:
+    ''' Preprocesses frames with the transforms of the training pipeline, the reference of the folded preprocessing.
+
+    Arguments:
+        images: Frames of shape (B, H, W) after CLAHE.
+        in_channels: Number of input channels of the model.
+        output_shape: Height and width the model is trained with.
+    Return:
+        Batch of model inputs (B, in_channels, *output_shape).
+    '''
+
+    transforms = [Rescaling(), T.Resize(size=output_shape, antialias=True)] + ([ThreeChannelCopy()] if in_channels == 3 else [])
+    composed_transforms = T.Compose(transforms)
+    return torch.stack([composed_transforms(image[None].float()) for image in images])
+
+def export_torchscript(model:PreprocessedModel, example:torch.Tensor, path:Path) -> None:
+    ''' Traces the model and stores it frozen for inference.
+
+    Arguments:
+        model: The wrapped model.
+        example: Example batch of frames (B, H, W).
+        path: File of the TorchScript artifact.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+        traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, str(path))
+
+def export_onnx(model:PreprocessedModel, example:torch.Tensor, path:Path) -> None:
+    ''' Exports the model to ONNX with dynamic batch size.
+
+    Arguments:
+        model: The wrapped model.
+        example: Example batch of frames (B, H, W).
+        path: File of the ONNX artifact.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    with torch.no_grad():
+        torch.onnx.export(model, (example,), str(path), input_names=['images'], output_names=['outputs'],
+                          dynamic_axes={'images': {0: 'batch'}, 'outputs': {0: 'batch'}},
+                          opset_version=ONNX_OPSET, dynamo=False)
+
+def load_exported_model(path:Path, num_threads:int=None):
+    ''' Loads an exported artifact for CPU inference.
+
+    Arguments:
+        path: File of a TorchScript or ONNX artifact.
+        num_threads: Number of intra-op threads, None keeps the default of the runtime.
+    Return:
+        Function mapping a batch of frames (B, H, W) as float tensor to the outputs as float tensor.
+    '''
+
+    if str(path).endswith(ONNX_SUFFIX):
+        import onnxruntime # optional, only needed for ONNX artifacts
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        return lambda images: torch.from_numpy(session.run(None, {'images': images.numpy()})[0])
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    model = torch.jit.load(str(path), map_location='cpu')
+    return lambda images: model(images)
+
+def max_abs_difference(reference:torch.Tensor, outputs:torch.Tensor) -> float:
+    return float((reference.float() - outputs.float()).abs().max())
+
+def export_checkpoint(run_path:Path, cv:int, checkpoint_name:str, output_path:Path, image_size:int, tolerance:float) -> dict:
+    ''' Exports a checkpoint of a run as TorchScript and ONNX artifact and validates both against the eager model
+    with the preprocessing of the training pipeline.
+
+    Arguments:
+        run_path: Location of the run.
+        cv: Number of the CV round.
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        output_path: Directory of the artifacts.
+        image_size: Height and width of the raw frames.
+        tolerance: Maximum absolute difference of the outputs.
+    Return:
+        Dictionary of the maximum absolute difference per artifact (None if the export or runtime is not available).
+    '''
+
+    config = read_run_config(run_path)
+    config.update(compile_model=False, channels_last=False, activation_checkpointing=False, pretrained=False)
+    device = torch.device('cpu')
+    model, _ = Checkpoint.load_inference_model(checkpoint_name, Path(run_path) / ('cv_' + str(cv)), device, config, cv)
+    model = PreprocessedModel(model.float().eval(), (image_size, image_size)).eval()
+
+    os.makedirs(output_path, exist_ok=True)
+    generator = torch.Generator().manual_seed(18)
+    example = torch.rand(2, image_size, image_size, generator=generator) * 65535
+    validation = torch.rand(3, image_size, image_size, generator=generator) * 65535 # other batch size than traced
+
+    with torch.no_grad():
+        reference = model.model(reference_preprocessing(validation, model.in_channels, model.output_shape))
+        differences = {'folded preprocessing': max_abs_difference(reference, model(validation))}
+
+    exports = {
+        'TorchScript': (export_torchscript, output_path / (checkpoint_name + TORCHSCRIPT_SUFFIX)),
+        'ONNX': (export_onnx, output_path / (checkpoint_name + ONNX_SUFFIX)),
+    }
+    for name, (export_function, path) in exports.items():
+        try:
+            export_function(model, example, path)
+            with torch.no_grad():
+                differences[name] = max_abs_difference(reference, load_exported_model(path)(validation))
+        except Exception as error:
+            print(name + ':', 'not validated (' + type(error).__name__ + ': ' + str(error).split('\n')[0] + ')')
+            differences[name] = None
+
+    for name, difference in differences.items():
+        if difference is not None:
+            print('{:<22} max abs difference {:.2e} {}'.format(name, difference, 'ok' if difference <= tolerance else 'EXCEEDS ' + str(tolerance)))
+    return differences
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Export a checkpoint as TorchScript and ONNX artifact for CPU inference')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-cv', '--fold', default=1, type=int, help='CV round of the checkpoint (default: 1)')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-o', '--output', default=None, type=str, help='output directory (default: <run>/cv_<fold>/export)')
+    args.add_argument('-is', '--image_size', default=224, type=int, help='height and width of the raw frames (default: 224)')
+    args.add_argument('-t', '--tolerance', default=1e-3, type=float, help='maximum absolute difference to eager (default: 1e-3)')
+    args.add_argument('--allow-missing-onnx', action='store_true', help='succeed without a validated ONNX artifact, e.g. without onnx or onnxruntime installed')
+    args = args.parse_args()
+
+    output_path = Path(args.output) if args.output else Path(args.run) / ('cv_' + str(args.fold)) / DIR_NAME_EXPORT
+    differences = export_checkpoint(Path(args.run), args.fold, args.checkpoint, output_path, args.image_size, args.tolerance)
+    # Every artifact has to be exported and validated, only the ONNX artifact may be skipped on request
+    optional = ['ONNX'] if args.allow_missing_onnx else []
+    exit(0 if all(d <= args.tolerance if d is not None else name in optional for name, d in differences.items()) else 1)
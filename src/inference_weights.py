@@ -0,0 +1,140 @@
+import os
+import json
+import torch
+
+from pathlib import Path
+from collections import OrderedDict
+
+from checkpoint_writer import atomic_save
+from checkpoint_index import CheckpointIndex, KIND_TRAINING, KIND_INFERENCE
+
+# Inference artifacts are stored next to the training checkpoints, e.g. "checkpoint_best_at_epoch_5.weights"
+WEIGHTS_SUFFIX = '.weights'
+METADATA_SUFFIX = '.weights.json'
+
+INFERENCE_DTYPES = {
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'float32': torch.float32,
+}
+
+def to_inference_weights(model_state_dict:dict, dtype:str) -> OrderedDict:
+    ''' Converts the floating point tensors of a model state dict to the (reduced) inference precision.
+
+    Arguments:
+        model_state_dict: State dict of the model.
+        dtype: Name of the inference precision, key of INFERENCE_DTYPES.
+    Return:
+        State dict on the CPU with floating point tensors converted, other tensors (e.g. num_batches_tracked) unchanged.
+    '''
+
+    return OrderedDict((key, value.detach().to('cpu', INFERENCE_DTYPES[dtype]) if value.is_floating_point() else value.detach().cpu())
+                       for key, value in model_state_dict.items())
+
+def save_metadata(metadata:dict, weights_path:Path) -> None:
+    ''' Saves the metadata belonging to an inference artifact atomically as json file.
+
+    Arguments:
+        metadata: Information about the weights, e.g. model type, epoch and precision.
+        weights_path: Location of the weights file the metadata belongs to.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    metadata_path = Path(str(weights_path)[:-len(WEIGHTS_SUFFIX)] + METADATA_SUFFIX)
+    temp_path = metadata_path.with_name(metadata_path.name + '.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(metadata, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, metadata_path)
+
+def save_inference_weights(model_state_dict:dict, weights_path:Path, metadata:dict, dtype:str) -> None:
+    ''' Saves only the weights of a model in inference precision together with its metadata.
+
+    Arguments:
+        model_state_dict: State dict of the model.
+        weights_path: Location of the weights file.
+        metadata: Information about the weights, e.g. model type and epoch.
+        dtype: Name of the inference precision, key of INFERENCE_DTYPES.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    atomic_save(to_inference_weights(model_state_dict, dtype), weights_path)
+    save_metadata(dict(metadata, dtype=dtype), weights_path)
+
+def load_inference_weights(weights_path:Path) -> tuple:
+    ''' Loads an inference artifact. The tensors are memory-mapped, only the weights are read from disk
+    (no optimizer, scheduler or scaler state).
+
+    Arguments:
+        weights_path: Location of the weights file.
+    Return:
+        Tuple of the state dict (tensors on CPU) and the metadata dict.
+    '''
+
+    try:
+        state_dict = torch.load(weights_path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 does not support memory-mapping
+        state_dict = torch.load(weights_path, map_location='cpu')
+
+    return state_dict, load_metadata(weights_path)
+
+def load_metadata(weights_path:Path) -> dict:
+    ''' Loads the metadata of an inference artifact without reading the weights.
+
+    Arguments:
+        weights_path: Location of the weights file.
+    Return:
+        The metadata dict, empty if no metadata is stored.
+    '''
+
+    metadata_path = str(weights_path)[:-len(WEIGHTS_SUFFIX)] + METADATA_SUFFIX
+    if not os.path.isfile(metadata_path):
+        return {}
+    with open(metadata_path, 'r') as file:
+        return json.load(file)
+
+def get_evaluation_weights_path(index:CheckpointIndex, name:str) -> Path:
+    ''' Gets the inference artifact of a checkpoint if it may replace the training checkpoint. Results are computed
+    with the full precision weights: reduced precision artifacts (e.g. float16) are an export format and are only
+    used if no training checkpoint is stored.
+
+    Arguments:
+        index: Checkpoint index of the CV round.
+        name: Name of the checkpoint, e.g. "checkpoint_best".
+    Return:
+        Path of the artifact, None if the training checkpoint is to be used.
+    '''
+
+    weights_path = index.get_path(name, KIND_INFERENCE)
+    if weights_path is None:
+        return None
+    if load_metadata(weights_path).get('dtype') == 'float32' or index.get_path(name, KIND_TRAINING) is None:
+        return weights_path
+    return None
+
+def load_model_state_dict(save_path_cv:Path, name:str) -> dict:
+    ''' Loads the model weights of a stored checkpoint, e.g. for the encoder of an autoencoder.
+    A full precision inference artifact is preferred over the full training checkpoint (see get_evaluation_weights_path).
+
+    Arguments:
+        save_path_cv: Location where the CV round of the run is stored.
+        name: Name of the checkpoint, e.g. "checkpoint_best".
+    Return:
+        The state dict of the model.
+    '''
+
+    index = CheckpointIndex(save_path_cv)
+
+    weights_path = get_evaluation_weights_path(index, name)
+    if weights_path is not None:
+        state_dict, _ = load_inference_weights(weights_path)
+        return state_dict
+
+    checkpoint_path = index.get_path(name, KIND_TRAINING)
+    if checkpoint_path is None:
+        raise FileNotFoundError('No checkpoint "' + name + '" found in ' + str(save_path_cv))
+    return torch.load(checkpoint_path, map_location='cpu')['model_state_dict']
@@ -3,6 +3,8 @@ import sys
 import json
 import numpy as np
 
+from conformal import CALIBRATION_CAVEAT
+
 class Logger(object):
     def __enter__(self):
         pass
@@ -42,6 +44,10 @@ class Logger(object):
             print("   BACC:          ", round(eval_test.metrics[4], config['early_stop_accuracy']))
             print("   MCC:           ", round(eval_test.metrics[5], config['early_stop_accuracy']))
             print("   Prec.:         ", round(eval_test.metrics[6], config['early_stop_accuracy']))
+            conformal = getattr(eval_test, 'conformal', None)
+            if conformal is not None:
+                print("   Set coverage:  ", round(conformal['coverage'], config['early_stop_accuracy']))
+                print("   Set size:      ", round(conformal['set_size'], config['early_stop_accuracy']), '(' + CALIBRATION_CAVEAT + ')')
         elif if_val_or_test:
             np.set_printoptions(suppress=True, precision=4, floatmode='fixed')
             print('TP:', eval_test.mse_loss_conf_matr_mean[1,1], 'TN:', eval_test.mse_loss_conf_matr_mean[0,0], 'FP:', eval_test.mse_loss_conf_matr_mean[1,0], 'FN:', eval_test.mse_loss_conf_matr_mean[0,1])
@@ -75,6 +81,22 @@ class Logger(object):
                     'MCC': float(eval_test.metrics[5]),
                     'Prec.': float(eval_test.metrics[6])
                 })
+                conformal = getattr(eval_test, 'conformal', None)
+                if conformal is not None:
+                    data_to_append[description].update({
+                        'Conformal coverage': conformal['coverage'],
+                        'Conformal set size': conformal['set_size'],
+                        'Conformal singletons': conformal['singletons'],
+                        'Conformal class coverage': conformal['class_coverage'].tolist(),
+                        'Conformal quantiles': conformal['quantiles'].tolist(),
+                        'Conformal calibration': CALIBRATION_CAVEAT,
+                    })
+                selective = getattr(eval_test, 'selective', None)
+                if selective is not None:
+                    data_to_append[description].update({
+                        'AURC': selective['aurc'],
+                        'E-AURC': selective['e_aurc'],
+                    })
             elif if_val_or_test:
                 data_to_append[description].update({
                     'mse_loss_conf_matr_mean': eval_test.mse_loss_conf_matr_mean.tolist(),
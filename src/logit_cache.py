@@ -0,0 +1,98 @@
+import os
+import numpy as np
+
+from pathlib import Path
+
+from checkpoint_index import CheckpointIndex, file_sha256, KIND_TRAINING, KIND_INFERENCE
+from prediction_store import save_prediction_store, load_prediction_store, PREDICTION_STORE_SUFFIX
+
+DIR_NAME_LOGIT_CACHE = 'logit_cache'
+
+# Splits evaluated with saved checkpoints
+SPLIT_VALID = 'valid'
+SPLIT_TEST = 'test'
+
+class LogitCache():
+    ''' Cache of the prediction stores (logits and per-sample losses) of the saved checkpoints of one CV round (fold).
+    Entries are keyed by the hash of the checkpoint file and the evaluated split, so calibration, threshold tuning,
+    confidence scoring and bootstrapping run on the cached results instead of evaluating the model again.
+    A retrained checkpoint has another hash, stale entries are never read.
+    '''
+
+    # Hashes computed for runs stored without index, by file, modification time and size (see checkpoint_hash)
+    computed_hashes = {}
+
+    def __init__(self, save_path_cv:Path):
+        ''' Creates the cache object of a fold directory, the cache directory is created on the first save.
+
+        Arguments:
+            self: The LogitCache object itself.
+            save_path_cv: Location where this CV round is stored.
+        Return:
+            The class constructor returns a "LogitCache" object.
+        '''
+
+        self.save_path_cv = Path(save_path_cv)
+        self.cache_dir = self.save_path_cv / DIR_NAME_LOGIT_CACHE
+        self.index = CheckpointIndex(save_path_cv)
+
+    def checkpoint_hash(self, checkpoint_name:str) -> str:
+        ''' Gets the hash of a stored checkpoint from the checkpoint index. For runs stored without index it is
+        computed once per file and process and memoized, path, contains, save and load call this several times per Eval.
+
+        Arguments:
+            self: The LogitCache object.
+            checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        Return:
+            The SHA-256 hex digest of the training checkpoint (of the inference weights if no training checkpoint exists).
+        '''
+
+        for kind in [KIND_TRAINING, KIND_INFERENCE]:
+            entry = self.index.get(checkpoint_name, kind)
+            if entry is not None:
+                if entry['sha256']:
+                    return entry['sha256']
+                path = self.save_path_cv / entry['file']
+                status = os.stat(path)
+                key = (str(path.resolve()), status.st_mtime_ns, status.st_size)
+                if key not in LogitCache.computed_hashes:
+                    LogitCache.computed_hashes[key] = file_sha256(path)
+                return LogitCache.computed_hashes[key]
+        raise FileNotFoundError('No checkpoint "' + checkpoint_name + '" found in ' + str(self.save_path_cv))
+
+    def path(self, checkpoint_name:str, split:str) -> Path:
+        return self.cache_dir / (self.checkpoint_hash(checkpoint_name)[:16] + '_' + split + PREDICTION_STORE_SUFFIX)
+
+    def contains(self, checkpoint_name:str, split:str) -> bool:
+        return os.path.isfile(self.path(checkpoint_name, split))
+
+    def save(self, records:np.ndarray, checkpoint_name:str, split:str) -> None:
+        ''' Stores the prediction store of a checkpoint evaluated on a split.
+
+        Arguments:
+            self: The LogitCache object.
+            records: Structured array of the predictions (see prediction_store.py).
+            checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+            split: Name of the evaluated split, e.g. SPLIT_TEST.
+        Return:
+            This Method has nothing to return.
+        '''
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_prediction_store(records, self.path(checkpoint_name, split))
+
+    def load(self, checkpoint_name:str, split:str) -> np.ndarray:
+        ''' Loads the cached prediction store of a checkpoint memory-mapped.
+
+        Arguments:
+            self: The LogitCache object.
+            checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+            split: Name of the evaluated split, e.g. SPLIT_TEST.
+        Return:
+            Read-only structured array of the predictions.
+        '''
+
+        path = self.path(checkpoint_name, split)
+        if not os.path.isfile(path):
+            raise FileNotFoundError('No cached predictions of "' + checkpoint_name + '" on the ' + split + ' split in ' + str(self.cache_dir))
+        return load_prediction_store(path)
@@ -10,8 +10,14 @@ from utils import Utils, comp_class_weights
 from config import Config
 from logger import Logger
 from checkpoint import Checkpoint
+from ensemble import FoldEnsemble
+from checkpoint_index import CheckpointIndex
+from logit_cache import SPLIT_VALID
+from bootstrap import bootstrap_run
+from pullback_aggregation import report_fold, SMOOTHING_NONE
 from utils_wandb import Wandb
 from data_loaders import Dataloaders
+from teacher_cache import get_teacher_logits
 from create_samples import create_samples
 from dataset_preparation import DatasetPreparation
 
@@ -28,6 +34,9 @@ def train_and_eval(config:Config):
     
     device = Utils.config_torch_and_cuda(config)
 
+    # Distillation: the student is trained on the soft targets of the fold ensemble of a teacher run
+    teacher_logits = get_teacher_logits(cust_data, device, config) if config['distillation'] and not config["auto_encoder"] else None
+
     for cv in range(config['num_cv']):
 
         early_stop = False
@@ -42,10 +51,12 @@ def train_and_eval(config:Config):
         
         save_path_cv = config.save_path / ('cv_' + str(cv + 1))
         os.makedirs(save_path_cv, exist_ok=True)
-        cv_done = True if any('test_results' in s for s in os.listdir(save_path_cv)) else False
+        cv_done = CheckpointIndex(save_path_cv).has_test_results()
 
         valid_ind_for_cv, train_ind_for_cv = cust_data.get_train_valid_ind(cv)
-        Dataloaders.setup_data_loaders_training(train_ind_for_cv,train_ind_for_cv[::2],valid_ind_for_cv,cust_data,config)
+        if teacher_logits is not None:
+            assert np.isfinite(teacher_logits[train_ind_for_cv]).all(), "Teacher logits missing for training images of CV " + str(cv + 1)
+        Dataloaders.setup_data_loaders_training(train_ind_for_cv,train_ind_for_cv[::2],valid_ind_for_cv,cust_data,config,teacher_logits)
         class_weights = comp_class_weights(labels=cust_data.label_data[train_ind_for_cv])
 
         if cv_done:
@@ -75,6 +86,8 @@ def train_and_eval(config:Config):
                         break
                     
                     Logger.print_section_line()
+                    if torch.cuda.is_available():
+                        torch.cuda.reset_peak_memory_stats(device)
                     duration_epoch = Utils.train_one_epoch(checkpoint.model, device, checkpoint.scaler, checkpoint.optimizer, config, class_weights)
                     checkpoint.scheduler.step()
 
@@ -147,6 +160,10 @@ def train_and_eval(config:Config):
                     print('Fold:          ', cv+1, '/', config['num_cv'])
                     print('Epoch:         ', epoch, '/', config['epochs'])
                     print('Duration Epoch:', str(round(duration_epoch, 2)) + 's')
+                    # The training loader drops the last incomplete batch, only full batches are seen
+                    print('Throughput:    ', str(round(len(Dataloaders.trainInd) * Dataloaders.trainInd.batch_size / duration_epoch, 1)) + ' images/s')
+                    if torch.cuda.is_available():
+                        print('Peak Memory:   ', str(round(torch.cuda.max_memory_allocated(device) / 2**20)) + 'MiB', '(activation checkpointing: ' + str(config['activation_checkpointing']) + ')')
                     
                     print('\nCross-fold Validation information:')
                     print('Training time:  %dh %dm %ds' % (int(duration_cv / 3600), int(np.mod(duration_cv, 3600) / 60), int(np.mod(np.mod(duration_cv, 3600), 60))))
@@ -167,15 +184,25 @@ def train_and_eval(config:Config):
         file_log_test_results = save_path_cv / FILE_NAME_TEST_RESULTS
         print('Testing performance with testset on:')
         for checkpoint_name in ['checkpoint_last', 'checkpoint_best']:
-            checkpoint = Checkpoint(checkpoint_name, save_path_cv, device, config, cv + 1)
+            model, checkpoint_metadata = Checkpoint.load_inference_model(checkpoint_name, save_path_cv, device, config, cv + 1)
             if config["enable_wandb"] and 'WANDB_API_KEY' not in os.environ:
-                Wandb.init(cv, checkpoint.wandb_id, config)
+                Wandb.init(cv, checkpoint_metadata.get('Wandb_ID'), config)
                 
-            eval_test = Eval(Dataloaders.testInd, device, checkpoint.model, config, save_path_cv, cv + 1, checkpoint_name=checkpoint_name, class_weights=class_weights)
+            if config['cache_valid_predictions']:
+                # Cached validation predictions are used for post-hoc calibration, threshold tuning (see posthoc.py)
+                # and the conformal prediction sets of the test split (see conformal.py)
+                Eval(Dataloaders.valInd, device, model, config, save_path_cv, cv + 1, checkpoint_name=checkpoint_name, class_weights=class_weights, split=SPLIT_VALID)
+            eval_test = Eval(Dataloaders.testInd, device, model, config, save_path_cv, cv + 1, checkpoint_name=checkpoint_name, class_weights=class_weights)
             Logger.printer(checkpoint_name, config, eval_test, if_val_or_test=True)
             if config["enable_wandb"]:
-                Wandb.wandb_log(eval_test, cust_data.label_classes, 0, checkpoint.optimizer, checkpoint_name, config)
+                Wandb.wandb_log(eval_test, cust_data.label_classes, 0, None, checkpoint_name, config)
             Logger.log_test(file_log_test_results, checkpoint_name, config, eval_test, if_val_or_test=True)
+            if config['pullback_smoothing'] != SMOOTHING_NONE and not config["auto_encoder"]:
+                # Pullback reports (smoothed predictions and plaque burden) from the cached test predictions
+                report_fold(save_path_cv, checkpoint_name, config['pullback_smoothing'], config['pullback_window'],
+                            config['pullback_stay_probability'], cust_data.label_classes, config['early_stop_accuracy'])
+        Eval.get_renderer(config).flush()
+        CheckpointIndex(save_path_cv).record_test_results(FILE_NAME_TEST_RESULTS)
 
     Logger.print_section_line()
 
@@ -202,6 +229,19 @@ def train_and_eval(config:Config):
         Logger.printer(checkpoint_type + ' Metrics Average:', config, test_eval_avg, if_val_or_test=True)
 
         Logger.log_test(config.save_path / FILE_NAME_TEST_RESULTS_AVERAGE, checkpoint_type, config, test_eval_avg, if_val_or_test=True)
+
+        if config['bootstrap_resamples'] and not config["auto_encoder"]:
+            # Confidence intervals of the averaged metrics from the cached test predictions of all folds
+            bootstrap_run(config.save_path, checkpoint_type, config['bootstrap_resamples'], num_workers=config['bootstrap_workers'], decimals=config['early_stop_accuracy'])
+
+        if config['ensemble_test'] and not config["auto_encoder"]:
+            # All fold models evaluated together, the mean probabilities are classified
+            ensemble = FoldEnsemble.from_run(config.save_path, device, config, checkpoint_type, vectorize=config['ensemble_vectorize'])
+            eval_ensemble = ensemble.evaluate(Dataloaders.testInd, config.save_path, checkpoint_type)
+            Logger.printer(checkpoint_type + ' Ensemble of ' + str(len(ensemble.models)) + ' Folds:', config, eval_ensemble, if_val_or_test=True)
+            print("   Disagreement:  ", round(eval_ensemble.mean_disagreement, config['early_stop_accuracy']))
+            print("   Agreement:     ", round(eval_ensemble.mean_agreement, config['early_stop_accuracy']))
+            Logger.log_test(config.save_path / FILE_NAME_TEST_RESULTS_AVERAGE, 'ensemble_' + checkpoint_type, config, eval_ensemble, if_val_or_test=True)
     
     #if config["enable_wandb"]: # TODO: uncomment and log for last checkpoint as well
     #    Wandb.init(-1, checkpoint.wandb_id, config)
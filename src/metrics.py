@@ -0,0 +1,181 @@
+import torch
+import numpy as np
+
+# Order of the metrics in Eval.metrics, Logger and Wandb
+METRIC_NAMES = ['accuracy', 'sensitivity', 'specificity', 'f1', 'bacc', 'mcc', 'precision']
+
+def safe_divide(numerator, denominator, fill:float=0.0) -> np.ndarray:
+    ''' Divides element-wise, where the denominator is zero the result is set to fill.
+
+    Arguments:
+        numerator: Array of numerators.
+        denominator: Array of denominators (broadcastable).
+        fill: Value of undefined results.
+    Return:
+        Array of quotients.
+    '''
+
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    shape = np.broadcast(numerator, denominator).shape
+    return np.divide(numerator, denominator, out=np.full(shape, fill), where=denominator != 0)
+
+def confusion_matrix(targets, predictions, num_out:int):
+    ''' Computes the confusion matrix (rows: targets, columns: predictions) with a single bincount.
+    Runs on the device for torch tensors, in NumPy otherwise.
+
+    Arguments:
+        targets: Integer class labels, shape (N,).
+        predictions: Integer predicted classes, shape (N,).
+        num_out: Number of classes.
+    Return:
+        Confusion matrix of shape (num_out, num_out), of the same type as the inputs.
+    '''
+
+    if isinstance(targets, torch.Tensor):
+        return torch.bincount(targets.long() * num_out + predictions.long(), minlength=num_out**2).reshape(num_out, num_out)
+    targets, predictions = np.asarray(targets, dtype=np.int64), np.asarray(predictions, dtype=np.int64)
+    return np.bincount(targets * num_out + predictions, minlength=num_out**2).reshape(num_out, num_out)
+
+def metrics_from_confusion_matrix(conf_matrix) -> dict:
+    ''' Derives all classification metrics from confusion matrices, vectorized over leading dimensions.
+    For two classes, class 1 is the positive class. For more classes, sensitivity, specificity and precision
+    are macro averages, F1 is weighted by the class support and MCC is the multiclass (Gorodkin) MCC.
+
+    Arguments:
+        conf_matrix: Confusion matrices of shape (..., C, C), rows: targets, columns: predictions.
+    Return:
+        Dictionary with the METRIC_NAMES of shape (...) and per class results of shape (..., C).
+    '''
+
+    conf_matrix = np.asarray(conf_matrix, dtype=np.float64)
+    num_out = conf_matrix.shape[-1]
+
+    total = conf_matrix.sum(axis=(-2, -1))
+    tp = np.diagonal(conf_matrix, axis1=-2, axis2=-1)
+    support = conf_matrix.sum(axis=-1)
+    predicted = conf_matrix.sum(axis=-2)
+    fn = support - tp
+    fp = predicted - tp
+    tn = total[..., None] - tp - fn - fp
+
+    sensitivity_per_class = safe_divide(tp, tp + fn)
+    specificity_per_class = safe_divide(tn, tn + fp)
+    precision_per_class = safe_divide(tp, tp + fp)
+    f1_per_class = safe_divide(2 * tp, 2 * tp + fp + fn)
+
+    if num_out == 2:
+        sensitivity = sensitivity_per_class[..., 1]
+        specificity = specificity_per_class[..., 1]
+        precision = precision_per_class[..., 1]
+        f1 = f1_per_class[..., 1]
+    else:
+        sensitivity = sensitivity_per_class.mean(axis=-1)
+        specificity = specificity_per_class.mean(axis=-1)
+        precision = precision_per_class.mean(axis=-1)
+        f1 = np.sum(safe_divide(support, total[..., None]) * f1_per_class, axis=-1)
+
+    # Matthews Correlation Coefficient, equals ((tp * tn) - (fp * fn)) / sqrt(...) for two classes
+    covariance = total * tp.sum(axis=-1) - np.sum(predicted * support, axis=-1)
+    mcc = safe_divide(covariance, np.sqrt((total**2 - np.sum(predicted**2, axis=-1)) * (total**2 - np.sum(support**2, axis=-1))))
+
+    return {
+        'accuracy': safe_divide(tp.sum(axis=-1), total),
+        'sensitivity': sensitivity,
+        'specificity': specificity,
+        'f1': f1,
+        'bacc': (sensitivity + specificity) / 2,
+        'mcc': mcc,
+        'precision': precision,
+        'weighted_accuracy': sensitivity_per_class,
+        'sensitivity_per_class': sensitivity_per_class,
+        'specificity_per_class': specificity_per_class,
+    }
+
+def auc_one_vs_rest(scores, targets, num_out:int, sample_weight=None) -> np.ndarray:
+    ''' Computes the one-vs-rest ROC AUC of every class with one sort of all scores.
+    Ties are counted half (identical to the area under the ROC curve). Optional sample weights
+    may have leading dimensions, e.g. (B, N) to evaluate B bootstrap resamples at once.
+
+    Arguments:
+        scores: Scores (e.g. logits or probabilities) of shape (N, C).
+        targets: Integer class labels of shape (N,).
+        num_out: Number of classes C.
+        sample_weight: Optional weights of shape (..., N).
+    Return:
+        AUC per class of shape (..., C), NaN for classes without positive or negative samples.
+    '''
+
+    scores = np.asarray(scores, dtype=np.float64)
+    targets = np.asarray(targets)
+    num_samples = scores.shape[0]
+
+    order = np.argsort(scores, axis=0, kind='stable')
+    scores_sorted = np.take_along_axis(scores, order, axis=0)
+    positive_sorted = np.take_along_axis(targets[:, None] == np.arange(num_out), order, axis=0)
+
+    weights = np.ones(num_samples) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    weights_sorted = weights[..., order]
+    positive_weights = weights_sorted * positive_sorted
+    negative_weights = weights_sorted * ~positive_sorted
+
+    # First and last position of the group of tied scores each sample belongs to
+    index = np.arange(num_samples)[:, None]
+    group_start = np.ones(scores_sorted.shape, dtype=bool)
+    group_start[1:] = scores_sorted[1:] != scores_sorted[:-1]
+    group_end = np.ones(scores_sorted.shape, dtype=bool)
+    group_end[:-1] = group_start[1:]
+    first = np.maximum.accumulate(np.where(group_start, index, 0), axis=0)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(group_end, index, num_samples - 1), axis=0), axis=0), axis=0)
+
+    # Negatives scored lower than and tied with each positive
+    negative_cumsum = np.cumsum(negative_weights, axis=-2)
+    negative_cumsum = np.concatenate([np.zeros(negative_cumsum.shape[:-2] + (1, num_out)), negative_cumsum], axis=-2)
+    leading_shape = negative_cumsum.shape[:-2]
+    negatives_below = np.take_along_axis(negative_cumsum, np.broadcast_to(first, leading_shape + first.shape), axis=-2)
+    negatives_tied = np.take_along_axis(negative_cumsum, np.broadcast_to(last + 1, leading_shape + last.shape), axis=-2) - negatives_below
+
+    area = np.sum(positive_weights * (negatives_below + 0.5 * negatives_tied), axis=-2)
+    return safe_divide(area, positive_weights.sum(axis=-2) * negative_weights.sum(axis=-2), fill=np.nan)
+
+def compute_metrics(outputs, targets, num_out:int) -> dict:
+    ''' Computes all metrics from the model outputs with one confusion matrix and one sort of the scores.
+    Torch tensors stay on their device for the confusion matrix.
+
+    Arguments:
+        outputs: Model outputs (logits) of shape (N, C), torch tensor or NumPy array.
+        targets: Integer class labels of shape (N,).
+        num_out: Number of classes C.
+    Return:
+        Dictionary with the metrics (see metrics_from_confusion_matrix), "roc_auc" and "confusion_matrix".
+    '''
+
+    if isinstance(outputs, torch.Tensor):
+        conf_matrix = confusion_matrix(targets, outputs.argmax(dim=1), num_out).cpu().numpy()
+        scores = outputs.float().cpu().numpy()
+        targets = targets.cpu().numpy()
+    else:
+        conf_matrix = confusion_matrix(targets, np.argmax(outputs, axis=1), num_out)
+        scores = outputs
+
+    metrics = metrics_from_confusion_matrix(conf_matrix)
+    metrics['roc_auc'] = auc_one_vs_rest(scores, targets, num_out)
+    metrics['confusion_matrix'] = conf_matrix
+    return metrics
+
+def average_loss_by_coverage(scores, losses, proportions) -> np.ndarray:
+    ''' Computes the average loss of the samples with the lowest scores for several proportions (coverages),
+    with one stable sort and one cumulative sum.
+
+    Arguments:
+        scores: Scores to rank the samples by (lowest first), e.g. the autoencoder loss, shape (N,).
+        losses: Losses to average, e.g. the classifier loss, shape (N,).
+        proportions: Proportions of samples to keep, in (0, 1].
+    Return:
+        Average loss per proportion, NaN where no sample is kept.
+    '''
+
+    losses_sorted = np.asarray(losses, dtype=np.float64)[np.argsort(scores, kind='stable')]
+    losses_cumsum = np.concatenate([[0.0], np.cumsum(losses_sorted)])
+    num_kept = (np.asarray(proportions) * len(losses_sorted)).astype(np.int64)
+    return safe_divide(losses_cumsum[num_kept], num_kept, fill=np.nan)
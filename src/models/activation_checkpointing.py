@@ -0,0 +1,22 @@
+import torch
+import torch.nn as nn
+
+from torch.utils.checkpoint import checkpoint
+
+def run_block(block:nn.Module, *args, checkpointing:bool=False):
+    ''' Runs a single encoder / decoder block of a model.
+    With checkpointing enabled the intermediate activations of the block are not stored during training,
+    but recomputed in the backward pass. This trades compute for memory (larger batches, 3D volumes).
+
+    Arguments:
+        block: The block (module) to run.
+        args: Positional arguments passed to the block.
+        checkpointing: Whether activation checkpointing is applied.
+    Return:
+        The output of the block.
+    '''
+
+    # Activations are only kept for the backward pass, so evaluation runs the block as usual.
+    if checkpointing and block.training and torch.is_grad_enabled():
+        return checkpoint(block, *args, use_reentrant=False)
+    return block(*args)
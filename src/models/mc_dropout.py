@@ -0,0 +1,13 @@
+import torch
+
+def replicate_batch(x:torch.Tensor, num_samples:int) -> torch.Tensor:
+    ''' Replicates a batch for MC dropout, sample t of input b is at position t * batch size + b.
+
+    Arguments:
+        x: Batch of features, first dimension is the batch size.
+        num_samples: Number of MC samples.
+    Return:
+        The replicated batch, first dimension is num_samples * batch size.
+    '''
+
+    return x.repeat((num_samples,) + (1,) * (x.dim() - 1))
@@ -0,0 +1,18 @@
+import torch.nn as nn
+from torchvision import models
+
+class MobileNetV3Small(nn.Module):
+    ''' Compact classifier (about 1.5M parameters), e.g. as student of a distilled fold ensemble. '''
+
+    def __init__(self, config, cv):
+        super(MobileNetV3Small, self).__init__()
+        self.output_size = config['num_out']
+        weights = None
+        if config['pretrained']: weights = models.MobileNet_V3_Small_Weights.DEFAULT
+        self.net = models.mobilenet_v3_small(weights=weights)
+
+        # Replace the final fully connected layer with the desired output size
+        self.net.classifier[-1] = nn.Linear(self.net.classifier[-1].in_features, self.output_size)
+
+    def forward(self, x):
+        return self.net(x)
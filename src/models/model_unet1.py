@@ -26,7 +26,10 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from pathlib import Path
-from glob import glob
+
+from models.activation_checkpointing import run_block
+from models.mc_dropout import replicate_batch
+from inference_weights import load_model_state_dict
 
 class EncoderBlock(nn.Module):
     """
@@ -67,11 +70,11 @@ class EncoderBlock(nn.Module):
             self.dropout_2 = nn.Dropout(p=dropout_rate)
 
     def apply_manual_dropout_mask(self, x, seed):
-        # Mask size : [Batch_size, Channels, Height, Width]
-        dropout_mask = torch.bernoulli(input=torch.empty(x.shape[0], x.shape[1], x.shape[2], x.shape[3]).fill_(self.dropout_rate),
-                                       generator=torch.Generator().manual_seed(seed))
+        # Mask size : [Batch_size, Channels, Height, Width], drawn on the device of x with the same scaling as nn.Dropout
+        generator = torch.Generator(device=x.device).manual_seed(seed)
+        dropout_mask = torch.empty_like(x).bernoulli_(1 - self.dropout_rate, generator=generator)
 
-        x = x*dropout_mask.to(x.device)
+        x = x*dropout_mask/(1 - self.dropout_rate)
 
         return x
 
@@ -313,6 +316,9 @@ class UNetWithoutSkips1(nn.Module):
                              If 'False', strided convolution would be used to downsample feature maps (http://arxiv.org/abs/1908.02182)
          dropout (bool) : Whether dropout should be added to central encoder and decoder blocks (eg: BayesianSegNet)
          dropout_rate (float) : Dropout probability
+         Activation checkpointing of the encoder/decoder blocks is enabled by config['activation_checkpointing']
+         MC dropout: forward with seeds (2 per block with dropout) and mc_samples replicates the batch mc_samples times
+                     before the first block with dropout, see uncertainty.mc_dropout_predict
      Returns:
          out (torch.Tensor) : Prediction of the segmentation map
 
@@ -333,6 +339,8 @@ class UNetWithoutSkips1(nn.Module):
         self.pooling = use_pooling
         self.dropout = dropout
         self.dropout_rate = dropout_rate
+        self.checkpointing = config['activation_checkpointing']
+        self.num_dropout_seeds = 8 if dropout is True else 0 # 2 seeds for each of the 2 central encoder and decoder blocks
 
         if mode == '2D':
             self.encoder = EncoderBlock
@@ -449,7 +457,7 @@ class UNetWithoutSkips1(nn.Module):
                                     out_channels=self.n_classes,
                                     kernel_size=1)
 
-    def forward(self, x, seeds=None):
+    def forward(self, x, seeds=None, mc_samples=None):
 
         if self.mode == '2D':
             h, w = x.shape[-2:]
@@ -461,13 +469,17 @@ class UNetWithoutSkips1(nn.Module):
         seed_index = 0
         for stage, enc_op in enumerate(self.contracting_path):
             if stage >= len(self.contracting_path) - 2:
+                if mc_samples is not None and stage == len(self.contracting_path) - 2:
+                    # The stages without dropout ran once, their outputs are shared by all MC samples
+                    x = replicate_batch(x, mc_samples)
+                    enc_outputs = [replicate_batch(enc_output, mc_samples) for enc_output in enc_outputs]
                 if seeds is not None:
-                    x = enc_op(x, seeds[seed_index:seed_index+2])
+                    x = run_block(enc_op, x, seeds[seed_index:seed_index+2], checkpointing=self.checkpointing)
                 else:
-                    x = enc_op(x)
+                    x = run_block(enc_op, x, checkpointing=self.checkpointing)
                 seed_index += 2 # 2 seeds required per block
             else:
-                x = enc_op(x)
+                x = run_block(enc_op, x, checkpointing=self.checkpointing)
             enc_outputs.append(x)
 
             if self.pooling is True:
@@ -476,17 +488,17 @@ class UNetWithoutSkips1(nn.Module):
                 x = self.downsampling_ops[stage](x)
 
         # Bottle-neck layer
-        x = self.bottle_neck_layer(x)
+        x = run_block(self.bottle_neck_layer, x, checkpointing=self.checkpointing)
         # Decoder
         for block_id, dec_op in enumerate(self.expanding_path):
             if block_id < 2:
                 if seeds is not None:
-                    x = dec_op(x, enc_outputs[-1-block_id], seeds[seed_index:seed_index+2])
+                    x = run_block(dec_op, x, enc_outputs[-1-block_id], seeds[seed_index:seed_index+2], checkpointing=self.checkpointing)
                 else:
-                    x = dec_op(x, enc_outputs[-1-block_id])
+                    x = run_block(dec_op, x, enc_outputs[-1-block_id], checkpointing=self.checkpointing)
                 seed_index += 2
             else:
-                x = dec_op(x, enc_outputs[-1-block_id])
+                x = run_block(dec_op, x, enc_outputs[-1-block_id], checkpointing=self.checkpointing)
 
 
         # Output
@@ -500,12 +512,24 @@ class UNetClassifier1(nn.Module):
 
         self.output_size = config['num_out']
 
-        self.contracting_path = UNetWithoutSkips1(config).contracting_path
+        # With config['unet_dropout'] the two central encoder blocks apply dropout, which allows MC dropout inference
+        unet = UNetWithoutSkips1(config, dropout=config['unet_dropout'], dropout_rate=config['dropout'])
+        self.contracting_path = unet.contracting_path
+        self.num_dropout_seeds = 4 if config['unet_dropout'] else 0
         self.avgpool = nn.AdaptiveAvgPool2d(1)
         self.fc = nn.Linear(512, self.output_size)
 
-    def forward(self, x):
-        x = self.contracting_path(x)
+    def forward(self, x, seeds=None, mc_samples=None):
+        seed_index = 0
+        for stage, enc_op in enumerate(self.contracting_path):
+            if stage >= len(self.contracting_path) - 2 and enc_op.dropout:
+                if mc_samples is not None and seed_index == 0:
+                    x = replicate_batch(x, mc_samples)
+                x = enc_op(x, None if seeds is None else seeds[seed_index:seed_index+2])
+                seed_index += 2
+            else:
+                x = enc_op(x)
+            x = F.max_pool2d(x, kernel_size=2)
         x = self.avgpool(x)
         x = x.view(x.size(0), -1)
         x = self.fc(x)
@@ -516,11 +540,7 @@ def load_unet1_with_classifier_weights(config, cv):
 
     # Load the pretrained ResNet18 model from a ".pt" file
     save_path_ae_cv = Path('./data/train_and_test', config['encoder_group'], config['encoder_name'], ('cv_' + str(cv)))
-    for path in glob(str(save_path_ae_cv / '*.pt')):
-        if "checkpoint_best" in path:
-            checkpoint_path = path
-    checkpoint = torch.load(checkpoint_path)
-    unet_classifier_dict = checkpoint['model_state_dict']
+    unet_classifier_dict = load_model_state_dict(save_path_ae_cv, 'checkpoint_best')
 
     # TODO: remove these two lines and load model from file instead
     #unet_classifier = UNetClassifier1(config)
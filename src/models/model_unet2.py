@@ -9,18 +9,16 @@ import torch
 import torch.nn as nn
 
 from pathlib import Path
-from glob import glob
+
+from models.activation_checkpointing import run_block
+from inference_weights import load_model_state_dict
 
 def load_unet2_with_classifier_weights(config, cv):
     unet_withoutskips = UNetWithoutSkips2(config, cv)
 
     # Load the pretrained ResNet18 model from a ".pt" file
     save_path_ae_cv = Path('./data/train_and_test', config['encoder_group'], config['encoder_name'], ('cv_' + str(cv)))
-    for path in glob(str(save_path_ae_cv / '*.pt')):
-        if "checkpoint_best" in path:
-            checkpoint_path = path
-    checkpoint = torch.load(checkpoint_path)
-    unet_classifier_dict = checkpoint['model_state_dict']
+    unet_classifier_dict = load_model_state_dict(save_path_ae_cv, 'checkpoint_best')
 
     # TODO: remove these two lines and load model from file instead
     #unet_classifier = UNetClassifier2(config)
@@ -73,6 +71,7 @@ class UNetWithoutSkips2(nn.Module):
     def __init__(self, config, in_channels=1, out_channels=1, init_features=64):
         super(UNetWithoutSkips2, self).__init__()
 
+        self.checkpointing = config['activation_checkpointing']
         features = init_features
         self.encoder1 = self._block(in_channels, features, name="enc1")
         self.pool1 = nn.MaxPool2d(kernel_size=2, stride=2)
@@ -107,25 +106,25 @@ class UNetWithoutSkips2(nn.Module):
         )
 
     def forward(self, x):
-        enc1 = self.encoder1(x)
-        enc2 = self.encoder2(self.pool1(enc1))
-        enc3 = self.encoder3(self.pool2(enc2))
-        enc4 = self.encoder4(self.pool3(enc3))
+        enc1 = run_block(self.encoder1, x, checkpointing=self.checkpointing)
+        enc2 = run_block(self.encoder2, self.pool1(enc1), checkpointing=self.checkpointing)
+        enc3 = run_block(self.encoder3, self.pool2(enc2), checkpointing=self.checkpointing)
+        enc4 = run_block(self.encoder4, self.pool3(enc3), checkpointing=self.checkpointing)
 
-        bottleneck = self.bottleneck(self.pool4(enc4))
+        bottleneck = run_block(self.bottleneck, self.pool4(enc4), checkpointing=self.checkpointing)
 
         dec4 = self.upconv4(bottleneck)
         #dec4 = torch.cat((dec4, enc4), dim=1)
-        dec4 = self.decoder4(dec4)
+        dec4 = run_block(self.decoder4, dec4, checkpointing=self.checkpointing)
         dec3 = self.upconv3(dec4)
         #dec3 = torch.cat((dec3, enc3), dim=1)
-        dec3 = self.decoder3(dec3)
+        dec3 = run_block(self.decoder3, dec3, checkpointing=self.checkpointing)
         dec2 = self.upconv2(dec3)
         #dec2 = torch.cat((dec2, enc2), dim=1)
-        dec2 = self.decoder2(dec2)
+        dec2 = run_block(self.decoder2, dec2, checkpointing=self.checkpointing)
         dec1 = self.upconv1(dec2)
         #dec1 = torch.cat((dec1, enc1), dim=1)
-        dec1 = self.decoder1(dec1)
+        dec1 = run_block(self.decoder1, dec1, checkpointing=self.checkpointing)
         return torch.sigmoid(self.conv(dec1))
 
     @staticmethod
@@ -6,7 +6,9 @@ import torch.nn as nn
 import torch
 from torchvision import models
 from pathlib import Path
-from glob import glob
+
+from models.activation_checkpointing import run_block
+from inference_weights import load_model_state_dict
 
 class VGG19(nn.Module):
     def __init__(self, config, cv):
@@ -38,9 +40,11 @@ class VGG19(nn.Module):
 class ResNetDecoder(nn.Module):
 
     # use inverted configs as argument to create decoder, i.e.g: configs[::-1]
-    def __init__(self, configs, bottleneck=False):
+    def __init__(self, configs, bottleneck=False, checkpointing=False):
         super(ResNetDecoder, self).__init__()
 
+        self.checkpointing = checkpointing
+
         if len(configs) != 4:
             raise ValueError("Only 4 layers can be configued")
 
@@ -69,11 +73,11 @@ class ResNetDecoder(nn.Module):
 
     def forward(self, x):
 
-        x = self.conv1(x)
-        x = self.conv2(x)
-        x = self.conv3(x)
-        x = self.conv4(x)
-        x = self.conv5(x)
+        x = run_block(self.conv1, x, checkpointing=self.checkpointing)
+        x = run_block(self.conv2, x, checkpointing=self.checkpointing)
+        x = run_block(self.conv3, x, checkpointing=self.checkpointing)
+        x = run_block(self.conv4, x, checkpointing=self.checkpointing)
+        x = run_block(self.conv5, x, checkpointing=self.checkpointing)
         x = self.gate(x)
 
         return x
@@ -251,14 +255,10 @@ def create_autoenc_vgg19(config, cv):
 
     # Load the pretrained ResNet18 model from a ".pt" file
     save_path_ae_cv = Path('./data/train_and_test', config['encoder_group'], config['encoder_name'], ('cv_' + str(cv)))
-    for path in glob(str(save_path_ae_cv / '*.pt')):
-        if "checkpoint_best" in path:
-            checkpoint_path = path
     
     resnet = VGG19(config, cv)
 
-    checkpoint = torch.load(checkpoint_path)
-    resnet.load_state_dict(checkpoint['model_state_dict'])
+    resnet.load_state_dict(load_model_state_dict(save_path_ae_cv, 'checkpoint_best'))
 
     # Define the encoder using the first layers of the model
     encoder = nn.Sequential(*list(resnet.net.children())[:-2])
@@ -268,7 +268,7 @@ def create_autoenc_vgg19(config, cv):
         param.requires_grad = False
 
     arch, bottleneck = [2, 2, 2, 2], False
-    decoder = ResNetDecoder(arch[::-1], bottleneck=bottleneck)
+    decoder = ResNetDecoder(arch[::-1], bottleneck=bottleneck, checkpointing=config['activation_checkpointing'])
 
     autoencoder = Autoencoder(encoder, decoder)
 
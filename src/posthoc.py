@@ -0,0 +1,201 @@
+import argparse
+import numpy as np
+
+from pathlib import Path
+
+from logit_cache import LogitCache, SPLIT_VALID, SPLIT_TEST
+from metrics import confusion_matrix, metrics_from_confusion_matrix, auc_one_vs_rest, METRIC_NAMES
+
+# Post-hoc analysis of cached logits (see logit_cache.py), no model is evaluated again.
+
+MAX_TEMPERATURE = 1000.0
+
+def softmax(logits:np.ndarray, temperature:float=1.0) -> np.ndarray:
+    ''' Computes the (temperature scaled) softmax, vectorized over leading dimensions.
+
+    Arguments:
+        logits: Logits of shape (..., C).
+        temperature: Divisor of the logits, values > 1 soften the probabilities.
+    Return:
+        Probabilities of shape (..., C).
+    '''
+
+    scaled = np.asarray(logits, dtype=np.float64) / temperature
+    scaled = scaled - scaled.max(axis=-1, keepdims=True)
+    exponentials = np.exp(scaled)
+    return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+def negative_log_likelihood(logits:np.ndarray, labels:np.ndarray, temperatures:np.ndarray) -> np.ndarray:
+    ''' Computes the mean negative log-likelihood of the labels for several temperatures at once.
+
+    Arguments:
+        logits: Logits of shape (N, C).
+        labels: Integer class labels of shape (N,).
+        temperatures: Temperatures of shape (T,).
+    Return:
+        Mean negative log-likelihood per temperature, shape (T,).
+    '''
+
+    scaled = np.asarray(logits, dtype=np.float64)[None] / np.asarray(temperatures, dtype=np.float64)[:, None, None]
+    maximum = scaled.max(axis=-1, keepdims=True)
+    log_normalizer = np.log(np.exp(scaled - maximum).sum(axis=-1)) + maximum[..., 0]
+    label_logits = np.take_along_axis(scaled, np.asarray(labels, dtype=np.int64)[None, :, None], axis=-1)[..., 0]
+    return np.mean(log_normalizer - label_logits, axis=-1)
+
+def fit_temperature(logits:np.ndarray, labels:np.ndarray, max_iterations:int=50, tolerance:float=1e-7) -> float:
+    ''' Fits the temperature minimizing the negative log-likelihood (temperature scaling). The likelihood is convex
+    in the inverse temperature, which is optimized with Newton steps (each step is limited to a factor of 4).
+
+    Arguments:
+        logits: Logits of shape (N, C), e.g. of the validation split.
+        labels: Integer class labels of shape (N,).
+        max_iterations: Maximum number of Newton steps.
+        tolerance: The optimization stops if the inverse temperature changes less than this.
+    Return:
+        The fitted temperature.
+    '''
+
+    logits = np.asarray(logits, dtype=np.float64)
+    label_logits = np.take_along_axis(logits, np.asarray(labels, dtype=np.int64)[:, None], axis=1)[:, 0]
+
+    inverse_temperature = 1.0
+    for _ in range(max_iterations):
+        probabilities = softmax(logits, 1.0 / inverse_temperature)
+        expected_logits = np.sum(probabilities * logits, axis=1)
+        gradient = np.mean(expected_logits - label_logits)
+        curvature = np.mean(np.sum(probabilities * logits**2, axis=1) - expected_logits**2)
+        if curvature <= 0:
+            break
+        updated = np.clip(inverse_temperature - gradient / curvature, inverse_temperature / 4, inverse_temperature * 4)
+        updated = max(updated, 1.0 / MAX_TEMPERATURE) # uninformative logits would diverge to an infinite temperature
+        converged = abs(updated - inverse_temperature) < tolerance
+        inverse_temperature = updated
+        if converged:
+            break
+    return float(1.0 / inverse_temperature)
+
+def expected_calibration_error(probabilities:np.ndarray, labels:np.ndarray, num_bins:int=15) -> float:
+    ''' Computes the expected calibration error of the top-1 confidence with equal-width bins.
+
+    Arguments:
+        probabilities: Probabilities of shape (N, C).
+        labels: Integer class labels of shape (N,).
+        num_bins: Number of confidence bins.
+    Return:
+        Weighted mean absolute difference between accuracy and confidence of the bins.
+    '''
+
+    confidences = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    bins = np.minimum((confidences * num_bins).astype(np.int64), num_bins - 1)
+    counts = np.bincount(bins, minlength=num_bins)
+    gaps = np.bincount(bins, weights=correct - confidences, minlength=num_bins)
+    return float(np.abs(gaps).sum() / max(counts.sum(), 1))
+
+def threshold_sweep(positive_scores:np.ndarray, labels:np.ndarray, thresholds:np.ndarray=None) -> dict:
+    ''' Computes the metrics of a binary classifier for all decision thresholds at once
+    (prediction positive if the score is >= threshold), with one sort and cumulative sums.
+
+    Arguments:
+        positive_scores: Score (e.g. probability) of the positive class 1, shape (N,).
+        labels: Binary labels of shape (N,).
+        thresholds: Thresholds of shape (T,), default: all distinct scores.
+    Return:
+        Dictionary with "thresholds" and the metrics of metrics_from_confusion_matrix, each of shape (T,).
+    '''
+
+    positive_scores = np.asarray(positive_scores, dtype=np.float64)
+    labels = np.asarray(labels)
+    if thresholds is None:
+        thresholds = np.unique(positive_scores)
+
+    order = np.argsort(positive_scores, kind='stable')
+    scores_sorted = positive_scores[order]
+    positives_cumsum = np.concatenate([[0], np.cumsum(labels[order] == 1)])
+
+    # Samples below the threshold are predicted negative
+    num_below = np.searchsorted(scores_sorted, thresholds, side='left')
+    fn = positives_cumsum[num_below]
+    tn = num_below - fn
+    tp = positives_cumsum[-1] - fn
+    fp = len(labels) - num_below - tp
+
+    conf_matrices = np.stack([np.stack([tn, fp], axis=-1), np.stack([fn, tp], axis=-1)], axis=-2)
+    sweep = metrics_from_confusion_matrix(conf_matrices)
+    sweep['thresholds'] = np.asarray(thresholds)
+    return sweep
+
+def best_threshold(positive_scores:np.ndarray, labels:np.ndarray, metric:str='mcc') -> float:
+    ''' Gets the decision threshold maximizing a metric, e.g. tuned on the validation split.
+
+    Arguments:
+        positive_scores: Score of the positive class 1, shape (N,).
+        labels: Binary labels of shape (N,).
+        metric: Name of the metric, one of METRIC_NAMES.
+    Return:
+        The threshold.
+    '''
+
+    sweep = threshold_sweep(positive_scores, labels)
+    return float(sweep['thresholds'][np.argmax(sweep[metric])])
+
+def recompute_metrics(records:np.ndarray, temperature:float=1.0, threshold:float=None) -> dict:
+    ''' Recomputes all metrics of cached predictions, optionally temperature scaled and with a tuned decision threshold.
+
+    Arguments:
+        records: Prediction store of a classifier (see prediction_store.py).
+        temperature: Temperature applied to the logits.
+        threshold: Decision threshold of the positive class (two classes only), None for the argmax.
+    Return:
+        Dictionary with the METRIC_NAMES, "roc_auc", "ece" and "nll".
+    '''
+
+    logits = np.asarray(records['logits'], dtype=np.float64)
+    labels = np.asarray(records['label'], dtype=np.int64)
+    num_out = logits.shape[1]
+    probabilities = softmax(logits, temperature)
+
+    predictions = probabilities.argmax(axis=1) if threshold is None else (probabilities[:, 1] >= threshold).astype(np.int64)
+    metrics = metrics_from_confusion_matrix(confusion_matrix(labels, predictions, num_out))
+    metrics['roc_auc'] = auc_one_vs_rest(logits, labels, num_out)
+    metrics['ece'] = expected_calibration_error(probabilities, labels)
+    metrics['nll'] = float(negative_log_likelihood(logits, labels, [temperature])[0])
+    return metrics
+
+def analyze_run(save_path:Path, checkpoint_name:str, metric:str='mcc') -> None:
+    ''' Prints the calibration and threshold analysis of every fold of a run. Temperature and threshold are tuned
+    on the cached validation predictions and applied to the cached test predictions.
+
+    Arguments:
+        save_path: Location of the run, e.g. "./data/train_and_test/group/name".
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        metric: Metric the threshold is tuned for.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    for save_path_cv in sorted(Path(save_path).glob('cv_*')):
+        cache = LogitCache(save_path_cv)
+        if not (cache.contains(checkpoint_name, SPLIT_VALID) and cache.contains(checkpoint_name, SPLIT_TEST)):
+            print(save_path_cv.name + ': no cached validation and test predictions of', checkpoint_name)
+            continue
+        valid, test = cache.load(checkpoint_name, SPLIT_VALID), cache.load(checkpoint_name, SPLIT_TEST)
+
+        temperature = fit_temperature(valid['logits'], valid['label'])
+        threshold = None
+        if valid['logits'].shape[1] == 2:
+            threshold = best_threshold(softmax(valid['logits'], temperature)[:, 1], valid['label'], metric)
+
+        print('\n' + save_path_cv.name, checkpoint_name, '(temperature: ' + str(round(temperature, 4)) + ', threshold: ' + str(threshold) + ')')
+        for title, results in [('   Uncalibrated: ', recompute_metrics(test)),
+                               ('   Calibrated:   ', recompute_metrics(test, temperature, threshold))]:
+            print(title, ', '.join(name + ' ' + str(round(float(results[name]), 4)) for name in METRIC_NAMES + ['ece', 'nll']))
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Post-hoc calibration and threshold analysis of cached predictions')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-m', '--metric', default='mcc', type=str, help='metric the threshold is tuned for (default: mcc)')
+    args = args.parse_args()
+
+    analyze_run(args.run, args.checkpoint, args.metric)
@@ -0,0 +1,179 @@
+import os
+import csv
+import time
+import torch
+import argparse
+import numpy as np
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+
+from utils import Utils
+from config import NAME_CONFIG_FILE_STANDARD
+from checkpoint import Checkpoint
+from checkpoint_index import CheckpointIndex, KIND_TRAINING, KIND_INFERENCE
+from ensemble import FoldEnsemble
+from accumulators import PredictionBuffer
+from compilation import get_memory_format
+from dataset import IVOCT_InferenceDataset
+from uncertainty import predictive_uncertainty
+from prediction_store import get_sample_info
+from pullback_aggregation import smooth_probabilities, plaque_burden, SMOOTHING_NONE
+
+FILE_NAME_FRAME_PREDICTIONS = 'frame_predictions.csv'
+FILE_NAME_PULLBACK_PREDICTIONS = 'pullback_predictions.csv'
+
+def read_run_config(run_path:Path) -> dict:
+    ''' Reads the configuration of a trained run without the "Config" object, so no prompt is shown and no directory is created.
+    The stored config of the run overwrites the standard configuration (keys added after the run was trained keep their defaults).
+
+    Arguments:
+        run_path: Location of the run, e.g. "./data/train_and_test/group/name".
+    Return:
+        The configuration as dict.
+    '''
+
+    config = Utils.read_json('./src/' + NAME_CONFIG_FILE_STANDARD)
+    config.update(Utils.read_json(Path(run_path) / 'config.json'))
+    config.setdefault('transformations_chosen', [])
+    return config
+
+def load_fold_models(run_path:Path, checkpoint_name:str, folds:list, device, config:dict) -> list:
+    ''' Loads the model of a checkpoint for the given folds of a run.
+
+    Arguments:
+        run_path: Location of the run.
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        folds: Numbers of the CV rounds (starting at 1).
+        device: Hardware to run the models on.
+        config: Configuration of the run.
+    Return:
+        List of the models in eval mode.
+    '''
+
+    models = []
+    for cv in folds:
+        save_path_cv = Path(run_path) / ('cv_' + str(cv))
+        index = CheckpointIndex(save_path_cv)
+        if index.get(checkpoint_name, KIND_TRAINING) is None and index.get(checkpoint_name, KIND_INFERENCE) is None:
+            raise FileNotFoundError('No checkpoint "' + checkpoint_name + '" found in ' + str(save_path_cv))
+        model, _ = Checkpoint.load_inference_model(checkpoint_name, save_path_cv, device, config, cv)
+        models.append(model)
+    return models
+
+def predict(ensemble:FoldEnsemble, dataloader:DataLoader) -> dict:
+    ''' Streams all frames through the models of the ensemble.
+
+    Arguments:
+        ensemble: The models of the folds.
+        dataloader: Dataloader of an IVOCT_InferenceDataset.
+    Return:
+        Dictionary of NumPy arrays per frame: "mean_probabilities", "entropy", "mutual_information" and "agreement".
+    '''
+
+    predictions = PredictionBuffer(len(dataloader.dataset), ensemble.device)
+    for inputs, _ in dataloader:
+        inputs = inputs.to(ensemble.device, memory_format=get_memory_format(ensemble.config), non_blocking=True)
+
+        with torch.set_grad_enabled(False):
+            with torch.cuda.amp.autocast():
+                predictions.add(**predictive_uncertainty(ensemble.forward(inputs)))
+
+    return {name: predictions.numpy(name) for name in ['mean_probabilities', 'entropy', 'mutual_information', 'agreement']}
+
+def write_predictions(output_path:Path, dataset:IVOCT_InferenceDataset, results:dict, label_classes:list,
+                      smoothing:str=SMOOTHING_NONE, window:int=5, stay_probability:float=0.9) -> None:
+    ''' Writes the predictions per frame and the aggregates per pullback as csv files.
+
+    Arguments:
+        output_path: Directory of the csv files.
+        dataset: The evaluated frames.
+        results: Predictions per frame (see predict).
+        label_classes: Names of the classes.
+        smoothing: Smoothing of the predictions along the pullbacks, see pullback_aggregation.smooth_probabilities.
+        window: Number of frames of the median window.
+        stay_probability: Probability that neighbouring frames have the same class (hmm).
+    Return:
+        This Method has nothing to return.
+    '''
+
+    os.makedirs(output_path, exist_ok=True)
+    sample_info = get_sample_info(dataset)
+    probabilities = results['mean_probabilities']
+    predicted = probabilities.argmax(axis=1)
+    confidence = probabilities.max(axis=1)
+    smoothed = smooth_probabilities(np.log(np.clip(probabilities, 1e-12, None)), sample_info['pullback'], sample_info['frame'], smoothing, window, stay_probability)
+    smoothed_predicted = smoothed.argmax(axis=1)
+    burden = plaque_burden(smoothed_predicted, sample_info['pullback'], sample_info['frame'], probabilities.shape[1])
+
+    with open(output_path / FILE_NAME_FRAME_PREDICTIONS, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['file', 'pullback', 'frame', 'prediction', 'confidence', 'entropy', 'disagreement', 'agreement',
+                         'smoothed_prediction', 'smoothed_confidence'] + ['p_' + name for name in label_classes])
+        for i in range(len(dataset)):
+            writer.writerow([dataset.files[i], sample_info['pullback'][i], sample_info['frame'][i], label_classes[predicted[i]],
+                             round(float(confidence[i]), 5), round(float(results['entropy'][i]), 5),
+                             round(float(results['mutual_information'][i]), 5), round(float(results['agreement'][i]), 5),
+                             label_classes[smoothed_predicted[i]], round(float(smoothed[i, smoothed_predicted[i]]), 5)]
+                            + [round(float(p), 5) for p in probabilities[i]])
+
+    # Aggregates per pullback: mean probabilities, fraction of frames per predicted class and mean confidence
+    pullbacks, pullback_ids = np.unique(sample_info['pullback'], return_inverse=True)
+    num_frames = np.bincount(pullback_ids, minlength=len(pullbacks))
+    mean_probabilities = np.stack([np.bincount(pullback_ids, weights=probabilities[:, c], minlength=len(pullbacks))
+                                   for c in range(probabilities.shape[1])], axis=1) / num_frames[:, None]
+    class_fractions = np.bincount(pullback_ids * probabilities.shape[1] + predicted, minlength=len(pullbacks) * probabilities.shape[1])
+    class_fractions = class_fractions.reshape(len(pullbacks), probabilities.shape[1]) / num_frames[:, None]
+    mean_confidence = np.bincount(pullback_ids, weights=confidence, minlength=len(pullbacks)) / num_frames
+
+    with open(output_path / FILE_NAME_PULLBACK_PREDICTIONS, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['pullback', 'frames', 'mean_confidence'] + ['p_' + name for name in label_classes]
+                        + ['fraction_' + name for name in label_classes] + ['plaque_burden', 'longest_plaque_segment'])
+        for i, pullback in enumerate(pullbacks):
+            # The burden of the smoothed predictions, plaque_burden sorts the pullbacks like np.unique
+            writer.writerow([pullback, num_frames[i], round(float(mean_confidence[i]), 5)]
+                            + [round(float(p), 5) for p in mean_probabilities[i]] + [round(float(f), 5) for f in class_fractions[i]]
+                            + [round(float(burden['burden'][i]), 5), burden['longest_segment'][i]])
+
+def main(run_path:Path, source:str, checkpoint_name:str, folds:list, batch_size:int, num_workers:int, output_path:Path) -> None:
+    config = read_run_config(run_path)
+    if config['auto_encoder']:
+        raise ValueError('Prediction is only supported for classifiers.')
+
+    device = Utils.config_torch_and_cuda(config) if torch.cuda.is_available() else torch.device('cpu')
+    folds = folds or list(range(1, config['num_cv'] + 1))
+    ensemble = FoldEnsemble(load_fold_models(run_path, checkpoint_name, folds, device, config), device, config, vectorize=config['ensemble_vectorize'])
+
+    dataset = IVOCT_InferenceDataset(source, config)
+    dataloader = DataLoader(dataset,
+                            batch_size=batch_size or config['batch_size'],
+                            num_workers=num_workers,
+                            pin_memory=device.type == 'cuda',
+                            prefetch_factor=4 if num_workers > 0 else None,
+                            persistent_workers=False)
+
+    print('Frames:', len(dataset), '- Folds:', folds, '- Checkpoint:', checkpoint_name)
+    start_time = time.time()
+    results = predict(ensemble, dataloader)
+    duration = time.time() - start_time
+    print('Duration:', str(round(duration, 2)) + 's', '(' + str(round(len(dataset) / duration, 1)) + ' frames/s)')
+
+    label_classes = ['No Plaque', 'Plaque'] if config['num_out'] == 2 else ['No Plaque', 'Calcified Plaque', 'Lipid/fibrous Plaque']
+    output_path = Path(output_path) if output_path else Path(run_path) / 'predictions' / Path(source).stem
+    write_predictions(output_path, dataset, results, label_classes, config['pullback_smoothing'], config['pullback_window'], config['pullback_stay_probability'])
+    print('Predictions stored in', output_path)
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Predict new frames with the models of a trained run')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-i', '--input', required=True, type=str, help='folder of h5 files, .npy file of images or .npz store')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-cv', '--folds', default=None, type=str, help='comma separated folds, averaged as ensemble (default: all)')
+    args.add_argument('-bs', '--batch_size', default=None, type=int, help='batch size (default: batch size of the run)')
+    args.add_argument('-nw', '--num_workers', default=4, type=int, help='data loading workers (default: 4)')
+    args.add_argument('-o', '--output', default=None, type=str, help='output directory (default: <run>/predictions/<input name>)')
+    args = args.parse_args()
+
+    folds = [int(cv) for cv in args.folds.split(',')] if args.folds else None
+    main(Path(args.run), args.input, args.checkpoint, folds, args.batch_size, args.num_workers, args.output)
@@ -0,0 +1,123 @@
+import os
+import numpy as np
+
+from pathlib import Path
+
+# Stored per checkpoint and split in the logit cache of the fold directory (see logit_cache.py)
+PREDICTION_STORE_SUFFIX = '_predictions.npy'
+
+# Fields identifying a sample, stored for classifiers and autoencoders. The "sample_id" is stable across runs
+# (the path of the file below the data directory, e.g. "set1/im_12.h5"), the "sample_index" is the position of the
+# file in the file list of DatasetPreparation and depends on the directory listing. Strings are stored with the
+# width of the longest value, nothing is truncated.
+SAMPLE_STRING_FIELDS = ['sample_id', 'pullback']
+
+def sample_fields(sample_info:dict) -> list:
+    ''' Gets the structured dtype fields identifying the samples.
+
+    Arguments:
+        sample_info: Dictionary with "sample_id", "sample_index", "pullback" and "frame" of every sample.
+    Return:
+        List of (name, dtype) tuples.
+    '''
+
+    widths = {name: max([len(str(value)) for value in sample_info[name]] + [1]) for name in SAMPLE_STRING_FIELDS}
+    return [('sample_id', 'U' + str(widths['sample_id'])), ('sample_index', np.int64), ('pullback', 'U' + str(widths['pullback'])),
+            ('frame', np.int32), ('label', np.int16)]
+
+def prediction_store_dtype(sample_info:dict, num_out:int=None) -> np.dtype:
+    ''' Gets the structured dtype of a prediction store, one record per sample.
+
+    Arguments:
+        sample_info: Dictionary with the identity of every sample, see sample_fields.
+        num_out: Number of classes of a classifier, None for an autoencoder.
+    Return:
+        Classifier: sample fields, logits, softmax, cross-entropy and linear loss.
+        Autoencoder: sample fields, MSE and L1 loss.
+    '''
+
+    if num_out is None:
+        return np.dtype(sample_fields(sample_info) + [('mse_loss', np.float32), ('l1_loss', np.float32)])
+    return np.dtype(sample_fields(sample_info) + [('logits', np.float32, (num_out,)), ('softmax', np.float32, (num_out,)),
+                                                  ('ce_loss', np.float32), ('linear_loss', np.float32)])
+
+def get_sample_info(dataset) -> dict:
+    ''' Gets the identity of every sample of a dataset, datasets without sample information are indexed by position.
+
+    Arguments:
+        dataset: The evaluated dataset, e.g. an IVOCT_Dataset.
+    Return:
+        Dictionary with the arrays "sample_id", "sample_index", "pullback" and "frame".
+    '''
+
+    if hasattr(dataset, 'sample_info'):
+        return dataset.sample_info()
+    return {
+        'sample_id': np.arange(len(dataset)).astype(str),
+        'sample_index': np.arange(len(dataset), dtype=np.int64),
+        'pullback': np.full(len(dataset), ''),
+        'frame': np.full(len(dataset), -1, dtype=np.int32),
+    }
+
+def create_prediction_store(sample_info:dict, labels:np.ndarray, num_out:int=None, **columns) -> np.ndarray:
+    ''' Creates the records of a prediction store from per-sample columns.
+
+    Arguments:
+        sample_info: Dictionary with "sample_id", "sample_index", "pullback" and "frame" of every sample (see IVOCT_Dataset.sample_info).
+        labels: Label of every sample.
+        num_out: Number of classes of a classifier, None for an autoencoder.
+        columns: The remaining fields of prediction_store_dtype by name.
+    Return:
+        Structured array with one record per sample.
+    '''
+
+    records = np.empty(len(labels), dtype=prediction_store_dtype(sample_info, num_out))
+    for name in ['sample_id', 'sample_index', 'pullback', 'frame']:
+        records[name] = sample_info[name]
+    records['label'] = labels
+    for name, values in columns.items():
+        records[name] = values
+    return records
+
+def save_prediction_store(records:np.ndarray, path:Path) -> None:
+    ''' Saves a prediction store as .npy file atomically (temporary file and rename).
+
+    Arguments:
+        records: Structured array of the predictions.
+        path: Location of the file.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    path = Path(path)
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as file:
+        np.save(file, records)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+def load_prediction_store(path:Path) -> np.ndarray:
+    ''' Loads a prediction store memory-mapped, records are only read from disk when accessed.
+
+    Arguments:
+        path: Location of the file.
+    Return:
+        Read-only structured array of the predictions.
+    '''
+
+    return np.load(path, mmap_mode='r')
+
+def join_by_sample_id(left:np.ndarray, right:np.ndarray) -> tuple:
+    ''' Matches the records of two prediction stores (e.g. classifier and autoencoder) by their stable sample id,
+    independent of the order in which the files were listed by each run.
+
+    Arguments:
+        left: Structured array with the field "sample_id".
+        right: Structured array with the field "sample_id".
+    Return:
+        Tuple of the positions in left and the positions in right of the samples stored in both, ordered by sample id.
+    '''
+
+    _, left_positions, right_positions = np.intersect1d(left['sample_id'], right['sample_id'], assume_unique=True, return_indices=True)
+    return left_positions, right_positions
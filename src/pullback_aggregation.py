@@ -0,0 +1,270 @@
+import csv
+import argparse
+import numpy as np
+
+from pathlib import Path
+
+from logit_cache import LogitCache, SPLIT_TEST
+from metrics import confusion_matrix, metrics_from_confusion_matrix, METRIC_NAMES
+
+# Aggregation of frame predictions per pullback from cached predictions (see logit_cache.py), no model is evaluated
+# again. The frames of a pullback are ordered by their frame number, neighbouring frames are smoothed together
+# (vectorized over all frames and pullbacks) and the plaque burden of every pullback is summarized.
+
+SMOOTHING_NONE = 'none'
+SMOOTHING_MEDIAN = 'median'
+SMOOTHING_HMM = 'hmm'
+SMOOTHINGS = [SMOOTHING_NONE, SMOOTHING_MEDIAN, SMOOTHING_HMM]
+
+FILE_NAME_PULLBACK_REPORT = 'pullback_report_{}.csv'
+
+def order_frames(pullbacks:np.ndarray, frames:np.ndarray) -> tuple:
+    ''' Orders the frames by pullback and frame number.
+
+    Arguments:
+        pullbacks: Pullback name of every frame (N,).
+        frames: Frame number of every frame within its pullback (N,).
+    Return:
+        Tuple of the order (N,) (positions of the frames in sequence order), the sorted pullback names (P,) and the
+        pullback id of every frame in sequence order (N,).
+    '''
+
+    names, pullback_ids = np.unique(pullbacks, return_inverse=True)
+    order = np.lexsort((np.asarray(frames), pullback_ids))
+    return order, names, pullback_ids[order]
+
+def median_smooth(values:np.ndarray, pullback_ids:np.ndarray, window:int) -> np.ndarray:
+    ''' Applies a running median over neighbouring frames of the same pullback, the first and last frame of a
+    pullback are repeated at its borders. All frames are gathered at once with an (N, window) index matrix.
+
+    Arguments:
+        values: Values of the frames in sequence order (N, C), e.g. log-probabilities.
+        pullback_ids: Pullback id of every frame in sequence order (N,).
+        window: Number of frames of the (odd) window.
+    Return:
+        Smoothed values of shape (N, C).
+    '''
+
+    positions = np.arange(len(pullback_ids))
+    counts = np.bincount(pullback_ids)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[pullback_ids]
+    ends = starts + counts[pullback_ids] - 1
+    offsets = np.arange(window) - window // 2
+    neighbours = np.clip(positions[:, None] + offsets[None, :], starts[:, None], ends[:, None])
+    return np.median(np.asarray(values)[neighbours], axis=1)
+
+def hmm_smooth(probabilities:np.ndarray, pullback_ids:np.ndarray, stay_probability:float, priors:np.ndarray=None) -> np.ndarray:
+    ''' Computes the posterior class probabilities of a hidden Markov model along each pullback (forward-backward).
+    The frame probabilities divided by the class priors are the emission likelihoods, a frame keeps the class of its
+    predecessor with stay_probability. The pullbacks are padded to the longest one and processed together, one
+    vectorized step per frame position.
+
+    Arguments:
+        probabilities: Softmax probabilities of the frames in sequence order (N, C).
+        pullback_ids: Pullback id of every frame in sequence order (N,).
+        stay_probability: Probability that neighbouring frames have the same class.
+        priors: Class priors of the classifier (C,), default: the mean of the probabilities.
+    Return:
+        Posterior probabilities of shape (N, C).
+    '''
+
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    num_out = probabilities.shape[1]
+    priors = probabilities.mean(axis=0) if priors is None else np.asarray(priors, dtype=np.float64)
+    transitions = np.full((num_out, num_out), (1 - stay_probability) / max(num_out - 1, 1))
+    np.fill_diagonal(transitions, stay_probability)
+
+    # (P, L, C) emissions, the padding after the end of a pullback is uninformative
+    counts = np.bincount(pullback_ids)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    steps = np.arange(len(pullback_ids)) - starts[pullback_ids]
+    emissions = np.ones((len(counts), counts.max(), num_out))
+    emissions[pullback_ids, steps] = probabilities / np.clip(priors, 1e-12, None)
+
+    # Scaled forward and backward passes
+    forward = np.empty_like(emissions)
+    state = priors[None, :] * emissions[:, 0]
+    forward[:, 0] = state / state.sum(axis=1, keepdims=True)
+    for step in range(1, emissions.shape[1]):
+        state = (forward[:, step - 1] @ transitions) * emissions[:, step]
+        forward[:, step] = state / state.sum(axis=1, keepdims=True)
+    backward = np.ones_like(emissions)
+    for step in range(emissions.shape[1] - 2, -1, -1):
+        state = (emissions[:, step + 1] * backward[:, step + 1]) @ transitions.T
+        backward[:, step] = state / state.sum(axis=1, keepdims=True)
+
+    posteriors = forward[pullback_ids, steps] * backward[pullback_ids, steps]
+    return posteriors / posteriors.sum(axis=1, keepdims=True)
+
+def smooth_probabilities(logits:np.ndarray, pullbacks:np.ndarray, frames:np.ndarray, smoothing:str=SMOOTHING_MEDIAN,
+                         window:int=5, stay_probability:float=0.9) -> np.ndarray:
+    ''' Smooths the predictions of the frames along their pullbacks.
+
+    Arguments:
+        logits: Logits (or log-probabilities) of the frames (N, C) in any order.
+        pullbacks: Pullback name of every frame (N,).
+        frames: Frame number of every frame (N,).
+        smoothing: One of SMOOTHINGS: "none", "median" (running median of the log-probabilities over window frames)
+                   or "hmm" (posteriors of the hidden Markov model with stay_probability).
+        window: Number of frames of the median window.
+        stay_probability: Probability that neighbouring frames have the same class (hmm).
+    Return:
+        Smoothed probabilities (N, C) in the order of the inputs.
+    '''
+
+    if smoothing not in SMOOTHINGS:
+        raise ValueError('Smoothing "' + smoothing + '" unknown, use one of ' + ', '.join(SMOOTHINGS) + '.')
+    logits = np.asarray(logits, dtype=np.float64)
+    log_probabilities = logits - logits.max(axis=1, keepdims=True)
+    log_probabilities -= np.log(np.exp(log_probabilities).sum(axis=1, keepdims=True))
+    if smoothing == SMOOTHING_NONE:
+        return np.exp(log_probabilities)
+
+    order, _, pullback_ids = order_frames(pullbacks, frames)
+    if smoothing == SMOOTHING_MEDIAN:
+        smoothed = median_smooth(log_probabilities[order], pullback_ids, window)
+        smoothed = np.exp(smoothed - smoothed.max(axis=1, keepdims=True))
+        smoothed /= smoothed.sum(axis=1, keepdims=True)
+    else:
+        smoothed = hmm_smooth(np.exp(log_probabilities[order]), pullback_ids, stay_probability)
+
+    probabilities = np.empty_like(smoothed)
+    probabilities[order] = smoothed
+    return probabilities
+
+def plaque_burden(predictions:np.ndarray, pullbacks:np.ndarray, frames:np.ndarray, num_out:int) -> dict:
+    ''' Summarizes the plaque burden of every pullback, class 0 is "No Plaque".
+
+    Arguments:
+        predictions: Class of every frame (N,) (predicted or labeled).
+        pullbacks: Pullback name of every frame (N,).
+        frames: Frame number of every frame (N,).
+        num_out: Number of classes.
+    Return:
+        Dictionary with the sorted "pullbacks" (P,), their number of "frames" (P,), the "class_fractions" (P, C),
+        the "burden" (fraction of frames with plaque) and the "longest_segment" of consecutive plaque frames (P,).
+    '''
+
+    order, names, pullback_ids = order_frames(pullbacks, frames)
+    predictions = np.asarray(predictions, dtype=np.int64)[order]
+    num_frames = np.bincount(pullback_ids, minlength=len(names))
+    class_fractions = np.bincount(pullback_ids * num_out + predictions, minlength=len(names) * num_out).reshape(len(names), num_out) / num_frames[:, None]
+
+    # Segments of consecutive plaque frames start at a plaque frame after a non-plaque frame or a new pullback
+    plaque = predictions > 0
+    segment_starts = plaque.copy()
+    segment_starts[1:] &= ~plaque[:-1] | (pullback_ids[1:] != pullback_ids[:-1])
+    segment_ids = np.cumsum(segment_starts) - 1
+    segment_lengths = np.bincount(segment_ids[plaque], minlength=segment_starts.sum())
+    longest_segment = np.zeros(len(names), dtype=np.int64)
+    np.maximum.at(longest_segment, pullback_ids[segment_starts], segment_lengths)
+
+    return {
+        'pullbacks': names,
+        'frames': num_frames,
+        'class_fractions': class_fractions,
+        'burden': 1 - class_fractions[:, 0],
+        'longest_segment': longest_segment,
+    }
+
+def pullback_report(records:np.ndarray, smoothing:str=SMOOTHING_MEDIAN, window:int=5, stay_probability:float=0.9) -> dict:
+    ''' Smooths cached predictions along the pullbacks and evaluates them per frame and per pullback.
+
+    Arguments:
+        records: Prediction store of a classifier (see prediction_store.py).
+        smoothing: One of SMOOTHINGS.
+        window: Number of frames of the median window.
+        stay_probability: Probability that neighbouring frames have the same class (hmm).
+    Return:
+        Dictionary with the frame "metrics" of the raw and the "smoothed_metrics" of the smoothed predictions, the
+        smoothed "probabilities" (N, C), the "predicted" and "labeled" plaque burden (see plaque_burden), the
+        "pullback_metrics" (METRIC_NAMES per pullback, (P,) each) and the "burden_error" (mean absolute difference).
+    '''
+
+    logits, labels = np.asarray(records['logits']), np.asarray(records['label'], dtype=np.int64)
+    pullbacks, frames = np.asarray(records['pullback']), np.asarray(records['frame'])
+    num_out = logits.shape[1]
+    probabilities = smooth_probabilities(logits, pullbacks, frames, smoothing, window, stay_probability)
+    predictions = probabilities.argmax(axis=1)
+
+    # One confusion matrix per pullback with a single bincount
+    names, pullback_ids = np.unique(pullbacks, return_inverse=True)
+    pullback_conf_matrices = np.bincount(pullback_ids * num_out**2 + labels * num_out + predictions,
+                                         minlength=len(names) * num_out**2).reshape(len(names), num_out, num_out)
+    pullback_metrics = metrics_from_confusion_matrix(pullback_conf_matrices)
+
+    predicted = plaque_burden(predictions, pullbacks, frames, num_out)
+    labeled = plaque_burden(labels, pullbacks, frames, num_out)
+    return {
+        'metrics': metrics_from_confusion_matrix(confusion_matrix(labels, logits.argmax(axis=1), num_out)),
+        'smoothed_metrics': metrics_from_confusion_matrix(pullback_conf_matrices.sum(axis=0)),
+        'probabilities': probabilities,
+        'predicted': predicted,
+        'labeled': labeled,
+        'pullback_metrics': {name: pullback_metrics[name] for name in METRIC_NAMES},
+        'burden_error': float(np.mean(np.abs(predicted['burden'] - labeled['burden']))),
+    }
+
+def write_pullback_report(path:Path, report:dict, label_classes:list=None) -> None:
+    ''' Writes the per-pullback results of a report as csv file.
+
+    Arguments:
+        path: Location of the csv file.
+        report: Report of pullback_report.
+        label_classes: Names of the classes, default: their numbers.
+    Return:
+        This Method has nothing to return.
+    '''
+
+    predicted, labeled = report['predicted'], report['labeled']
+    label_classes = label_classes or [str(c) for c in range(predicted['class_fractions'].shape[1])]
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['pullback', 'frames', 'burden', 'labeled_burden', 'longest_segment', 'labeled_longest_segment']
+                        + ['fraction_' + name for name in label_classes] + METRIC_NAMES)
+        for i, pullback in enumerate(predicted['pullbacks']):
+            writer.writerow([pullback, predicted['frames'][i], round(float(predicted['burden'][i]), 5), round(float(labeled['burden'][i]), 5),
+                             predicted['longest_segment'][i], labeled['longest_segment'][i]]
+                            + [round(float(f), 5) for f in predicted['class_fractions'][i]]
+                            + [round(float(report['pullback_metrics'][name][i]), 5) for name in METRIC_NAMES])
+
+def report_fold(save_path_cv:Path, checkpoint_name:str, smoothing:str=SMOOTHING_MEDIAN, window:int=5,
+                stay_probability:float=0.9, label_classes:list=None, decimals:int=4) -> dict:
+    ''' Prints the pullback summary of the cached test predictions of a fold and writes its FILE_NAME_PULLBACK_REPORT.
+
+    Arguments:
+        save_path_cv: Location where this CV round is stored.
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        smoothing: One of SMOOTHINGS.
+        window: Number of frames of the median window.
+        stay_probability: Probability that neighbouring frames have the same class (hmm).
+        label_classes: Names of the classes.
+        decimals: Number of printed decimals.
+    Return:
+        The report, see pullback_report.
+    '''
+
+    report = pullback_report(LogitCache(save_path_cv).load(checkpoint_name, SPLIT_TEST), smoothing, window, stay_probability)
+    write_pullback_report(Path(save_path_cv) / FILE_NAME_PULLBACK_REPORT.format(checkpoint_name), report, label_classes)
+
+    print('\n' + checkpoint_name, 'Pullbacks (' + smoothing + ' smoothing,', len(report['predicted']['pullbacks']), 'pullbacks):')
+    for title, name in [('   Accuracy:      ', 'accuracy'), ('   BACC:          ', 'bacc'), ('   MCC:           ', 'mcc')]:
+        print(title, round(float(report['metrics'][name]), decimals), '->', round(float(report['smoothed_metrics'][name]), decimals))
+    print('   Burden MAE:    ', round(report['burden_error'], decimals))
+    return report
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Pullback reports of cached test predictions')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-s', '--smoothing', default=SMOOTHING_MEDIAN, choices=SMOOTHINGS, help='temporal smoothing (default: median)')
+    args.add_argument('-w', '--window', default=5, type=int, help='frames of the median window (default: 5)')
+    args.add_argument('-sp', '--stay_probability', default=0.9, type=float, help='probability of the same class in the next frame (default: 0.9)')
+    args = args.parse_args()
+
+    for save_path_cv in sorted(Path(args.run).glob('cv_*')):
+        if not LogitCache(save_path_cv).contains(args.checkpoint, SPLIT_TEST):
+            print(save_path_cv.name + ': no cached test predictions of', args.checkpoint)
+            continue
+        print('\n' + save_path_cv.name, end='')
+        report_fold(save_path_cv, args.checkpoint, args.smoothing, args.window, args.stay_probability)
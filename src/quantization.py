@@ -0,0 +1,156 @@
+import io
+import os
+import copy
+import torch
+import argparse
+import numpy as np
+import torch.nn as nn
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from eval import Eval
+from utils import Utils
+from logger import Logger
+from checkpoint import Checkpoint
+from dataset import IVOCT_Dataset
+from dataset_preparation import DatasetPreparation
+from benchmark import measure_latency
+from export import PreprocessedModel, export_torchscript, DIR_NAME_EXPORT, TORCHSCRIPT_SUFFIX
+from predict import read_run_config
+
+QUANTIZABLE_MODELS = ['ResNet18', 'VGG19']
+QUANTIZATION_DYNAMIC = 'int8_dynamic'
+QUANTIZATION_STATIC = 'int8_static'
+FILE_NAME_QUANTIZATION_RESULTS = 'quantization_results.json'
+
+def quantize_linear_dynamic(model:nn.Module) -> nn.Module:
+    ''' Quantizes the weights of the linear layers to int8, activations are quantized on the fly per batch.
+
+    Arguments:
+        model: The float model in eval mode on the CPU.
+    Return:
+        A quantized copy of the model.
+    '''
+
+    return quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+def quantize_static(model:nn.Module, calibration_loader:DataLoader, num_batches:int, backend:str='x86') -> nn.Module:
+    ''' Quantizes weights and activations of all supported layers to int8 (FX graph mode). The ranges of the activations
+    are observed on calibration batches.
+
+    Arguments:
+        model: The float model in eval mode on the CPU.
+        calibration_loader: Dataloader of the calibration images, e.g. the validation set of the fold.
+        num_batches: Maximum number of calibration batches.
+        backend: Quantized engine the model is run with.
+    Return:
+        A quantized copy of the model.
+    '''
+
+    torch.backends.quantized.engine = backend
+    example_inputs, _ = next(iter(calibration_loader))
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping(backend), example_inputs=(example_inputs,))
+
+    with torch.no_grad():
+        for batch_index, (inputs, _) in enumerate(calibration_loader):
+            if batch_index >= num_batches:
+                break
+            prepared(inputs)
+
+    return convert_fx(prepared)
+
+def get_model_size(model:nn.Module) -> int:
+    ''' Gets the size of the serialized state dict of a model in bytes. '''
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+def quantize_checkpoint(run_path:Path, cv:int, checkpoint_name:str, num_calibration_batches:int, iterations:int, image_size:int) -> dict:
+    ''' Quantizes a checkpoint of a ResNet18 or VGG19 classifier dynamically and statically, evaluates all variants on the
+    test set with Eval and measures their CPU latency. The quantized models are stored as TorchScript artifacts
+    with the folded preprocessing (see export.py).
+
+    Arguments:
+        run_path: Location of the run.
+        cv: Number of the CV round, its validation set is used for calibration.
+        checkpoint_name: Name of the checkpoint, e.g. "checkpoint_best".
+        num_calibration_batches: Maximum number of validation batches used for calibration.
+        iterations: Number of timed forward passes per variant.
+        image_size: Height and width of the raw frames of the exported artifacts.
+    Return:
+        Dictionary of the results per variant ("fp32", "int8_dynamic", "int8_static").
+    '''
+
+    config = read_run_config(run_path)
+    if config['model_type'] not in QUANTIZABLE_MODELS:
+        raise ValueError('Quantization is only supported for ' + ', '.join(QUANTIZABLE_MODELS) + ', not "' + config['model_type'] + '".')
+    config.update(compile_model=False, channels_last=False, activation_checkpointing=False, pretrained=False,
+                  mc_dropout_samples=0, tta_views=0)
+
+    device = torch.device('cpu')
+    save_path_cv = Path(run_path) / ('cv_' + str(cv))
+    model, _ = Checkpoint.load_inference_model(checkpoint_name, save_path_cv, device, config, cv)
+    model = model.float().eval()
+
+    cust_data = DatasetPreparation(config)
+    valid_ind, _ = cust_data.get_train_valid_ind(cv - 1)
+    calibration_loader = DataLoader(IVOCT_Dataset(valid_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'])
+    test_loader = DataLoader(IVOCT_Dataset(cust_data.test_ind, cust_data.label_data, cust_data.all_files_paths, config), batch_size=config['batch_size'])
+
+    variants = {
+        'fp32': model,
+        QUANTIZATION_DYNAMIC: quantize_linear_dynamic(model),
+        QUANTIZATION_STATIC: quantize_static(model, calibration_loader, num_calibration_batches),
+    }
+
+    example_inputs = torch.rand(config['batch_size'], 3, 224, 224)
+    results = {}
+    for name, variant in variants.items():
+        eval_test = Eval(test_loader, device, variant, config, save_path_cv, cv)
+        Logger.printer(checkpoint_name + ' ' + name + ':', config, eval_test, if_val_or_test=True)
+        results[name] = {
+            'Accuracy': float(eval_test.metrics[0]),
+            'MCC': float(eval_test.metrics[5]),
+            'AUC': float(eval_test.roc_auc[1] if config['num_out'] == 2 else np.nanmean(eval_test.roc_auc)), # one-vs-rest, macro average for 3 classes
+            'Latency [ms]': measure_latency(variant, example_inputs, iterations) * 1000,
+            'Size [MB]': get_model_size(variant) / 2**20,
+        }
+
+        if name != 'fp32':
+            os.makedirs(save_path_cv / DIR_NAME_EXPORT, exist_ok=True)
+            export_torchscript(PreprocessedModel(variant, (image_size, image_size)).eval(), torch.rand(2, image_size, image_size) * 65535,
+                               save_path_cv / DIR_NAME_EXPORT / (checkpoint_name + '.' + name + TORCHSCRIPT_SUFFIX))
+
+    reference = results['fp32']
+    print('\n{:<14} {:>10} {:>10} {:>10} {:>13} {:>9} {:>10}'.format('Variant', 'd Acc.', 'd MCC', 'd AUC', 'Latency [ms]', 'Speedup', 'Size [MB]'))
+    for name, result in results.items():
+        result.update({
+            'Delta Accuracy': result['Accuracy'] - reference['Accuracy'],
+            'Delta MCC': result['MCC'] - reference['MCC'],
+            'Delta AUC': result['AUC'] - reference['AUC'],
+            'Speedup': reference['Latency [ms]'] / result['Latency [ms]'],
+        })
+        print('{:<14} {:>+10.4f} {:>+10.4f} {:>+10.4f} {:>13.1f} {:>8.2f}x {:>10.1f}'.format(name, result['Delta Accuracy'], result['Delta MCC'],
+              result['Delta AUC'], result['Latency [ms]'], result['Speedup'], result['Size [MB]']))
+
+    file_results = save_path_cv / FILE_NAME_QUANTIZATION_RESULTS
+    all_results = Utils.read_json(file_results) if file_results.exists() else {}
+    all_results[checkpoint_name] = results
+    Utils.write_json(all_results, file_results)
+    return results
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Post-training int8 quantization of ResNet18 and VGG19 classifiers')
+    args.add_argument('-r', '--run', required=True, type=str, help='location of the run, e.g. ./data/train_and_test/group/name')
+    args.add_argument('-cv', '--fold', default=1, type=int, help='CV round of the checkpoint (default: 1)')
+    args.add_argument('-c', '--checkpoint', default='checkpoint_best', type=str, help='checkpoint name (default: checkpoint_best)')
+    args.add_argument('-cb', '--calibration_batches', default=16, type=int, help='validation batches for calibration (default: 16)')
+    args.add_argument('-it', '--iterations', default=10, type=int, help='timed forward passes per variant (default: 10)')
+    args.add_argument('-is', '--image_size', default=224, type=int, help='height and width of the raw frames of the artifacts (default: 224)')
+    args = args.parse_args()
+
+    quantize_checkpoint(Path(args.run), args.fold, args.checkpoint, args.calibration_batches, args.iterations, args.image_size)
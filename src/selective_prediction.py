@@ -0,0 +1,89 @@
+import numpy as np
+
+from metrics import safe_divide
+
+# Selective prediction: the samples are accepted from the most to the least confident, the risk at a coverage is the
+# average loss (e.g. the 0/1 error) of the accepted samples. All confidence scores are "higher is more confident",
+# uncertainties (entropy, MC dropout mutual information, ensemble disagreement, reconstruction error, kNN distance)
+# are passed negated.
+
+def confidences_from_logits(logits:np.ndarray) -> dict:
+    ''' Computes the confidence scores available from the logits (or log-probabilities) alone.
+
+    Arguments:
+        logits: Logits of shape (N, C).
+    Return:
+        Dictionary with the "max_softmax" probability, the "margin" between the two highest probabilities and the
+        "negative_entropy" of the softmax, each of shape (N,).
+    '''
+
+    logits = np.asarray(logits, dtype=np.float64)
+    probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    top_two = -np.partition(-probabilities, 1, axis=1)[:, :2]
+    return {
+        'max_softmax': top_two[:, 0],
+        'margin': top_two[:, 0] - top_two[:, 1],
+        'negative_entropy': np.sum(probabilities * np.log(np.clip(probabilities, 1e-12, None)), axis=1),
+    }
+
+def risk_coverage_curves(confidences, losses) -> dict:
+    ''' Computes the full-resolution risk-coverage curves of several confidence scores with one sort and one cumulative
+    sum: the i-th point accepts the i most confident samples.
+
+    Arguments:
+        confidences: Confidence scores of shape (S, N) for S scores (or (N,) for one score).
+        losses: Losses of shape (N,), e.g. 1 for misclassified and 0 for correct samples.
+    Return:
+        Dictionary with the "coverage" of shape (N,) and the "risk" of shape (S, N) (or (N,)).
+    '''
+
+    confidences = np.asarray(confidences, dtype=np.float64)
+    order = np.argsort(-confidences, axis=-1, kind='stable')
+    losses_sorted = np.asarray(losses, dtype=np.float64)[order]
+    num_accepted = np.arange(1, confidences.shape[-1] + 1)
+    return {'coverage': num_accepted / confidences.shape[-1], 'risk': np.cumsum(losses_sorted, axis=-1) / num_accepted}
+
+def area_under_risk_coverage(confidences, losses, sample_weight=None) -> np.ndarray:
+    ''' Computes the area under the risk-coverage curve (AURC), the mean risk over all coverages. Optional sample
+    weights may have leading dimensions, e.g. (B, N) for B bootstrap resamples, a weight counts the sample as often.
+
+    Arguments:
+        confidences: Confidence scores of shape (N,).
+        losses: Losses of shape (N,).
+        sample_weight: Optional weights of shape (..., N).
+    Return:
+        AURC of shape (...), NaN for resamples with zero total weight.
+    '''
+
+    order = np.argsort(-np.asarray(confidences, dtype=np.float64), kind='stable')
+    losses_sorted = np.asarray(losses, dtype=np.float64)[order]
+    weights = np.ones(len(order)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)[..., order]
+
+    accepted_weight = np.cumsum(weights, axis=-1)
+    risks = safe_divide(np.cumsum(weights * losses_sorted, axis=-1), accepted_weight)
+    return safe_divide(np.sum(weights * risks, axis=-1), accepted_weight[..., -1], fill=np.nan)
+
+def compare_confidence_scores(scores:dict, losses) -> dict:
+    ''' Compares several confidence scores in one call: the curves of all scores and of the optimal score
+    (the negated loss, which accepts the samples with the lowest loss first) are computed together.
+
+    Arguments:
+        scores: Dictionary of confidence scores, each of shape (N,).
+        losses: Losses of shape (N,).
+    Return:
+        Dictionary with the "coverage" (N,), the "risk" curve (N,), the "aurc" and the excess AURC "e_aurc"
+        (AURC - optimal AURC) per score name, and the "optimal_aurc".
+    '''
+
+    names = list(scores)
+    losses = np.asarray(losses, dtype=np.float64)
+    curves = risk_coverage_curves(np.stack([np.asarray(scores[name], dtype=np.float64) for name in names] + [-losses]), losses)
+    aurc = curves['risk'].mean(axis=1)
+    return {
+        'coverage': curves['coverage'],
+        'risk': dict(zip(names, curves['risk'][:-1])),
+        'aurc': {name: float(value) for name, value in zip(names, aurc[:-1])},
+        'e_aurc': {name: float(value - aurc[-1]) for name, value in zip(names, aurc[:-1])},
+        'optimal_aurc': float(aurc[-1]),
+    }
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import torch
+import numpy as np
+
+from pathlib import Path
+from torch.utils.data import DataLoader
+
+from dataset import IVOCT_Dataset
+from dataset_preparation import DatasetPreparation
+from ensemble import FoldEnsemble
+from logit_cache import LogitCache, DIR_NAME_LOGIT_CACHE
+from compilation import get_memory_format
+from prediction_store import save_prediction_store, load_prediction_store
+from predict import read_run_config
+
+TEACHER_LOGITS_PREFIX = 'teacher_'
+
+def get_teacher_path(config) -> Path:
+    return Path('./data/train_and_test', config['teacher_group'], config['teacher_name'])
+
+def get_cv_indices(cust_data) -> np.ndarray:
+    return np.concatenate([np.asarray(indices, dtype=np.int64) for indices in cust_data.train_ind_subdivision])
+
+def teacher_logits_path(teacher_path:Path, teacher_config, checkpoint_name:str, cust_data) -> Path:
+    ''' Gets the cache file of the teacher logits, keyed by the checkpoints of all folds and the dataset and split
+    of the student. A retrained fold, another dataset or another split leads to another file, stale logits are never read.
+
+    Arguments:
+        teacher_path: Location of the teacher run.
+        teacher_config: Configuration of the teacher run.
+        checkpoint_name: Name of the checkpoint of the fold models.
+        cust_data: The DatasetPreparation object of the student run.
+    Return:
+        Path of the .npy file in the logit cache of the teacher run.
+    '''
+
+    digest = hashlib.sha256((teacher_config['c2_or_c3'] + teacher_config['cart_or_pol']).encode())
+    for cv in range(teacher_config['num_cv']):
+        save_path_cv = Path(teacher_path) / ('cv_' + str(cv + 1))
+        try:
+            digest.update(LogitCache(save_path_cv).checkpoint_hash(checkpoint_name).encode())
+        except FileNotFoundError:
+            continue # folds without this checkpoint are not part of the ensemble
+    # The logits are indexed by the file list of the student, the cached images are its cross validation set
+    digest.update('\n'.join(cust_data.all_files_paths).encode())
+    digest.update(np.sort(get_cv_indices(cust_data)).tobytes())
+    digest.update(np.sort(np.asarray(cust_data.test_ind, dtype=np.int64)).tobytes())
+    return Path(teacher_path) / DIR_NAME_LOGIT_CACHE / (TEACHER_LOGITS_PREFIX + checkpoint_name + '_' + digest.hexdigest()[:16] + '.npy')
+
+def get_teacher_logits(cust_data, device, config) -> np.ndarray:
+    ''' Gets the logits of every fold model of the teacher run for all images of the cross validation set.
+    The logits are computed once with the fold ensemble and cached on disk, later runs and epochs read the cache.
+    The images are preprocessed without data augmentation, the test set is never evaluated.
+
+    Arguments:
+        cust_data: The DatasetPreparation object of the student run.
+        device: Hardware the teacher models are evaluated on.
+        config: Configuration of the student run.
+    Return:
+        Memory-mapped array of shape (number of files, folds, classes), NaN for images of the test set.
+    '''
+
+    teacher_path = get_teacher_path(config)
+    teacher_config = read_run_config(teacher_path)
+    if teacher_config['num_out'] != config['num_out'] or teacher_config['c2_or_c3'] != config['c2_or_c3']:
+        raise ValueError('The teacher "' + str(teacher_path) + '" is trained on other classes than the student.')
+    # A teacher that has seen test images of the student would leak them into the soft targets
+    teacher_test_ind = DatasetPreparation(teacher_config).test_ind
+    if not np.array_equal(np.sort(np.asarray(teacher_test_ind, dtype=np.int64)), np.sort(np.asarray(cust_data.test_ind, dtype=np.int64))):
+        raise ValueError('The teacher "' + str(teacher_path) + '" is tested on other images than the student (or its split is not deterministic).')
+
+    path = teacher_logits_path(teacher_path, teacher_config, config['teacher_checkpoint'], cust_data)
+    if os.path.isfile(path):
+        teacher_logits = load_prediction_store(path)
+        if teacher_logits.shape[0] == len(cust_data.all_files_paths):
+            print('Teacher logits loaded from', path)
+            return teacher_logits
+
+    ensemble = FoldEnsemble.from_run(teacher_path, device, teacher_config, config['teacher_checkpoint'], vectorize=teacher_config['ensemble_vectorize'])
+    cv_indices = get_cv_indices(cust_data)
+    dataloader = DataLoader(IVOCT_Dataset(cv_indices, cust_data.label_data, cust_data.all_files_paths, config),
+                            batch_size=config['batch_size'], num_workers=1, pin_memory=True)
+
+    print('Computing teacher logits of', len(ensemble.models), 'folds for', len(cv_indices), 'images...')
+    teacher_logits = np.full((len(cust_data.all_files_paths), len(ensemble.models), config['num_out']), np.nan, dtype=np.float32)
+    position = 0
+    for inputs, _ in dataloader:
+        inputs = inputs.to(device, memory_format=get_memory_format(teacher_config))
+        with torch.set_grad_enabled(False):
+            with torch.cuda.amp.autocast():
+                member_logits = ensemble.forward(inputs)
+        teacher_logits[cv_indices[position:position + inputs.shape[0]]] = member_logits.float().transpose(0, 1).cpu().numpy()
+        position += inputs.shape[0]
+
+    os.makedirs(path.parent, exist_ok=True)
+    save_prediction_store(teacher_logits, path)
+    return load_prediction_store(path)
@@ -0,0 +1,109 @@
+import time
+import torch
+
+from uncertainty import predictive_uncertainty
+
+class TestTimeAugmentation():
+    ''' Test-time augmentation with K deterministic views of every batch. The views are created with batched tensor
+    operations on the device and evaluated in one forward pass of K * batch size images. View 0 is the original image,
+    the other views combine a horizontal flip, a rotation and an intensity jitter drawn from a seeded generator.
+    For polar images the rotation is a circular shift of the columns (angles), for Cartesian (square) images a multiple of 90 degrees.
+    '''
+
+    def __init__(self, num_views:int, polar:bool, seed:int=18, intensity_jitter:float=0.1):
+        ''' Draws the parameters of the views.
+
+        Arguments:
+            self: The TestTimeAugmentation object itself.
+            num_views: Number of views K, including the original image.
+            polar: Whether the images are in polar representation (columns are angles).
+            seed: Seed of the view parameters, the views are identical for every batch and run.
+            intensity_jitter: Maximum relative change of contrast and brightness.
+        Return:
+            The class constructor returns a "TestTimeAugmentation" object.
+        '''
+
+        self.num_views = num_views
+        self.polar = polar
+
+        generator = torch.Generator().manual_seed(seed)
+        self.flips = torch.rand(num_views, generator=generator) < 0.5
+        self.rotations = torch.rand(num_views, generator=generator) # fraction of a full rotation
+        self.contrasts = 1 + intensity_jitter * (2 * torch.rand(num_views, generator=generator) - 1)
+        self.brightnesses = intensity_jitter * (2 * torch.rand(num_views, generator=generator) - 1)
+
+        # View 0 is the original image
+        self.flips[0], self.rotations[0], self.contrasts[0], self.brightnesses[0] = False, 0.0, 1.0, 0.0
+
+    def augment(self, inputs:torch.Tensor) -> torch.Tensor:
+        ''' Creates all views of a batch.
+
+        Arguments:
+            self: The TestTimeAugmentation object.
+            inputs: Batch of images of shape (B, C, H, W) on the device.
+        Return:
+            Views of shape (K * B, C, H, W), view k of image b is at position k * B + b.
+        '''
+
+        views = []
+        for k in range(self.num_views):
+            view = torch.flip(inputs, dims=[-1]) if self.flips[k] else inputs
+            if self.polar:
+                view = torch.roll(view, shifts=int(self.rotations[k] * inputs.shape[-1]), dims=-1)
+            else:
+                view = torch.rot90(view, k=int(self.rotations[k] * 4), dims=[-2, -1])
+            views.append(view * self.contrasts[k].item() + self.brightnesses[k].item())
+        return torch.cat(views)
+
+    def predict(self, model, inputs:torch.Tensor) -> dict:
+        ''' Evaluates a classifier on all views of a batch in one forward pass.
+
+        Arguments:
+            self: The TestTimeAugmentation object.
+            model: The classifier.
+            inputs: Batch of images of shape (B, C, H, W) on the device.
+        Return:
+            Dictionary of uncertainty.predictive_uncertainty with the per sample "variance" of the probability
+            of the predicted class over the views.
+        '''
+
+        outputs = model(self.augment(inputs))
+        view_logits = outputs.reshape((self.num_views, inputs.shape[0]) + tuple(outputs.shape[1:]))
+        summary = predictive_uncertainty(view_logits)
+
+        predicted = summary['mean_probabilities'].argmax(dim=1)
+        view_probabilities = torch.softmax(view_logits.float(), dim=2)
+        summary['variance'] = view_probabilities.gather(2, predicted[None, :, None].expand(self.num_views, -1, 1))[..., 0].var(dim=0, unbiased=False)
+        return summary
+
+    def fit_to_latency_budget(self, model, inputs:torch.Tensor, budget_ms:float) -> int:
+        ''' Reduces the number of views to the largest number whose forward pass of a batch stays within a latency budget.
+        The latency is measured with 1 and with all views and interpolated linearly in between.
+
+        Arguments:
+            self: The TestTimeAugmentation object.
+            model: The classifier.
+            inputs: Example batch of images on the device.
+            budget_ms: Maximum latency of a batch in milliseconds.
+        Return:
+            The number of views used from now on (at least 1).
+        '''
+
+        max_views = self.num_views
+        latencies = []
+        with torch.no_grad():
+            for num_views in [1, max_views]:
+                self.num_views = num_views
+                self.predict(model, inputs) # warm-up
+                if inputs.is_cuda:
+                    torch.cuda.synchronize()
+                start_time = time.perf_counter()
+                self.predict(model, inputs)
+                if inputs.is_cuda:
+                    torch.cuda.synchronize()
+                latencies.append((time.perf_counter() - start_time) * 1000)
+
+        latency_per_view = max(latencies[1] - latencies[0], 1e-6) / max(max_views - 1, 1)
+        self.num_views = int(min(max((budget_ms - latencies[0]) // latency_per_view + 1, 1), max_views))
+        print('Test-time augmentation:', self.num_views, 'views within', budget_ms, 'ms per batch')
+        return self.num_views
@@ -0,0 +1,47 @@
+import torch
+
+def entropy(probabilities:torch.Tensor, dim:int=-1) -> torch.Tensor:
+    return -torch.sum(probabilities * torch.log(probabilities.clamp_min(1e-12)), dim=dim)
+
+def predictive_uncertainty(sample_logits:torch.Tensor) -> dict:
+    ''' Combines the logits of several stochastic forward passes or ensemble members of a batch.
+
+    Arguments:
+        sample_logits: Logits of all samples (passes or members), shape (samples, batch size, classes, ...).
+    Return:
+        Dictionary with per sample "mean_probabilities" (batch size, classes, ...), the predictive "entropy"
+        (entropy of the mean), the "mutual_information" between prediction and sample (entropy of the mean minus mean
+        entropy of the samples) and the "agreement" (fraction of samples voting for the predicted class of the mean).
+    '''
+
+    sample_probabilities = torch.softmax(sample_logits.float(), dim=2)
+    mean_probabilities = sample_probabilities.mean(dim=0)
+    predictive_entropy = entropy(mean_probabilities, dim=1)
+
+    return {
+        'mean_probabilities': mean_probabilities,
+        'entropy': predictive_entropy,
+        'mutual_information': predictive_entropy - entropy(sample_probabilities, dim=2).mean(dim=0),
+        'agreement': (sample_probabilities.argmax(dim=2) == mean_probabilities.argmax(dim=1)).float().mean(dim=0),
+    }
+
+def mc_dropout_predict(model, inputs:torch.Tensor, num_samples:int, seed:int=0) -> dict:
+    ''' Runs Monte Carlo dropout inference in one batched forward pass. The model replicates the batch num_samples times
+    before its first block with dropout (the blocks before run once) and applies seeded dropout masks on the device.
+
+    Arguments:
+        model: Model supporting MC dropout, i.e. with the attribute "num_dropout_seeds" and the forward arguments
+               "seeds" and "mc_samples" (UNetWithoutSkips1, UNetClassifier1).
+        inputs: Batch of inputs on the device.
+        num_samples: Number of stochastic forward passes.
+        seed: Seed of the dropout masks, e.g. the index of the batch.
+    Return:
+        Dictionary of predictive_uncertainty.
+    '''
+
+    if not getattr(model, 'num_dropout_seeds', 0):
+        raise ValueError('The model "' + type(model).__name__ + '" has no dropout blocks for MC dropout.')
+
+    seeds = torch.arange(model.num_dropout_seeds) + seed * model.num_dropout_seeds
+    outputs = model(inputs, seeds=seeds, mc_samples=num_samples)
+    return predictive_uncertainty(outputs.reshape((num_samples, inputs.shape[0]) + tuple(outputs.shape[1:])))
@@ -15,6 +15,8 @@ from collections import OrderedDict
 
 from utils_wandb import Wandb
 from data_loaders import Dataloaders
+from compilation import get_memory_format
+from distillation import distillation_loss
 from sklearn.utils.class_weight import compute_class_weight
 
 
@@ -33,6 +35,10 @@ class Utils():
         # Set location where torch stores its models
         os.environ['TORCH_HOME'] = './data/torch_pretrained_models'
         
+        # Set location where torch.compile caches compiled artifacts, reused after restarts
+        os.environ['TORCHINDUCTOR_CACHE_DIR'] = './data/torch_compile_cache'
+        os.environ['TORCHINDUCTOR_FX_GRAPH_CACHE'] = '1'
+        
         torch.backends.cudnn.enabled = config['use_cuda']
         
         # use deterministic training?
@@ -61,7 +67,7 @@ class Utils():
         return torch.device(config['gpu'])
     
     @staticmethod
-    def train_one_epoch(model, device, loss_function, scaler, optimizer, config, class_weights):
+    def train_one_epoch(model, device, scaler, optimizer, config, class_weights):
 
         if config['auto_encoder']:
             loss_function = nn.MSELoss()
@@ -78,9 +84,9 @@ class Utils():
         num_batches = len(Dataloaders.trainInd)
         print('Training', num_batches, 'batches.')
 
-        for j, (inputs, labels) in enumerate(Dataloaders.trainInd):
+        for j, (inputs, labels, *teacher_logits) in enumerate(Dataloaders.trainInd):
             
-            inputs = inputs.to(device)
+            inputs = inputs.to(device, memory_format=get_memory_format(config))
             labels = labels.squeeze().type(torch.LongTensor).to(device)
             
             optimizer.zero_grad()
@@ -99,6 +105,8 @@ class Utils():
                         # inputs = F.interpolate(first_channel, size=(32, 32), mode='bilinear', align_corners=False)
                         
                         loss_all = loss_function(outputs, inputs)
+                    elif teacher_logits:
+                        loss_all = distillation_loss(outputs, teacher_logits[0].to(device), labels, loss_function, config['distillation_temperature'], config['distillation_alpha'])
                     else:
                         loss_all = loss_function(outputs, labels)
                 